@@ -6,18 +6,31 @@ import hmac
 import json
 import logging
 import os
+import re
 import secrets
 import shutil
 import sqlite3
 import subprocess as sp
 import sys
+import threading
 import time
-from typing import Dict, Optional, Tuple
-
-from fastapi import Depends, FastAPI, HTTPException, Query, Request
+from typing import AsyncIterator, List, Optional, Tuple
+
+import numpy as np
+from fastapi import (
+    Depends,
+    FastAPI,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    WebSocket,
+    WebSocketDisconnect,
+)
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.background import BackgroundTasks
-from starlette.responses import StreamingResponse
+from starlette.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 
 from tools.utils import read_ctoaster_config
 
@@ -28,7 +41,73 @@ read_ctoaster_config()
 if not read_ctoaster_config():
     raise RuntimeError("Failed to read ctoaster configuration")
 
+from tools import exe_store, jobconfig
 from tools.utils import ctoaster_data, ctoaster_jobs, ctoaster_root, ctoaster_version
+from tools.server import (
+    COLUMNS_TYPE,
+    JOB_INDEX_FILENAME,
+    JSON_TYPE,
+    METRICS_CONTENT_TYPE,
+    PRIVATE_REVALIDATE,
+    PUBLIC_SHORT,
+    QUOTA_HARD,
+    QUOTA_SOFT,
+    RUN_QUEUE_FILENAME,
+    SELECTION_FILENAME,
+    USAGE_FILENAME,
+    BlockingPools,
+    Channel,
+    ChannelError,
+    CompressionMiddleware,
+    DiskUsage,
+    HttpMetrics,
+    JobIndex,
+    JobSelection,
+    LoopLagMonitor,
+    MetricsMiddleware,
+    MetricsRegistry,
+    OutputCatalogue,
+    OutputCompactor,
+    ProfilerMiddleware,
+    RunQueue,
+    RequestProfiler,
+    RunScheduler,
+    SeriesCache,
+    SharedRunScheduler,
+    StatusWatcher,
+    ModelMetrics,
+    TTLCache,
+    TailHub,
+    UserStore,
+    arrow_stream,
+    available_series_types,
+    conditional,
+    default_supervisor,
+    downsample,
+    downsample_indices,
+    file_validator,
+    is_series_file,
+    iter_files,
+    job_status,
+    last_lines_offset,
+    launch_model,
+    minmax_buckets,
+    model_executable,
+    negotiate,
+    pack_columns,
+    parse_event_id,
+    parse_size,
+    parse_rows,
+    read_output,
+    read_range,
+    read_run_records,
+    read_status_file,
+    split_lines,
+    stored_file,
+    tree_validator,
+    volume_usage,
+    zip_stream,
+)
 
 # Auth constants (define before use)
 JWT_SECRET = os.environ.get("CTOASTER_JWT_SECRET", "changeme-in-prod")
@@ -59,31 +138,49 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compressed (gzip, or brotli if installed) JSON and text responses
+app.add_middleware(CompressionMiddleware)
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Request profiling, switched on and off with the /admin/profiler
+# endpoint.  Profiles go to CTOASTER_PROFILE_DIR.
+request_profiler = RequestProfiler(
+    os.environ.get("CTOASTER_PROFILE_DIR", os.path.join(ctoaster_jobs, ".profiles"))
+)
+app.add_middleware(ProfilerMiddleware, profiler=request_profiler)
+
+# Prometheus metrics, served at /metrics
+metrics_registry = MetricsRegistry()
+http_metrics = HttpMetrics(metrics_registry)
+app.add_middleware(MetricsMiddleware, metrics=http_metrics)
+
+# Bounded thread pools for blocking work in async handlers, and a
+# monitor of how long the event loop gets blocked for regardless.
+blocking_pools = BlockingPools.from_env()
+loop_lag = LoopLagMonitor()
+
+
+@app.on_event("startup")
+async def _start_loop_lag_monitor():
+    loop_lag.start()
+
+
 # === Auth / user storage ===
+user_store = UserStore(
+    USER_DB_PATH,
+    cache_ttl=float(os.environ.get("CTOASTER_USER_CACHE_TTL", "30")),
+)
+
+# Verified token payloads, so that repeated requests skip the HMAC check
+TOKEN_CACHE_TTL = 60
+token_cache = TTLCache(maxsize=4096, ttl=TOKEN_CACHE_TTL)
+
+
 def init_user_db():
-    dir_path = os.path.dirname(USER_DB_PATH)
-    if dir_path:
-        os.makedirs(dir_path, exist_ok=True)
-    conn = sqlite3.connect(USER_DB_PATH)
-    try:
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                email TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                salt TEXT NOT NULL,
-                created_at TEXT NOT NULL
-            )
-            """
-        )
-        conn.commit()
-    finally:
-        conn.close()
+    user_store.init()
 
 
 def _b64url_encode(data: bytes) -> str:
@@ -118,6 +215,9 @@ def generate_token(user_id: int, email: str) -> str:
 
 
 def decode_token(token: str) -> dict:
+    cached = token_cache.get(token)
+    if cached is not None and cached.get("exp", 0) >= int(time.time()):
+        return cached
     try:
         payload_b64, sig_b64 = token.split(".")
     except ValueError:
@@ -129,49 +229,16 @@ def decode_token(token: str) -> dict:
     payload = json.loads(payload_bytes.decode("utf-8"))
     if payload.get("exp", 0) < int(time.time()):
         raise HTTPException(status_code=401, detail="Token expired")
+    token_cache.set(token, payload, ttl=min(TOKEN_CACHE_TTL, payload["exp"] - time.time()))
     return payload
 
 
 def get_user_by_email(email: str) -> Optional[dict]:
-    conn = sqlite3.connect(USER_DB_PATH)
-    try:
-        cur = conn.execute(
-            "SELECT id, email, password_hash, salt, created_at FROM users WHERE email = ?",
-            (email,),
-        )
-        row = cur.fetchone()
-        if not row:
-            return None
-        return {
-            "id": row[0],
-            "email": row[1],
-            "password_hash": row[2],
-            "salt": row[3],
-            "created_at": row[4],
-        }
-    finally:
-        conn.close()
+    return user_store.get_by_email(email)
 
 
 def get_user_by_id(user_id: int) -> Optional[dict]:
-    conn = sqlite3.connect(USER_DB_PATH)
-    try:
-        cur = conn.execute(
-            "SELECT id, email, password_hash, salt, created_at FROM users WHERE id = ?",
-            (user_id,),
-        )
-        row = cur.fetchone()
-        if not row:
-            return None
-        return {
-            "id": row[0],
-            "email": row[1],
-            "password_hash": row[2],
-            "salt": row[3],
-            "created_at": row[4],
-        }
-    finally:
-        conn.close()
+    return user_store.get_by_id(user_id)
 
 
 def create_user(email: str, password: str) -> dict:
@@ -179,21 +246,13 @@ def create_user(email: str, password: str) -> dict:
     if existing:
         raise HTTPException(status_code=400, detail="User already exists")
     salt_b64, hash_b64 = hash_password(password)
-    conn = sqlite3.connect(USER_DB_PATH)
     try:
-        cur = conn.execute(
-            "INSERT INTO users (email, password_hash, salt, created_at) VALUES (?, ?, ?, ?)",
-            (
-                email,
-                hash_b64,
-                salt_b64,
-                datetime.datetime.utcnow().isoformat() + "Z",
-            ),
+        user_id = user_store.create(
+            email, hash_b64, salt_b64, datetime.datetime.utcnow().isoformat() + "Z"
         )
-        conn.commit()
-        user_id = cur.lastrowid
-    finally:
-        conn.close()
+    except sqlite3.IntegrityError:
+        # Registered by another request in the meantime
+        raise HTTPException(status_code=400, detail="User already exists")
     return {"id": user_id, "email": email}
 
 
@@ -252,8 +311,233 @@ def write_job_owner(job_path: str, user: dict):
         json.dump({"user_id": user["id"], "email": user["email"]}, f)
 
 
-# Track selected job per user to preserve existing UI contract
-selected_job_name_by_user: Dict[int, Optional[str]] = {}
+# Selected job per user, for clients that call /run-job, /pause-job
+# and /delete-job without naming the job.  Kept on the jobs volume so
+# that it doesn't matter which replica a request reaches.
+job_selection = JobSelection(os.path.join(ctoaster_jobs, SELECTION_FILENAME))
+
+
+def target_job_name(user: dict, job_name: Optional[str]) -> str:
+    """
+    The job a request acts on: the one named, or else the user's
+    selected job.
+    """
+    if job_name:
+        validate_job_name(job_name)
+        return job_name
+    selected = job_selection.get(user["id"])
+    if not selected:
+        raise HTTPException(status_code=400, detail="No job selected")
+    return selected
+
+# Model run scheduling: at most CTOASTER_RUN_SLOTS model processes run
+# at once on this pod, optionally capped per user; further runs queue.
+# With CTOASTER_RUN_QUEUE=shared the queue lives on the jobs volume and
+# is shared by all replicas and by stand-alone workers
+# (python -m tools.server.worker); CTOASTER_RUN_SLOTS=0 then makes this
+# pod API-only.
+RUN_QUEUE = os.environ.get("CTOASTER_RUN_QUEUE", "local")
+RUN_SLOTS = int(os.environ.get("CTOASTER_RUN_SLOTS", "1"))
+RUN_SLOTS_PER_USER = os.environ.get("CTOASTER_RUN_SLOTS_PER_USER")
+if RUN_QUEUE == "shared":
+    run_scheduler = SharedRunScheduler(
+        RunQueue(
+            os.path.join(ctoaster_jobs, RUN_QUEUE_FILENAME),
+            per_user_slots=int(RUN_SLOTS_PER_USER) if RUN_SLOTS_PER_USER else None,
+        ),
+        launch_model,
+        slots=RUN_SLOTS,
+    )
+else:
+    run_scheduler = RunScheduler(
+        RUN_SLOTS,
+        launch_model,
+        per_user_slots=int(RUN_SLOTS_PER_USER) if RUN_SLOTS_PER_USER else None,
+    )
+
+# Job metadata index: serves job listings without touching every job
+# directory.  A background pass reconciles it with the filesystem every
+# CTOASTER_INDEX_RECONCILE seconds to pick up changes made by the model.
+INDEX_RECONCILE_SECONDS = float(os.environ.get("CTOASTER_INDEX_RECONCILE", "60"))
+job_index = JobIndex(os.path.join(ctoaster_jobs, JOB_INDEX_FILENAME), ctoaster_jobs)
+
+
+def _reconcile_job_index():
+    while True:
+        time.sleep(INDEX_RECONCILE_SECONDS)
+        job_index.reconcile_all()
+
+
+threading.Thread(target=_reconcile_job_index, name="job-index", daemon=True).start()
+
+# Disk usage accounting: per-job byte totals on the jobs volume, updated
+# when a job changes and reconciled with the filesystem every
+# CTOASTER_USAGE_RECONCILE seconds.  CTOASTER_QUOTA_SOFT and
+# CTOASTER_QUOTA_HARD ("500M", "2G") are the default per-user quotas;
+# /admin/quotas overrides them for individual users.
+USAGE_RECONCILE_SECONDS = float(os.environ.get("CTOASTER_USAGE_RECONCILE", "3600"))
+USAGE_FLUSH_SECONDS = 5.0
+USAGE_RECONCILE_CHECK_SECONDS = min(60.0, USAGE_RECONCILE_SECONDS)
+disk_usage = DiskUsage(
+    os.path.join(ctoaster_jobs, USAGE_FILENAME),
+    ctoaster_jobs,
+    soft_quota=parse_size(os.environ.get("CTOASTER_QUOTA_SOFT")),
+    hard_quota=parse_size(os.environ.get("CTOASTER_QUOTA_HARD")),
+)
+
+
+def _account_disk_usage():
+    # Every replica checks whether a reconcile is due; the first to see
+    # that it is does it, and the others skip it until it is due again.
+    last_check = None
+    while True:
+        time.sleep(USAGE_FLUSH_SECONDS)
+        try:
+            disk_usage.flush()
+            if last_check is None or time.monotonic() - last_check >= USAGE_RECONCILE_CHECK_SECONDS:
+                last_check = time.monotonic()
+                if disk_usage.reconcile_all(min_interval=USAGE_RECONCILE_SECONDS):
+                    # Executables no job links to any more (the jobs were
+                    # deleted, cleaned or given a new build)
+                    pruned = exe_store.prune_store()
+                    if pruned:
+                        logger.info(f"Removed {pruned} unused executables from the store")
+        except Exception as e:
+            # (e.g. the usage database locked for too long): try again later
+            logger.error(f"Disk usage accounting failed: {e}")
+
+
+threading.Thread(target=_account_disk_usage, name="disk-usage", daemon=True).start()
+
+
+def _usage_status_change(event: dict):
+    # A job's size changes the most while it runs; measure it whenever
+    # its status changes (started, paused, finished...).  Events with no
+    # previous status are the watcher's first sight of a job (every job,
+    # at startup): the reconcile pass covers those.
+    if (
+        event["user_id"] is not None
+        and event["previous_status"] is not None
+        and event["status"] != event["previous_status"]
+    ):
+        disk_usage.mark_dirty(event["user_id"], event["job_name"])
+
+
+def check_quota(user: dict) -> Optional[str]:
+    """
+    Refuse a request that would use more space if the user is over
+    their hard quota.
+
+    :return: A warning to pass on if the user is over their soft quota.
+    """
+    state = disk_usage.check(user["id"])
+    if state == QUOTA_HARD:
+        raise HTTPException(
+            status_code=507,
+            detail="Disk quota exceeded: delete some jobs before creating or running more",
+        )
+    if state == QUOTA_SOFT:
+        return "You are over your disk quota soft limit: please delete jobs you no longer need"
+    return None
+
+# Job status watcher: one per process, publishing status transitions
+# and progress to /job-events subscribers.  CTOASTER_STATUS_WATCH is
+# "inotify", "poll" or "auto" (polling on network filesystems).
+status_watcher = StatusWatcher(
+    ctoaster_jobs, mode=os.environ.get("CTOASTER_STATUS_WATCH", "auto")
+)
+
+
+def _index_status_change(event: dict):
+    if event["user_id"] is not None:
+        job_index.refresh(event["user_id"], event["job_name"])
+
+
+status_watcher.add_listener(_index_status_change)
+status_watcher.add_listener(_usage_status_change)
+status_watcher.start()
+
+# Parsed time series output, cached as NumPy arrays on the jobs volume
+# and updated incrementally as the model appends to the files.
+series_cache = SeriesCache(
+    os.environ.get(
+        "CTOASTER_SERIES_CACHE", os.path.join(ctoaster_jobs, ".cache", "series")
+    )
+)
+
+# Shared tailers for the streaming endpoints: one per followed file.
+tail_hub = TailHub(pools=blocking_pools)
+
+
+def job_run_finished(user_id: int, job_name: str, job_path: str) -> bool:
+    """
+    Whether a job has stopped producing output: it is not running, and
+    not queued or starting either.
+    """
+    if job_status(job_path) == "RUNNING":
+        return False
+    return not (
+        run_scheduler.is_running(user_id, job_name)
+        or run_scheduler.queue_position(user_id, job_name) is not None
+    )
+
+# Output files of each job, listed from the output/<module> directories.
+output_catalogue = OutputCatalogue(series_cache)
+
+# Compaction: the outputs of jobs that have been COMPLETE for
+# CTOASTER_COMPACT_AFTER seconds ("off" to never compact) are
+# compressed in the background; reads decompress them on the fly.
+# CTOASTER_COMPACT_CODEC is "gzip" or "zstd" (the default, if the
+# zstandard module is installed).
+COMPACT_AFTER = os.environ.get("CTOASTER_COMPACT_AFTER", "3600")
+COMPACT_INTERVAL_SECONDS = 600.0
+
+
+def _compact_outputs():
+    compactor = OutputCompactor(series_cache, codec=os.environ.get("CTOASTER_COMPACT_CODEC") or None)
+    after = float(COMPACT_AFTER)
+    while True:
+        time.sleep(COMPACT_INTERVAL_SECONDS)
+        now = time.time()
+        try:
+            jobs = job_index.with_status("COMPLETE")
+        except Exception as e:
+            logger.error(f"Listing jobs to compact failed: {e}")
+            continue
+        for job in jobs:
+            try:
+                finished = job["status_mtime"] or job["updated_at"]
+                if now - finished < after or compactor.is_compacted(job["path"], since=finished):
+                    continue
+                if compactor.compact_job(job["path"])["files"]:
+                    disk_usage.mark_dirty(job["user_id"], job["name"])
+            except Exception as e:
+                logger.error(f"Compacting {job['path']} failed: {e}")
+
+
+if COMPACT_AFTER.strip().lower() != "off":
+    threading.Thread(target=_compact_outputs, name="compaction", daemon=True).start()
+
+
+def resolve_output_file(job_path: str, data_file_name: str) -> str:
+    """
+    Path of a job's output file ("module/name", or a bare name that is
+    looked for in output/biogem first).
+    """
+    data_file_path = output_catalogue.resolve(job_path, data_file_name)
+    if data_file_path is None:
+        raise HTTPException(status_code=404, detail="Data file not found")
+    return data_file_path
+
+
+def resolve_series_file(job_path: str, data_file_name: str) -> str:
+    """
+    As resolve_output_file, for the ASCII time series files that can be plotted.
+    """
+    data_file_path = resolve_output_file(job_path, data_file_name)
+    if not is_series_file(os.path.basename(data_file_path)):
+        raise HTTPException(status_code=400, detail="Data file is not a time series file")
+    return data_file_path
 
 init_user_db()
 
@@ -262,6 +546,160 @@ init_user_db()
 def healthz():
     return {"ok": True}
 
+
+# === Metrics ===
+# If CTOASTER_METRICS_TOKEN is set, scrapers must send it as a bearer token.
+METRICS_TOKEN = os.environ.get("CTOASTER_METRICS_TOKEN")
+
+model_metrics = ModelMetrics(metrics_registry, ctoaster_jobs)
+event_subscribers = metrics_registry.gauge(
+    "ctoaster_event_subscribers",
+    "Clients following job output (tail) or status changes (status), and /ws subscriptions (ws).",
+    ("kind",),
+)
+ws_connections = metrics_registry.gauge(
+    "ctoaster_ws_connections", "Open /ws connections (each with any number of subscriptions)."
+)
+followed_files = metrics_registry.gauge(
+    "ctoaster_followed_files", "Files being tailed for streaming clients."
+)
+jobs_volume = metrics_registry.gauge(
+    "ctoaster_jobs_volume_bytes", "Size and use of the jobs volume.", ("kind",)
+)
+pool_threads = metrics_registry.gauge(
+    "ctoaster_pool_threads",
+    "Blocking work thread pools: size, and tasks running and waiting.",
+    ("pool", "kind"),
+)
+loop_lag_seconds = metrics_registry.gauge(
+    "ctoaster_event_loop_lag_seconds",
+    "How late event loop timers fire, over the recent past.",
+    ("quantile",),
+)
+
+default_supervisor().add_listener(model_metrics.count_exit)
+
+
+def _collect_metrics():
+    model_metrics.update(
+        run_scheduler.running_count(),
+        run_scheduler.running_paths(),
+        queued=run_scheduler.queued_count(),
+    )
+
+    event_subscribers.set(tail_hub.follower_count(), kind="tail")
+    event_subscribers.set(status_watcher.subscriber_count(), kind="status")
+    event_subscribers.set(sum(c.subscription_count() for c in ws_channels), kind="ws")
+    ws_connections.set(len(ws_channels))
+    followed_files.set(tail_hub.tail_count())
+
+    usage = volume_usage(ctoaster_jobs)
+    if usage:
+        for kind, value in usage.items():
+            jobs_volume.set(value, kind=kind)
+
+    for pool, stats in blocking_pools.stats().items():
+        for kind, value in stats.items():
+            pool_threads.set(value, pool=pool, kind=kind)
+
+    lag = loop_lag.stats()
+    for quantile in ("p50", "p99", "max"):
+        if lag[quantile] is not None:
+            loop_lag_seconds.set(lag[quantile], quantile=quantile)
+
+
+metrics_registry.add_collector(_collect_metrics)
+
+
+@app.get("/metrics")
+def metrics(request: Request):
+    """
+    Metrics in the Prometheus text format.
+    """
+    if METRICS_TOKEN:
+        auth_header = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(auth_header, f"Bearer {METRICS_TOKEN}"):
+            raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return PlainTextResponse(metrics_registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+# === Admin ===
+# Admin endpoints are only available if CTOASTER_ADMIN_TOKEN is set, to
+# clients sending it as a bearer token.
+ADMIN_TOKEN = os.environ.get("CTOASTER_ADMIN_TOKEN")
+
+
+def require_admin(request: Request):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled")
+    auth_header = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(auth_header, f"Bearer {ADMIN_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+@app.get("/admin/profiler", dependencies=[Depends(require_admin)])
+def get_profiler_settings():
+    request_profiler.reload()
+    return {"settings": request_profiler.settings, "active": request_profiler.active}
+
+
+@app.put("/admin/profiler", dependencies=[Depends(require_admin)])
+async def update_profiler_settings(request: Request):
+    """
+    Change the profiler settings (for all replicas): "enabled",
+    "routes" (route templates to profile every request of), "sample_rate"
+    (fraction of other requests to profile) and "interval" (seconds
+    between samples).
+    """
+    try:
+        settings = await blocking_pools.run("io", request_profiler.update, await request.json())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"settings": settings}
+
+
+@app.get("/admin/profiles", dependencies=[Depends(require_admin)])
+def list_profiles():
+    return {"profiles": request_profiler.list()}
+
+
+@app.get("/admin/profiles/{name}", dependencies=[Depends(require_admin)])
+def get_profile(name: str):
+    """
+    A profile: collapsed stacks (.collapsed) or speedscope JSON (.speedscope.json).
+    """
+    path = request_profiler.path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    media_type = "application/json" if name.endswith(".json") else "text/plain"
+    return FileResponse(path, media_type=media_type, filename=name)
+
+@app.get("/admin/usage", dependencies=[Depends(require_admin)])
+def get_all_usage():
+    return {"users": disk_usage.totals()}
+
+
+@app.put("/admin/quotas/{user_id}", dependencies=[Depends(require_admin)])
+async def set_user_quota(user_id: int, request: Request):
+    """
+    Override a user's quotas: "soft" and "hard" sizes ("500M", "2G";
+    null for no limit).
+    """
+    data = await request.json()
+    try:
+        soft = parse_size(data.get("soft"))
+        hard = parse_size(data.get("hard"))
+    except (TypeError, ValueError, AttributeError):
+        raise HTTPException(status_code=400, detail="Invalid quota size")
+    await blocking_pools.run("io", disk_usage.set_quota, user_id, soft, hard)
+    return {"user_id": user_id, "soft_quota_bytes": soft, "hard_quota_bytes": hard}
+
+
+@app.delete("/admin/quotas/{user_id}", dependencies=[Depends(require_admin)])
+def clear_user_quota(user_id: int):
+    disk_usage.clear_quota(user_id)
+    return {"user_id": user_id, "message": "Quotas reset to the defaults"}
+
 @app.get("/")
 def root():
     return {"ok": True}
@@ -273,7 +711,7 @@ async def register(request: Request):
     password = data.get("password", "")
     if not email or not password:
         raise HTTPException(status_code=400, detail="Email and password are required")
-    user = create_user(email, password)
+    user = await blocking_pools.run("hash", create_user, email, password)
     token = generate_token(user["id"], user["email"])
     return {"user": user, "token": token}
 
@@ -285,8 +723,10 @@ async def login(request: Request):
     password = data.get("password", "")
     if not email or not password:
         raise HTTPException(status_code=400, detail="Email and password are required")
-    user = get_user_by_email(email)
-    if not user or not verify_password(password, user["salt"], user["password_hash"]):
+    user = await blocking_pools.run("io", get_user_by_email, email)
+    if not user or not await blocking_pools.run(
+        "hash", verify_password, password, user["salt"], user["password_hash"]
+    ):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     token = generate_token(user["id"], user["email"])
     return {"user": {"id": user["id"], "email": user["email"]}, "token": token}
@@ -297,21 +737,56 @@ def me(current_user=Depends(get_current_user)):
     return {"user": {"id": current_user["id"], "email": current_user["email"]}}
 
 
+@app.get("/usage")
+def get_usage(current_user=Depends(get_current_user)):
+    """
+    Space used by the current user's jobs on the jobs volume, with
+    their quotas and a per-job breakdown (largest first).  Figures are
+    updated when jobs change, so may lag a running job by a little.
+    """
+    return disk_usage.usage(current_user["id"])
+
+
 @app.get("/jobs")
-def list_jobs(current_user=Depends(get_current_user)):
+def list_jobs(
+    status: Optional[str] = Query(None),
+    sort: str = Query("name"),
+    order: str = Query("asc"),
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    current_user=Depends(get_current_user),
+):
+    """
+    List the user's jobs from the job index.  status is a comma-separated
+    list of statuses to filter on; sort is one of name, status, created
+    or updated.
+    """
     try:
         if ctoaster_jobs is None:
             raise ValueError("ctoaster_jobs is not defined")
 
-        user_root = safe_join(ctoaster_jobs, str(current_user["id"]))
-        os.makedirs(user_root, exist_ok=True)
-        job_list = os.listdir(user_root)
-        jobs = []
-        for job in job_list:
-            job_path = safe_join(user_root, job)
-            if os.path.isdir(job_path) and job.strip() != "MODELS":
-                jobs.append({"name": job, "path": job_path})
-        return {"jobs": jobs}
+        job_index.ensure_reconciled(current_user["id"])
+        statuses = [s.strip() for s in status.split(",") if s.strip()] if status else None
+        try:
+            entries, total = job_index.list(
+                current_user["id"], statuses, sort, order, limit, offset
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        jobs = [
+            {
+                "name": entry["name"],
+                "path": entry["path"],
+                "status": entry["status"],
+                "run_length": entry["run_length"],
+                "t100": "true" if entry["t100"] else "false",
+                "updated_at": entry["updated_at"],
+            }
+            for entry in entries
+        ]
+        return {"jobs": jobs, "total": total}
+    except HTTPException:
+        raise
     except Exception as e:
         return {"error": str(e)}
 
@@ -324,32 +799,21 @@ def get_job_details(job_name: str, current_user=Depends(get_current_user)):
 
         job_path = get_user_job_path(current_user, job_name)
 
-        if not os.path.isdir(job_path):
+        entry = job_index.refresh(current_user["id"], job_name)
+        if entry is None:
             logger.info(f"Job not found: {job_path}")
             return {"error": "Job not found"}
 
-        selected_job_name_by_user[current_user["id"]] = job_name
+        job_selection.set(current_user["id"], job_name)
 
-        # Determine job status
-        status = "UNCONFIGURED"
-        if os.path.exists(os.path.join(job_path, "data_genie")):
-            status = "RUNNABLE"
-            if os.path.exists(os.path.join(job_path, "status")):
-                with open(os.path.join(job_path, "status")) as f:
-                    status_line = f.readline().strip()
-                    status = status_line.split()[0] if status_line else "ERROR"
+        status = entry["status"]
+        run_length = entry["run_length"]
+        t100 = bool(entry["t100"])
 
-        # Determine run length and T100 from the config file
-        run_length = "n/a"
-        t100 = False
-        config_path = os.path.join(job_path, "config", "config")
-        if os.path.exists(config_path):
-            with open(config_path) as f:
-                for line in f:
-                    if line.startswith("run_length:"):
-                        run_length = line.split(":")[1].strip()
-                    if line.startswith("t100:"):
-                        t100 = line.split(":")[1].strip().lower() == "true"
+        # Runs waiting for a scheduler slot
+        queue_position = run_scheduler.queue_position(current_user["id"], job_name)
+        if queue_position is not None:
+            status = "QUEUED"
 
         job_details = {
             "name": job_name,
@@ -357,6 +821,7 @@ def get_job_details(job_name: str, current_user=Depends(get_current_user)):
             "status": status,
             "run_length": run_length,
             "t100": "true" if t100 else "false",
+            "queue_position": queue_position,
         }
 
         logger.info(f"Job details retrieved: {job_details}")
@@ -368,11 +833,10 @@ def get_job_details(job_name: str, current_user=Depends(get_current_user)):
 
 
 @app.delete("/delete-job")
-def delete_job(current_user=Depends(get_current_user)):
+@app.delete("/delete-job/{job_name}")
+def delete_job(job_name: Optional[str] = None, current_user=Depends(get_current_user)):
     try:
-        selected_job_name = selected_job_name_by_user.get(current_user["id"])
-        if not selected_job_name:
-            raise HTTPException(status_code=400, detail="No job selected")
+        selected_job_name = target_job_name(current_user, job_name)
 
         if ctoaster_jobs is None:
             raise ValueError("ctoaster_jobs is not defined")
@@ -383,13 +847,19 @@ def delete_job(current_user=Depends(get_current_user)):
             logger.info(f"Job not found: {job_path}")
             return {"error": "Job not found"}
 
-        # Delete the job directory
+        run_scheduler.cancel(current_user["id"], selected_job_name)
+
+        # Delete the job directory (and the series cache's copies of its outputs)
+        series_cache.invalidate_job(job_path)
         shutil.rmtree(job_path)
+        job_index.remove(current_user["id"], selected_job_name)
+        disk_usage.remove(current_user["id"], selected_job_name)
+        output_catalogue.forget(job_path)
 
         local_job_name = selected_job_name
 
         # Clear the selected job name
-        selected_job_name_by_user[current_user["id"]] = None
+        job_selection.clear(current_user["id"], selected_job_name)
 
         logger.info(f"Job deleted: {job_path}")
         return {"message": f"Job '{local_job_name}' deleted successfully"}
@@ -433,35 +903,46 @@ async def add_job(request: Request, current_user=Depends(get_current_user)):
         raise ValueError("ctoaster_jobs is not defined")
 
     job_dir = get_user_job_path(current_user, job_name)
-    if os.path.exists(job_dir):
-        raise HTTPException(status_code=400, detail="Job already exists")
+    warning = await blocking_pools.run("io", check_quota, current_user)
 
-    # Create the job directory
-    try:
-        os.makedirs(os.path.join(job_dir, "config"))
-    except Exception as e:
-        raise HTTPException(
-            status_code=500, detail=f"Could not create job directory: {str(e)}"
-        )
+    # Create the job files in the I/O pool
+    def create_job():
+        if os.path.exists(job_dir):
+            raise HTTPException(status_code=400, detail="Job already exists")
 
-    # Create the main config file
-    config_path = os.path.join(job_dir, "config", "config")
-    try:
-        with open(config_path, "w") as config_file:
-            config_file.write(
-                "base_config: ?\nuser_config: ?\nrun_length: ?\nt100: ?\n"
+        # Create the job directory
+        try:
+            os.makedirs(os.path.join(job_dir, "config"))
+        except Exception as e:
+            raise HTTPException(
+                status_code=500, detail=f"Could not create job directory: {str(e)}"
             )
-    except Exception as e:
-        raise HTTPException(
-            status_code=500, detail=f"Could not write configuration file: {str(e)}"
-        )
 
-    # Tag ownership
-    write_job_owner(job_dir, current_user)
+        # Create the main config file
+        config_path = os.path.join(job_dir, "config", "config")
+        try:
+            with open(config_path, "w") as config_file:
+                config_file.write(
+                    "base_config: ?\nuser_config: ?\nrun_length: ?\nt100: ?\n"
+                )
+        except Exception as e:
+            raise HTTPException(
+                status_code=500, detail=f"Could not write configuration file: {str(e)}"
+            )
+
+        # Tag ownership
+        write_job_owner(job_dir, current_user)
+        job_index.refresh(current_user["id"], job_name, force=True)
+        disk_usage.measure(current_user["id"], job_name)
+
+    await blocking_pools.run("io", create_job)
 
-    selected_job_name_by_user[current_user["id"]] = job_name
+    await blocking_pools.run("io", job_selection.set, current_user["id"], job_name)
 
-    return {"status": "success", "message": f"Job '{job_name}' created successfully"}
+    response = {"status": "success", "message": f"Job '{job_name}' created successfully"}
+    if warning:
+        response["warning"] = warning
+    return response
 
 
 @app.get("/run-segments/{job_name}")
@@ -515,9 +996,12 @@ def get_run_segments(job_name: str, current_user=Depends(get_current_user)):
 
 
 @app.get("/base-configs")
-def get_base_configs():
+def get_base_configs(request: Request, response: Response):
     try:
         base_configs_dir = os.path.join(ctoaster_data, "base-configs")
+        not_modified = conditional(request, response, file_validator(base_configs_dir), PUBLIC_SHORT)
+        if not_modified:
+            return not_modified
         base_configs = [
             f.rpartition(".")[0]
             for f in os.listdir(base_configs_dir)
@@ -532,9 +1016,12 @@ def get_base_configs():
 
 
 @app.get("/user-configs")
-def get_user_configs():
+def get_user_configs(request: Request, response: Response):
     try:
         user_configs_dir = os.path.join(ctoaster_data, "user-configs")
+        not_modified = conditional(request, response, tree_validator(user_configs_dir), PUBLIC_SHORT)
+        if not_modified:
+            return not_modified
         user_configs = []
         for root, _, files in os.walk(user_configs_dir):
             for file in files:
@@ -550,31 +1037,31 @@ def get_user_configs():
 
 
 @app.get("/completed-jobs")
-async def get_completed_jobs(current_user=Depends(get_current_user)):
+def get_completed_jobs(
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    current_user=Depends(get_current_user),
+):
     try:
         if ctoaster_jobs is None:
             raise ValueError("ctoaster_jobs is not defined")
 
-        completed_jobs = []
-        user_root = safe_join(ctoaster_jobs, str(current_user["id"]))
-        os.makedirs(user_root, exist_ok=True)
-        for job_name in os.listdir(user_root):
-            job_path = safe_join(user_root, job_name)
-            if os.path.isdir(job_path):
-                status_file = os.path.join(job_path, "status")
-                if os.path.exists(status_file):
-                    status_parts = read_status_file(job_path)
-                    if status_parts and status_parts[0] == "COMPLETE":
-                        completed_jobs.append(job_name)
-
-        return {"completed_jobs": completed_jobs}
+        job_index.ensure_reconciled(current_user["id"])
+        entries, total = job_index.list(
+            current_user["id"], ["COMPLETE"], limit=limit, offset=offset
+        )
+        completed_jobs = [entry["name"] for entry in entries]
+
+        return {"completed_jobs": completed_jobs, "total": total}
     except Exception as e:
         logger.error(f"Error fetching completed jobs: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/setup/{job_name}")
-def get_setup(job_name: str, current_user=Depends(get_current_user)):
+def get_setup(
+    job_name: str, request: Request, response: Response, current_user=Depends(get_current_user)
+):
     try:
         if ctoaster_jobs is None or ctoaster_data is None:
             raise ValueError("ctoaster_jobs or ctoaster_data is not defined")
@@ -589,6 +1076,10 @@ def get_setup(job_name: str, current_user=Depends(get_current_user)):
         config_path = os.path.join(job_path, "config", "config")
         if not os.path.exists(config_path):
             raise ValueError("Config file not found")
+        mods_path = os.path.join(job_path, "config", "config_mods")
+        not_modified = conditional(request, response, file_validator(config_path, mods_path))
+        if not_modified:
+            return not_modified
 
         setup_details = {
             "base_config": "",
@@ -611,7 +1102,6 @@ def get_setup(job_name: str, current_user=Depends(get_current_user)):
                     setup_details["restart_from"] = line.split(":", 1)[1].strip()
 
         # Read modifications
-        mods_path = os.path.join(job_path, "config", "config_mods")
         if os.path.exists(mods_path):
             with open(mods_path) as f:
                 setup_details["modifications"] = f.read().strip()
@@ -631,15 +1121,6 @@ async def update_setup(job_name: str, request: Request, current_user=Depends(get
 
         job_path = get_user_job_path(current_user, job_name)
 
-        if not os.path.isdir(job_path):
-            logger.info(f"Job not found: {job_path}")
-            return {"error": "Job not found"}
-
-        # Update the main config file
-        config_path = os.path.join(job_path, "config", "config")
-        if not os.path.exists(config_path):
-            raise ValueError("Config file not found")
-
         # Prepare the updated configuration data
         base_config = data.get("base_config", "")
         user_config = data.get("user_config", "")
@@ -649,66 +1130,80 @@ async def update_setup(job_name: str, request: Request, current_user=Depends(get
         if restart == "":
             restart = None  # Handle empty string as None
 
-        with open(config_path, "w") as f:
-            if base_config:
-                f.write(
-                    f"base_config_dir: {os.path.join(ctoaster_data, 'base-configs')}\n"
-                )
-                f.write(f"base_config: {base_config}\n")
-            if user_config:
-                f.write(
-                    f"user_config_dir: {os.path.join(ctoaster_data, 'user-configs')}\n"
-                )
-                f.write(f"user_config: {user_config}\n")
-            if restart is not None:
-                f.write(f"restart: {restart}\n")
-            else:
-                f.write("restart: \n")
-            today = datetime.datetime.today().strftime("%Y-%m-%d %H:%M:%S")
-            f.write(f"config_date: {today}\n")
-            f.write(f"run_length: {run_length}\n")
-
-        # Update the modifications file
-        mods_path = os.path.join(job_path, "config", "config_mods")
-        if modifications:
-            with open(mods_path, "w") as f:
-                f.write(modifications)
-        elif os.path.exists(mods_path):
-            os.remove(mods_path)
-
-        # Regenerate the namelists (use per-user jobs root)
+        # Update the config files (file system work, off the loop)
         user_jobs_root = safe_join(ctoaster_jobs, str(current_user["id"]))
-        os.makedirs(user_jobs_root, exist_ok=True)
-        new_job_script = os.path.join(ctoaster_root, "tools", "new-job.py")
-        cmd = [
-            sys.executable,
-            new_job_script,
-            "--gui",
-            "-b",
+        mods_path = os.path.join(job_path, "config", "config_mods")
+        found = await blocking_pools.run(
+            "io",
+            _write_setup,
+            job_path,
+            user_jobs_root,
             base_config,
-            "-u",
             user_config,
-            "-j",
-            user_jobs_root,
-            job_name,
-            str(run_length),
-        ]
-        if modifications:
-            cmd.extend(["-m", mods_path])
-        if restart:
-            cmd.extend(["--restart", restart])
-
-        try:
-            res = sp.check_output(cmd, stderr=sp.STDOUT, text=True).strip()
-        except sp.CalledProcessError as e:
-            res = f"ERR:Failed to run new-job script with error {e.output}"
-            raise ValueError(res)
-        except Exception as e:
-            res = f"ERR:Unexpected error {e}"
-            raise ValueError(res)
+            modifications,
+            run_length,
+            restart,
+        )
+        if not found:
+            logger.info(f"Job not found: {job_path}")
+            return {"error": "Job not found"}
 
-        if not res.startswith("OK"):
-            raise ValueError(res[4:])
+        # Regenerate the namelists (use per-user jobs root)
+        if not jobconfig.needs_version_repo():
+            # In-process, with the defaults namelists etc. cached
+            try:
+                await blocking_pools.run(
+                    "io",
+                    jobconfig.configure_job,
+                    job_name,
+                    int(run_length),
+                    user_jobs_root,
+                    base_config=base_config,
+                    user_config=user_config,
+                    config_mods=mods_path if modifications else None,
+                    restart=restart,
+                    gui=True,
+                )
+            except jobconfig.JobConfigError as e:
+                raise ValueError(str(e))
+        else:
+            # Other model versions are set up from their own repository
+            # clone, which new-job.py switches to
+            new_job_script = os.path.join(ctoaster_root, "tools", "new-job.py")
+            cmd = [
+                sys.executable,
+                new_job_script,
+                "--gui",
+                "-b",
+                base_config,
+                "-u",
+                user_config,
+                "-j",
+                user_jobs_root,
+                job_name,
+                str(run_length),
+            ]
+            if modifications:
+                cmd.extend(["-m", mods_path])
+            if restart:
+                cmd.extend(["--restart", restart])
+
+            try:
+                res = (
+                    await blocking_pools.run("subprocess", sp.check_output, cmd, stderr=sp.STDOUT, text=True)
+                ).strip()
+            except sp.CalledProcessError as e:
+                res = f"ERR:Failed to run new-job script with error {e.output}"
+                raise ValueError(res)
+            except Exception as e:
+                res = f"ERR:Unexpected error {e}"
+                raise ValueError(res)
+
+            if not res.startswith("OK"):
+                raise ValueError(res[4:])
+
+        await blocking_pools.run("io", job_index.refresh, current_user["id"], job_name, True)
+        disk_usage.mark_dirty(current_user["id"], job_name)
 
         return {"message": "Setup updated successfully"}
     except Exception as e:
@@ -716,112 +1211,140 @@ async def update_setup(job_name: str, request: Request, current_user=Depends(get
         return {"error": str(e)}
 
 
-## Utility function used in run_job
-def read_status_file(job_dir):
+def _write_setup(
+    job_path: str,
+    user_jobs_root: str,
+    base_config: str,
+    user_config: str,
+    modifications: str,
+    run_length,
+    restart: Optional[str],
+) -> bool:
     """
-    Attempts to read the status file for a job, handling potential issues on Windows where
-    the file might be locked by another process.
+    Write a job's config and config_mods files.
 
-    :param job_dir: The job directory containing the 'status' file.
-    :return: A list containing the status information or None if the file could not be read.
+    :return: False if the job doesn't exist.
     """
-    status = None
-    safety = 0
-    while not status and safety < 1000:
-        try:
-            if safety != 0:
-                time.sleep(0.001)
-            safety += 1
-            with open(os.path.join(job_dir, "status")) as fp:
-                status = fp.readline().strip().split()
-        except IOError:
-            pass  # You may log the error here if needed
-    if safety == 1000:
-        print("Failed to read the status file after multiple attempts.")
-    return status
+    if not os.path.isdir(job_path):
+        return False
 
+    # Update the main config file
+    config_path = os.path.join(job_path, "config", "config")
+    if not os.path.exists(config_path):
+        raise ValueError("Config file not found")
 
-@app.post("/run-job")
-async def run_job(current_user=Depends(get_current_user)):
-    try:
-        selected_job_name = selected_job_name_by_user.get(current_user["id"])
-        if not selected_job_name:
-            raise HTTPException(status_code=400, detail="No job selected")
-
-        if ctoaster_jobs is None:
-            raise ValueError("ctoaster_jobs is not defined")
+    with open(config_path, "w") as f:
+        if base_config:
+            f.write(
+                f"base_config_dir: {os.path.join(ctoaster_data, 'base-configs')}\n"
+            )
+            f.write(f"base_config: {base_config}\n")
+        if user_config:
+            f.write(
+                f"user_config_dir: {os.path.join(ctoaster_data, 'user-configs')}\n"
+            )
+            f.write(f"user_config: {user_config}\n")
+        if restart is not None:
+            f.write(f"restart: {restart}\n")
+        else:
+            f.write("restart: \n")
+        today = datetime.datetime.today().strftime("%Y-%m-%d %H:%M:%S")
+        f.write(f"config_date: {today}\n")
+        f.write(f"run_length: {run_length}\n")
+
+    # Update the modifications file
+    mods_path = os.path.join(job_path, "config", "config_mods")
+    if modifications:
+        with open(mods_path, "w") as f:
+            f.write(modifications)
+    elif os.path.exists(mods_path):
+        os.remove(mods_path)
+
+    os.makedirs(user_jobs_root, exist_ok=True)
+    return True
+
+
+def _check_runnable(job_path: str, job_name: str) -> None:
+    """
+    :raises HTTPException: unless the job is in a runnable state and the
+        model executable is there.
+    """
+    if not os.path.isdir(job_path):
+        raise HTTPException(status_code=404, detail="Job not found")
 
-        job_path = get_user_job_path(current_user, selected_job_name)
+    # Check if the job is in a runnable state
+    status = "UNCONFIGURED"
+    if os.path.exists(os.path.join(job_path, "data_genie")):
+        status = "RUNNABLE"
+        if os.path.exists(os.path.join(job_path, "status")):
+            # Use the read_status_file function to read the status
+            status_parts = read_status_file(job_path)
+            if status_parts:
+                status = status_parts[0]  # The first element is the status
+            else:
+                status = "ERROR"
 
-        if not os.path.isdir(job_path):
-            raise HTTPException(status_code=404, detail="Job not found")
+    if status not in ["RUNNABLE", "PAUSED"]:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Job '{job_name}' is not configured or runnable.",
+        )
 
-        # Check if the job is in a runnable state
-        status = "UNCONFIGURED"
-        if os.path.exists(os.path.join(job_path, "data_genie")):
-            status = "RUNNABLE"
-            if os.path.exists(os.path.join(job_path, "status")):
-                # Use the read_status_file function to read the status
-                status_parts = read_status_file(job_path)
-                if status_parts:
-                    status = status_parts[0]  # The first element is the status
-                else:
-                    status = "ERROR"
+    # Check if executable exists
+    exe = model_executable()
+    if not os.path.exists(exe):
+        raise HTTPException(
+            status_code=500, detail=f"Executable not found at {exe}"
+        )
 
-        if status not in ["RUNNABLE", "PAUSED"]:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Job '{selected_job_name}' is not configured or runnable.",
-            )
 
-        # Correct path to check for the executable
-        exe = os.path.join(
-            ctoaster_jobs,
-            "MODELS",
-            ctoaster_version,  # Replace with actual version variable or string
-            sys.platform.upper(),  # Dynamically get platform information
-            "ship",
-            "carrotcake.exe",
+@app.post("/run-job")
+@app.post("/run-job/{job_name}")
+async def run_job(
+    job_name: Optional[str] = None,
+    priority: int = Query(0),
+    current_user=Depends(get_current_user),
+):
+    selected_job_name = job_name
+    try:
+        selected_job_name = await blocking_pools.run(
+            "io", target_job_name, current_user, job_name
         )
 
-        # Check if executable exists
-        if not os.path.exists(exe):
-            raise HTTPException(
-                status_code=500, detail=f"Executable not found at {exe}"
-            )
+        if ctoaster_jobs is None:
+            raise ValueError("ctoaster_jobs is not defined")
 
-        # Copy the executable to the job directory
-        runexe = os.path.join(job_path, "carrotcake-ship.exe")
-        if os.path.exists(runexe):
-            os.remove(runexe)
-        shutil.copy(exe, runexe)
+        job_path = get_user_job_path(current_user, selected_job_name)
 
-        # Handle resuming a paused job
-        command_file_path = os.path.join(job_path, "command")
-        if os.path.exists(command_file_path):
-            os.remove(command_file_path)
+        # Check the job and the executable (file system work, off the loop)
+        await blocking_pools.run("io", _check_runnable, job_path, selected_job_name)
 
-        if status == "PAUSED":
-            status_parts = read_status_file(job_path)
-            if status_parts and len(status_parts) >= 4:
-                _, koverall, _, genie_clock = status_parts[:4]
-                # Write the GUI_RESTART command to the command file
-                with open(command_file_path, "w") as command_file:
-                    command_file.write(f"GUI_RESTART {koverall} {genie_clock}\n")
-            else:
-                raise HTTPException(
-                    status_code=500,
-                    detail="Status file does not contain the required parameters to resume the job.",
-                )
+        warning = await blocking_pools.run("io", check_quota, current_user)
 
-        # Start executable and direct stdout and stderr to run.log in job directory
-        log_file_path = os.path.join(job_path, "run.log")
-        with open(log_file_path, "a") as log_file:
-            process = sp.Popen(
-                [runexe], cwd=job_path, stdout=log_file, stderr=sp.STDOUT
+        # Hand the run to the scheduler: it starts now if there is a free
+        # slot, otherwise it waits in the queue.
+        try:
+            queue_position = await blocking_pools.run(
+                "io", run_scheduler.submit, current_user["id"], selected_job_name, job_path, priority
             )
-
-        return {"message": f"Job '{selected_job_name}' is now running"}
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        await blocking_pools.run("io", job_index.refresh, current_user["id"], selected_job_name)
+        status_watcher.mark_active(job_path)
+
+        if queue_position is not None:
+            response = {
+                "message": f"Job '{selected_job_name}' is queued at position {queue_position}",
+                "status": "QUEUED",
+                "queue_position": queue_position,
+            }
+        else:
+            response = {"message": f"Job '{selected_job_name}' is now running", "status": "RUNNING"}
+        if warning:
+            response["warning"] = warning
+        return response
+    except HTTPException:
+        raise
     except FileNotFoundError as fnfe:
         error_message = f"File not found error: {str(fnfe)}"
         logger.error(error_message)
@@ -833,11 +1356,11 @@ async def run_job(current_user=Depends(get_current_user)):
 
 
 @app.post("/pause-job")
-async def pause_job(current_user=Depends(get_current_user)):
+@app.post("/pause-job/{job_name}")
+def pause_job(job_name: Optional[str] = None, current_user=Depends(get_current_user)):
+    selected_job_name = job_name
     try:
-        selected_job_name = selected_job_name_by_user.get(current_user["id"])
-        if not selected_job_name:
-            raise HTTPException(status_code=400, detail="No job selected")
+        selected_job_name = target_job_name(current_user, job_name)
 
         if ctoaster_jobs is None:
             raise ValueError("ctoaster_jobs is not defined")
@@ -847,6 +1370,10 @@ async def pause_job(current_user=Depends(get_current_user)):
         if not os.path.isdir(job_path):
             raise HTTPException(status_code=404, detail="Job not found")
 
+        # A run that has not started yet is just taken out of the queue
+        if run_scheduler.cancel(current_user["id"], selected_job_name):
+            return {"message": f"Job '{selected_job_name}' has been removed from the run queue"}
+
         # Check if the job is currently running or paused
         status_file_path = os.path.join(job_path, "status")
         if not os.path.exists(status_file_path):
@@ -861,6 +1388,7 @@ async def pause_job(current_user=Depends(get_current_user)):
         command_file_path = os.path.join(job_path, "command")
         with open(command_file_path, "w") as command_file:
             command_file.write("PAUSE\n")
+        job_index.refresh(current_user["id"], selected_job_name)
 
         return {"message": f"Job '{selected_job_name}' has been paused"}
     except Exception as e:
@@ -869,8 +1397,26 @@ async def pause_job(current_user=Depends(get_current_user)):
         raise HTTPException(status_code=500, detail=error_message)
 
 
+# Largest piece of a log returned by one /get-log request
+LOG_READ_LIMIT = 4 * 1024 * 1024
+
 @app.get("/get-log/{job_name}")
-async def get_log(job_name: str, current_user=Depends(get_current_user)):
+async def get_log(
+    job_name: str,
+    request: Request,
+    response: Response,
+    offset: Optional[int] = Query(None, ge=0),
+    length: Optional[int] = Query(None, ge=1),
+    tail: Optional[int] = Query(None, ge=0),
+    current_user=Depends(get_current_user),
+):
+    """
+    Read a job's log: all of it, a byte range (offset and length), or
+    its last `tail` lines.  next_offset is where the following read
+    should start, so a client can page through the log or fetch only
+    what has been appended since its last call.  A client holding the
+    log as it was (same ETag) gets 304 Not Modified.
+    """
     if not job_name:
         raise HTTPException(status_code=400, detail="No job specified")
 
@@ -883,20 +1429,52 @@ async def get_log(job_name: str, current_user=Depends(get_current_user)):
     if not os.path.exists(log_file_path):
         logger.info(f"Log file not found at: {log_file_path}")
         # Return empty content instead of raising 404
-        return {"content": ""}
+        return {"content": "", "offset": 0, "next_offset": 0, "size": 0}
 
-    # Read the entire log file content
-    with open(log_file_path, "r") as log_file:
-        content = log_file.read()
+    if tail is not None and offset is not None:
+        raise HTTPException(status_code=400, detail="Use either offset or tail, not both")
+
+    # (Each range of the log is a different representation.)
+    validator = file_validator(log_file_path, extra=[str(request.query_params)])
+    not_modified = conditional(request, response, validator)
+    if not_modified:
+        return not_modified
+
+    # Without any of offset, length or tail, the whole log (as before)
+    paged = offset is not None or length is not None or tail is not None
+    limit = min(length or LOG_READ_LIMIT, LOG_READ_LIMIT) if paged else None
+    try:
+        if tail is not None:
+            offset = await blocking_pools.run("io", last_lines_offset, log_file_path, tail)
+        content, next_offset, size = await blocking_pools.run(
+            "io", read_range, log_file_path, offset or 0, limit
+        )
+    except OSError as e:
+        raise HTTPException(status_code=500, detail=f"Error reading log file: {str(e)}")
 
-    return {"content": content}
+    return {
+        "content": content,
+        "offset": min(offset or 0, size),
+        "next_offset": next_offset,
+        "size": size,
+    }
 
 
 # SSE endpoint to stream job output
 @app.get("/stream-output/{job_name}")
-async def stream_output(job_name: str, background_tasks: BackgroundTasks, current_user=Depends(get_current_user)):
+async def stream_output(
+    job_name: str,
+    background_tasks: BackgroundTasks,
+    last_event_id: Optional[str] = Header(None),
+    current_user=Depends(get_current_user),
+):
     """
     Stream the output of the specified job using Server-Sent Events (SSE).
+
+    Each line is sent with the byte offset just after it as its event
+    ID; a client reconnecting with Last-Event-ID carries on from there.
+    Otherwise the stream starts at the end of the log.  The stream ends
+    once the job has finished and the rest of the log has been sent.
     """
     if not job_name:
         raise HTTPException(status_code=400, detail="No job specified")
@@ -924,24 +1502,299 @@ async def stream_output(job_name: str, background_tasks: BackgroundTasks, curren
             status_code=404, detail=f"Log file not found at: {log_file_path}"
         )
 
-    # Function to read the log file line by line
+    user_id = current_user["id"]
+
+    # Follow the log file through the shared tailer, line by line
     async def log_file_reader():
-        with open(log_file_path, "r") as log_file:
-            log_file.seek(0, os.SEEK_END)  # Start at the end of the file
-            while True:
-                line = log_file.readline()
-                if line:
-                    yield f"data: {line.strip()}\n\n"
-                else:
-                    await asyncio.sleep(1)  # Wait for new data
+        async for end, data in tail_hub.follow(
+            log_file_path,
+            parse_event_id(last_event_id),
+            lambda: job_run_finished(user_id, job_name, job_path),
+        ):
+            offset = end - len(data)
+            for line in split_lines(data):
+                offset = min(offset + len(line) + 1, end)
+                text = line.decode("utf-8", "replace").strip()
+                yield f"id: {offset}\ndata: {text}\n\n"
 
     # Start streaming the log file to the client
     return StreamingResponse(log_file_reader(), media_type="text/event-stream")
+
+
+# SSE endpoint to stream job status changes
+@app.get("/job-events")
+async def job_events(current_user=Depends(get_current_user)):
+    """
+    Stream status transitions and progress of all the user's jobs using
+    Server-Sent Events (SSE).  The current status of each job is sent
+    first, then one event per change.
+    """
+    user_id = current_user["id"]
+    queue = status_watcher.subscribe(user_id)
+
+    def format_event(event):
+        event = {k: v for k, v in event.items() if k != "user_id"}
+        return f"event: status\ndata: {json.dumps(event)}\n\n"
+
+    async def event_stream():
+        try:
+            for event in status_watcher.snapshot(user_id):
+                yield format_event(event)
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"  # Stop proxies timing out idle streams
+                    continue
+                yield format_event(event)
+        finally:
+            status_watcher.unsubscribe(user_id, queue)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
+# === Multiplexed updates over a WebSocket ===
+#
+# One connection per client session carries any number of
+# subscriptions to job logs, series files and status changes (see
+# tools/server/channel.py for flow control).  Messages are JSON.  From
+# the client:
+#
+#   {"op": "subscribe", "id": "a", "topic": "log", "job": "j1", "offset": 0, "credit": 16}
+#   {"op": "subscribe", "id": "b", "topic": "series", "job": "j1",
+#    "file": "biogem_series_atm_temp.res", "variable": "...", "max_points": 1000, "bucket": 10}
+#   {"op": "subscribe", "id": "c", "topic": "status", "job": "j1"}  (job optional: all jobs)
+#   {"op": "credit", "id": "a", "n": 16}
+#   {"op": "unsubscribe", "id": "a"}
+#   {"op": "ping"}
+#
+# From the server: {"type": "subscribed" | "data" | "end" | "error", "id": ...}
+# and {"type": "pong"}.  Data messages carry {"lines": [...], "offset": n}
+# for logs, {"points": [[t, v], ...], "offset": n} for series and
+# {"jobs": {name: status event}} for status; a client resuming a log or
+# series subscribes again with the last offset it got.  Coalesced data
+# messages join several updates into one (only the latest status of a
+# job is kept).
+#
+# Browsers can't set headers on a WebSocket, so the bearer token may be
+# given as the `token` query parameter instead.  uvicorn logs the path
+# and query string of every request (and of WebSocket handshakes, on its
+# error logger), so the token is redacted from its log records.
+
+# Messages a subscription may send before the client grants more
+WS_DEFAULT_CREDIT = 16
+
+ws_channels = set()
+
+_TOKEN_PARAM = re.compile(r"([?&]token=)[^&\s\"]*")
+
+
+class _RedactTokenFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        if isinstance(record.msg, str):
+            record.msg = _TOKEN_PARAM.sub(r"\1[redacted]", record.msg)
+        if isinstance(record.args, tuple):
+            record.args = tuple(
+                _TOKEN_PARAM.sub(r"\1[redacted]", arg) if isinstance(arg, str) else arg
+                for arg in record.args
+            )
+        return True
+
+
+for _name in ("uvicorn.access", "uvicorn.error"):
+    logging.getLogger(_name).addFilter(_RedactTokenFilter())
+
+
+def _websocket_user(websocket: WebSocket) -> dict:
+    auth_header = websocket.headers.get("Authorization", "")
+    if auth_header.startswith("Bearer "):
+        token = auth_header.split(" ", 1)[1].strip()
+    else:
+        token = websocket.query_params.get("token")
+    if not token:
+        raise HTTPException(status_code=401, detail="Missing token")
+    user = get_user_by_id(decode_token(token)["uid"])
+    if not user:
+        raise HTTPException(status_code=401, detail="User not found")
+    return user
+
+
+def _owned_job_path(user: dict, job_name) -> str:
+    if not isinstance(job_name, str):
+        raise HTTPException(status_code=400, detail="No job specified")
+    job_path = get_user_job_path(user, job_name)
+    if not os.path.isdir(job_path):
+        raise HTTPException(status_code=404, detail="Job not found")
+    ensure_job_owner(job_path, user)
+    return job_path
+
+
+def _int_param(message: dict, name: str, minimum: int = 0) -> Optional[int]:
+    value = message.get(name)
+    if value is None:
+        return None
+    if not isinstance(value, int) or isinstance(value, bool) or value < minimum:
+        raise HTTPException(status_code=400, detail=f"'{name}' must be an integer of at least {minimum}")
+    return value
+
+
+async def _log_updates(user: dict, job_name: str, job_path: str, offset: Optional[int]):
+    async for end, data in tail_hub.follow(
+        os.path.join(job_path, "run.log"),
+        offset,
+        lambda: job_run_finished(user["id"], job_name, job_path),
+    ):
+        lines = [line.decode("utf-8", "replace").rstrip("\r") for line in split_lines(data)]
+        yield {"lines": lines, "offset": end}
+
+
+async def _series_updates(
+    user: dict,
+    job_name: str,
+    job_path: str,
+    data_file_path: str,
+    variable: str,
+    max_points: Optional[int],
+    method: str,
+    bucket: Optional[int],
+    offset: Optional[int],
+):
+    blocks = series_blocks(
+        data_file_path,
+        variable,
+        max_points,
+        method,
+        bucket,
+        offset,
+        lambda: job_run_finished(user["id"], job_name, job_path),
+    )
+    async for end, t, v in blocks:
+        yield {"points": np.column_stack((t, v)).tolist(), "offset": end}
+
+
+async def _status_updates(user: dict, job_name: Optional[str]):
+    queue = status_watcher.subscribe(user["id"])
+    try:
+        events = status_watcher.snapshot(user["id"])
+        while True:
+            jobs = {
+                event["job_name"]: {k: v for k, v in event.items() if k != "user_id"}
+                for event in events
+                if job_name is None or event["job_name"] == job_name
+            }
+            if jobs:
+                yield {"jobs": jobs}
+            events = [await queue.get()]
+    finally:
+        status_watcher.unsubscribe(user["id"], queue)
+
+
+async def _subscription_source(user: dict, message: dict):
+    # Everything the client sent is checked here, so that a bad request
+    # gets an error in place of "subscribed".
+    topic = message.get("topic")
+    job_name = message.get("job")
+    if topic == "status":
+        if job_name is not None:
+            await blocking_pools.run("io", _owned_job_path, user, job_name)
+        return _status_updates(user, job_name)
+    if topic not in ("log", "series"):
+        raise HTTPException(status_code=400, detail=f"Unknown topic '{topic}'")
+    job_path = await blocking_pools.run("io", _owned_job_path, user, job_name)
+    offset = _int_param(message, "offset")
+    if topic == "log":
+        return _log_updates(user, job_name, job_path, offset)
+
+    method = message.get("downsample", "lttb")
+    if method not in ("lttb", "minmax"):
+        raise HTTPException(status_code=400, detail=f"Unknown downsampling method '{method}'")
+    max_points = _int_param(message, "max_points", 3)
+    bucket = _int_param(message, "bucket", 2)
+    variable = message.get("variable")
+    if not isinstance(variable, str) or not variable.strip():
+        raise HTTPException(status_code=400, detail="No variable specified")
+    file_name = message.get("file")
+    if not isinstance(file_name, str) or not file_name:
+        raise HTTPException(status_code=400, detail="No data file specified")
+    data_file_path = await blocking_pools.run("io", resolve_series_file, job_path, file_name)
+    try:
+        series = await blocking_pools.run("io", series_cache.load, data_file_path)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error reading the data file: {str(e)}")
+    try:
+        series.index(trim_variable(variable))
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Variable '{variable}' not found in the file")
+    return _series_updates(
+        user, job_name, job_path, data_file_path, variable, max_points, method, bucket, offset
+    )
+
+
+@app.websocket("/ws")
+async def websocket_updates(websocket: WebSocket):
+    """
+    Log, series and status updates for any of the user's jobs, over one
+    connection.
+    """
+    try:
+        # Token check and user lookup (SQLite) off the loop
+        user = await blocking_pools.run("io", _websocket_user, websocket)
+    except HTTPException:
+        await websocket.close(code=1008)  # Policy violation
+        return
+    await websocket.accept()
+    channel = Channel(websocket.send_json)
+    ws_channels.add(channel)
+    try:
+        while True:
+            try:
+                message = await websocket.receive_json()
+            except (ValueError, KeyError):
+                await channel.send({"type": "error", "status": 400, "detail": "Messages must be JSON"})
+                continue
+            if not isinstance(message, dict):
+                await channel.send({"type": "error", "status": 400, "detail": "Messages must be JSON objects"})
+                continue
+            op = message.get("op")
+            sub_id = message.get("id")
+            try:
+                if op == "ping":
+                    await channel.send({"type": "pong"})
+                    continue
+                if not isinstance(sub_id, str) or not sub_id:
+                    raise HTTPException(status_code=400, detail="A subscription id is required")
+                if op == "subscribe":
+                    credit = _int_param(message, "credit")
+                    channel.subscribe(
+                        sub_id,
+                        await _subscription_source(user, message),
+                        WS_DEFAULT_CREDIT if credit is None else credit,
+                    )
+                    await channel.send({"type": "subscribed", "id": sub_id})
+                elif op == "credit":
+                    await channel.grant(sub_id, _int_param(message, "n", 1) or 1)
+                elif op == "unsubscribe":
+                    await channel.unsubscribe(sub_id)
+                else:
+                    raise HTTPException(status_code=400, detail=f"Unknown op '{op}'")
+            except HTTPException as e:
+                await channel.send({"type": "error", "id": sub_id, "status": e.status_code, "detail": e.detail})
+            except ChannelError as e:
+                await channel.send({"type": "error", "id": sub_id, "status": 409, "detail": str(e)})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        ws_channels.discard(channel)
+        await channel.close()
+
+
 # Namelist Apis
 
 
 @app.get("/jobs/{job_id}/namelists")
-def get_namelists(job_id: str, current_user=Depends(get_current_user)):
+def get_namelists(
+    job_id: str, request: Request, response: Response, current_user=Depends(get_current_user)
+):
     if ctoaster_jobs is None:
         raise ValueError("ctoaster_jobs is not defined")
 
@@ -952,6 +1805,11 @@ def get_namelists(job_id: str, current_user=Depends(get_current_user)):
 
     ensure_job_owner(job_dir, current_user)
 
+    # (Namelists are only ever added or removed, which updates the directory.)
+    not_modified = conditional(request, response, file_validator(job_dir))
+    if not_modified:
+        return not_modified
+
     # List files in job_dir that start with 'data_' and are files
     namelists = []
     for filename in os.listdir(job_dir):
@@ -964,7 +1822,13 @@ def get_namelists(job_id: str, current_user=Depends(get_current_user)):
 
 
 @app.get("/jobs/{job_id}/namelists/{namelist_name}")
-def get_namelist_content(job_id: str, namelist_name: str, current_user=Depends(get_current_user)):
+def get_namelist_content(
+    job_id: str,
+    namelist_name: str,
+    request: Request,
+    response: Response,
+    current_user=Depends(get_current_user),
+):
     if ctoaster_jobs is None:
         raise ValueError("ctoaster_jobs is not defined")
 
@@ -985,6 +1849,10 @@ def get_namelist_content(job_id: str, namelist_name: str, current_user=Depends(g
     if not os.path.isfile(namelist_file_path):
         raise HTTPException(status_code=404, detail="Namelist not found")
 
+    not_modified = conditional(request, response, file_validator(namelist_file_path))
+    if not_modified:
+        return not_modified
+
     try:
         with open(namelist_file_path, "r") as file:
             content = file.read()
@@ -997,7 +1865,7 @@ def get_namelist_content(job_id: str, namelist_name: str, current_user=Depends(g
 
 
 @app.get("/get_data_files_list/{job_name}")
-async def get_data_files_list(job_name: str, current_user=Depends(get_current_user)):
+def get_data_files_list(job_name: str, current_user=Depends(get_current_user)):
     if not job_name:
         raise HTTPException(status_code=400, detail="No job specified")
 
@@ -1009,46 +1877,63 @@ async def get_data_files_list(job_name: str, current_user=Depends(get_current_us
     if not os.path.isdir(job_path):
         raise HTTPException(status_code=404, detail="Job not found")
 
-    # Search for 'output/biogem' folder specifically
-    plot_data_path = None
-    for root, dirs, files in os.walk(job_path):
-        if "output/biogem" in root:
-            plot_data_path = root
-            break
+    # Match files starting with 'biogem_series' in output/biogem
+    data_file_name_prefix = "biogem_series"
+    data_file_list = [
+        name
+        for module, name in output_catalogue.files(job_path)
+        if module == "biogem" and name.startswith(data_file_name_prefix)
+    ]
 
-    if not plot_data_path:
+    if not data_file_list:
         raise HTTPException(
-            status_code=404, detail="Output/biogem path not found"
+            status_code=404,
+            detail=f"No files found with prefix '{data_file_name_prefix}' in output/biogem",
         )
 
-    print(":: Resolved plot_data_path ::", plot_data_path)
+    return data_file_list
 
+@app.get("/jobs/{job_name}/outputs")
+def get_job_outputs(
+    job_name: str,
+    module: Optional[str] = Query(None),
+    current_user=Depends(get_current_user),
+):
+    """
+    Every plottable output file of a job -- time series (.res) and
+    netCDF (.nc) files from all modules -- with its variables, row (or
+    record) count, size and last-modified time.  A file's "path" can be
+    passed as data_file_name to the plotting endpoints.
+    """
+    job_path = get_user_job_path(current_user, job_name)
+    if not os.path.isdir(job_path):
+        raise HTTPException(status_code=404, detail="Job not found")
+    ensure_job_owner(job_path, current_user)
     try:
-        # Log all files in the directory for debugging purposes
-        all_files = os.listdir(plot_data_path)
-        print(":: All files in resolved path ::", all_files)
-
-        # Match files starting with 'biogem_series'
-        data_file_name_prefix = "biogem_series"
-        data_file_list = [f for f in all_files if f.startswith(data_file_name_prefix)]
-
-        print(":: List of matching files ::", data_file_list)
-
-        if not data_file_list:
-            raise HTTPException(
-                status_code=404,
-                detail=f"No files found with prefix '{data_file_name_prefix}' in {plot_data_path}",
-            )
-
-        return data_file_list
-
+        files = output_catalogue.catalogue(job_path, module)
     except Exception as e:
-        raise HTTPException(
-            status_code=500, detail=f"Error fetching data files: {str(e)}"
-        )
+        raise HTTPException(status_code=500, detail=f"Error listing output files: {str(e)}")
+    return {"job_name": job_name, "files": files}
+
+@app.get("/jobs/{job_name}/runs")
+def get_job_runs(
+    job_name: str,
+    limit: Optional[int] = Query(None, ge=1),
+    current_user=Depends(get_current_user),
+):
+    """
+    A job's model runs, newest first: when and where each ran, how it
+    ended (exit code or signal), and its wall time, CPU time and peak
+    memory use.  A run still going on has state RUNNING.
+    """
+    job_path = get_user_job_path(current_user, job_name)
+    if not os.path.isdir(job_path):
+        raise HTTPException(status_code=404, detail="Job not found")
+    ensure_job_owner(job_path, current_user)
+    return {"job_name": job_name, "runs": read_run_records(job_path, limit)}
 
 @app.get("/get-variables/{job_name}/{data_file_name}")
-async def get_variables(job_name: str, data_file_name: str, current_user=Depends(get_current_user)):
+def get_variables(job_name: str, data_file_name: str, current_user=Depends(get_current_user)):
     if not job_name or not data_file_name:
         raise HTTPException(status_code=400, detail="Job name or data file name is missing")
 
@@ -1063,33 +1948,19 @@ async def get_variables(job_name: str, data_file_name: str, current_user=Depends
 
     ensure_job_owner(job_path, current_user)
 
-    # Search for 'output/biogem' folder specifically
-    plot_data_path = None
-    for root, dirs, files in os.walk(job_path):
-        if "output/biogem" in root:
-            plot_data_path = root
-            break
+    # Locate the data file in the job's output catalogue
+    data_file_path = resolve_output_file(job_path, data_file_name)
 
-    if not plot_data_path:
-        raise HTTPException(
-            status_code=404, detail="Output/biogem path not found"
-        )
-
-    # Construct the full path to the data file
-    data_file_path = os.path.join(plot_data_path, data_file_name)
-
-    # Check if the data file exists
-    if not os.path.isfile(data_file_path):
-        raise HTTPException(status_code=404, detail="Data file not found")
-
-    # Read the file and extract variables from the header line
+    # Extract variables from the header line (or the netCDF header).
+    # Series files go through the series cache, so that the plot
+    # requests that follow find the file already parsed.
     try:
-        with open(data_file_path, 'r') as file:
-            header_line = file.readline().strip()
-            # Extract variables based on everything after '/' in the header
-            variables = [var.strip() for var in header_line.split('/')[1:]]  # Skip the first column
+        details = output_catalogue.describe(data_file_path)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error reading the data file: {str(e)}")
+    if "error" in details:
+        raise HTTPException(status_code=500, detail=f"Error reading the data file: {details['error']}")
+    variables = details["variables"]  # Excludes the time column of series files
 
     if not variables:
         raise HTTPException(status_code=404, detail="No variables found in the data file")
@@ -1098,6 +1969,12 @@ async def get_variables(job_name: str, data_file_name: str, current_user=Depends
     return variables
 
 
+def _header_subset(response: Response) -> dict:
+    # The headers set on an endpoint's `response` parameter, for a
+    # Response the endpoint returns itself (which FastAPI doesn't merge).
+    return {k: v for k, v in response.headers.items() if k != "content-length"}
+
+
 from pydantic import BaseModel
 
 # Request body model for the POST API
@@ -1105,9 +1982,24 @@ class PlotDataRequest(BaseModel):
     job_name: str
     data_file_name: str
     variable: str
+    max_points: Optional[int] = None  # Downsample to at most this many points
+    downsample: str = "lttb"  # Downsampling method: "lttb" or "minmax"
 
 @app.post("/get-plot-data")
-async def get_plot_data(request: PlotDataRequest, current_user=Depends(get_current_user)):
+def get_plot_data(
+    request: PlotDataRequest,
+    http_request: Request,
+    response: Response,
+    current_user=Depends(get_current_user),
+):
+    """
+    One variable of a series file as [time, value] pairs, or as binary
+    columns for clients that Accept them (see tools/server/encoding.py).
+    The response carries an ETag built from the file's state and the
+    request; a client sending it back in If-None-Match gets 304 Not
+    Modified while the file is unchanged (a dashboard reloading the
+    same plots).
+    """
     job_name = request.job_name
     data_file_name = request.data_file_name
     variable = request.variable
@@ -1126,128 +2018,277 @@ async def get_plot_data(request: PlotDataRequest, current_user=Depends(get_curre
 
     ensure_job_owner(job_path, current_user)
 
-    # Search for 'output/biogem' folder specifically
-    plot_data_path = None
-    for root, dirs, files in os.walk(job_path):
-        if "output/biogem" in root:
-            plot_data_path = root
-            break
+    # Locate the data file in the job's output catalogue
+    data_file_path = resolve_series_file(job_path, data_file_name)
 
-    if not plot_data_path:
-        raise HTTPException(
-            status_code=404, detail="Output/biogem path not found"
-        )
+    media_type = negotiate(http_request.headers.get("accept"), available_series_types())
+    if media_type is None:
+        raise HTTPException(status_code=406, detail=f"Plot data is available as {', '.join(available_series_types())}")
 
-    # Construct the full path to the data file
-    data_file_path = os.path.join(plot_data_path, data_file_name)
-
-    # Check if the data file exists
-    if not os.path.isfile(data_file_path):
-        raise HTTPException(status_code=404, detail="Data file not found")
+    validator = file_validator(
+        stored_file(data_file_path)[0], extra=[request.model_dump_json(), media_type]
+    )
+    not_modified = conditional(http_request, response, validator, vary="Accept")
+    if not_modified:
+        return not_modified
 
-    # Read the file and extract data for the selected variable
+    # Extract data for the selected variable from the parsed file
     try:
-        with open(data_file_path, 'r') as file:
-            header_line = file.readline().strip()
-            columns = header_line.split('/')  # Split by '/' to match the column names
-            columns = [col.strip() for col in columns]
-
-            # Get the first column name and the index of the selected variable
-            first_column_name = columns[0]  # Use the original first column name
-            if variable not in columns:
-                raise HTTPException(status_code=404, detail="Variable not found in the data file")
-
-            variable_index = columns.index(variable)
-
-            # Read the data lines and extract the values for the first column and selected variable
-            data = []
-            for line in file:
-                parts = line.strip().split()
-                if len(parts) > variable_index:
-                    try:
-                        first_column_value = float(parts[0])  # Value of the first column
-                        data_value = float(parts[variable_index])
-                        data.append([first_column_value, data_value])  # Store as [first_column_value, data_value] pair
-                    except ValueError:
-                        continue  # Skip lines with invalid data
-
+        series = series_cache.load(data_file_path)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error reading the data file: {str(e)}")
 
-    if not data:
+    first_column_name = series.columns[0]  # Use the original first column name
+    if variable not in series.columns:
+        raise HTTPException(status_code=404, detail="Variable not found in the data file")
+
+    # [first_column_value, data_value] pairs, skipping rows with invalid data
+    t, v = series.series(variable)
+    total_points = len(t)
+    if request.max_points is not None:
+        if request.max_points < 3:
+            raise HTTPException(status_code=400, detail="max_points must be at least 3")
+        try:
+            t, v = downsample(t, v, request.max_points, request.downsample)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    if not len(t):
         raise HTTPException(status_code=404, detail="No data found for the selected variable")
 
-    # Return the original column names and data
-    return {
+    if media_type != JSON_TYPE:
+        header = {"columns": [first_column_name, variable], "total_points": total_points}
+        arrays = [(first_column_name, t), (variable, v)]
+        if media_type == COLUMNS_TYPE:
+            body = pack_columns(header, arrays)
+        else:
+            body = arrow_stream(header, arrays)
+        return Response(body, media_type=media_type, headers=_header_subset(response))
+
+    # Return the original column names and data (serialised directly:
+    # FastAPI's own encoding walks every float of the list)
+    content = {
         "columns": [first_column_name, variable],
-        "data": data
+        "data": np.column_stack((t, v)).tolist(),
+        "total_points": total_points,
     }
+    return JSONResponse(content, headers=_header_subset(response))
+
+class PlotSeriesRequest(BaseModel):
+    data_file_name: str
+    variables: List[str]
+
+class PlotDataBatchRequest(BaseModel):
+    job_name: str
+    items: List[PlotSeriesRequest]
+    max_points: Optional[int] = None  # Downsample each file to at most this many points
+    downsample: str = "lttb"  # Downsampling method: "lttb" or "minmax"
+
+def _json_floats(values: np.ndarray) -> list:
+    # NaN is not valid JSON: missing values are sent as null.
+    return [None if x != x else x for x in values.tolist()]
+
+@app.post("/get-plot-data-batch")
+def get_plot_data_batch(
+    request: PlotDataBatchRequest,
+    http_request: Request,
+    current_user=Depends(get_current_user),
+):
+    """
+    Several variables from several series files in one request.  Each
+    file is located and loaded once, and its variables share one time
+    axis: rows without a valid time are skipped, and missing values of a
+    variable are returned as null (NaN in binary columns, for clients
+    that Accept them: the files in order, each its time column then its
+    variables).
+    """
+    if not request.job_name or not request.items:
+        raise HTTPException(status_code=400, detail="Job name or items are missing")
+    media_type = negotiate(http_request.headers.get("accept"), (JSON_TYPE, COLUMNS_TYPE))
+    if media_type is None:
+        raise HTTPException(status_code=406, detail=f"Plot data is available as {JSON_TYPE}, {COLUMNS_TYPE}")
+    if request.max_points is not None and request.max_points < 3:
+        raise HTTPException(status_code=400, detail="max_points must be at least 3")
+
+    job_path = get_user_job_path(current_user, request.job_name)
+    if not os.path.isdir(job_path):
+        raise HTTPException(status_code=404, detail="Job not found")
+    ensure_job_owner(job_path, current_user)
+
+    # Group the requested variables by file, keeping the request order
+    variables_by_file = {}
+    for item in request.items:
+        names = variables_by_file.setdefault(item.data_file_name, [])
+        names.extend(v for v in item.variables if v not in names)
+
+    results = []
+    for data_file_name, variables in variables_by_file.items():
+        data_file_path = output_catalogue.resolve(job_path, data_file_name)
+        if data_file_path is None:
+            raise HTTPException(status_code=404, detail=f"Data file '{data_file_name}' not found")
+        if not is_series_file(os.path.basename(data_file_path)):
+            raise HTTPException(status_code=400, detail=f"'{data_file_name}' is not a time series file")
+        try:
+            series = series_cache.load(data_file_path)
+            indices = [series.index(variable) for variable in variables]
+        except KeyError as e:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Variable '{e.args[0]}' not found in '{data_file_name}'",
+            )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error reading the data file: {str(e)}")
+
+        data = np.asarray(series.data)
+        data = data[~np.isnan(data[:, 0])]
+        total_points = len(data)
+        if request.max_points is not None:
+            try:
+                keep = downsample_indices(
+                    data[:, 0], [data[:, i] for i in indices], request.max_points, request.downsample
+                )
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            data = data[keep]
+
+        if media_type == COLUMNS_TYPE:
+            results.append({
+                "data_file_name": data_file_name,
+                "columns": [series.columns[0]] + variables,
+                "total_points": total_points,
+                "arrays": [(series.columns[0], data[:, 0])]
+                + [(variable, data[:, i]) for variable, i in zip(variables, indices)],
+            })
+            continue
+
+        results.append({
+            "data_file_name": data_file_name,
+            "columns": [series.columns[0]] + variables,
+            "time": data[:, 0].tolist(),
+            "values": {
+                variable: _json_floats(data[:, i]) for variable, i in zip(variables, indices)
+            },
+            "total_points": total_points,
+        })
+
+    if media_type == COLUMNS_TYPE:
+        arrays = [array for result in results for array in result.pop("arrays")]
+        return Response(pack_columns({"files": results}, arrays), media_type=COLUMNS_TYPE)
+    return {"files": results}
 
 from typing import Generator
-from fastapi.responses import StreamingResponse, FileResponse
-import tempfile
+from fastapi.responses import StreamingResponse
 import shutil
 
 def trim_variable(variable: str) -> str:
     """Trim and normalize the variable by removing leading/trailing spaces."""
     return variable.strip()
 
-async def read_data_file(file_path: str, variable: str) -> Generator[str, None, None]:
-    """Generator function to yield existing and new data as it is written to the file."""
+async def series_blocks(
+    file_path: str,
+    variable: str,
+    max_points: Optional[int] = None,
+    method: str = "lttb",
+    bucket: Optional[int] = None,
+    resume_offset: Optional[int] = None,
+    is_done=None,
+) -> AsyncIterator[Tuple[int, np.ndarray, np.ndarray]]:
+    """
+    Existing and new data of one variable of a series file, as it is
+    written, in blocks of (end offset, times, values).
+
+    With max_points, the existing data is downsampled before it is sent;
+    with bucket, new data is sent as the minimum and maximum of each run
+    of that many rows rather than row by row.  The end offset is where
+    the block ends in the file: with resume_offset, the existing data is
+    skipped and rows are sent from that offset on.
+    """
     try:
-        with open(file_path, 'r') as file:
-            # Read header and split by '/'
-            header_line = file.readline().strip()
-            columns = header_line.split('/')  # Adjust delimiter if needed
-            trimmed_columns = [trim_variable(col) for col in columns]
-            trimmed_variable = trim_variable(variable)
-
-            if trimmed_variable not in trimmed_columns:
-                logger.error(f"Variable '{trimmed_variable}' not found in columns: {trimmed_columns}")
-                raise HTTPException(status_code=404, detail=f"Variable '{variable}' not found in the file")
-
-            variable_index = trimmed_columns.index(trimmed_variable)
-
-            # Step 1: Stream all existing data in the file
-            while True:
-                line = file.readline()
-                if not line:
-                    break  # Stop when we reach the end of existing data
-                
-                parts = line.strip().split()  # Use whitespace delimiter (same as POST endpoint)
-                if len(parts) > variable_index:
-                    try:
-                        first_column_value = float(parts[0])
-                        data_value = float(parts[variable_index])
-                        yield f"data: {first_column_value},{data_value}\n\n"
-                    except ValueError:
-                        continue  # Skip lines with invalid data
-
-            # Step 2: Tail the file for new data
-            file.seek(0, os.SEEK_END)  # Move to the end of the file to start tailing
-            while True:
-                line = file.readline()
-                if not line:
-                    await asyncio.sleep(0.5)  # Sleep briefly to wait for new data
-                    continue
-
-                parts = line.strip().split()  # Use whitespace delimiter (same as POST endpoint)
-                if len(parts) > variable_index:
-                    try:
-                        first_column_value = float(parts[0])
-                        data_value = float(parts[variable_index])
-                        yield f"data: {first_column_value},{data_value}\n\n"
-                    except ValueError:
-                        continue  # Skip lines with invalid data
+        # Step 1: All existing data in the file, from the series cache
+        series = await blocking_pools.run("io", series_cache.load, file_path)
+        trimmed_variable = trim_variable(variable)
+        try:
+            variable_index = series.index(trimmed_variable)
+        except KeyError:
+            logger.error(f"Variable '{trimmed_variable}' not found in columns: {series.columns}")
+            raise HTTPException(status_code=404, detail=f"Variable '{variable}' not found in the file")
+
+        if resume_offset is None:
+            t, v = series.series(trimmed_variable)
+            if max_points is not None:
+                t, v = downsample(t, v, max_points, method)
+            yield series.offset, t, v
+            resume_offset = series.offset
+
+        ncols = len(series.columns)
+
+        def parse_block(data: bytes) -> Tuple[np.ndarray, np.ndarray]:
+            # (From offset 0 the header line comes too; it parses as NaN.)
+            rows = parse_rows(data.decode("utf-8", "replace"), ncols)
+            t, v = rows[:, 0], rows[:, variable_index]
+            mask = ~(np.isnan(t) | np.isnan(v))  # Skip lines with invalid data
+            t, v = t[mask], v[mask]
+            if bucket:
+                t, v = minmax_buckets(t, v, bucket)
+            return t, v
+
+        if stored_file(file_path)[1] is not None:
+            # Compressed: the job has finished and the file won't grow.
+            # Send whatever a resuming client is missing, and stop.
+            if resume_offset < series.offset:
+                data = await blocking_pools.run("io", read_output, file_path, resume_offset)
+                yield (resume_offset + len(data), *parse_block(data))
+            return
+
+        # Step 2: Follow the file for new data, from where the cache left off
+        async for end, data in tail_hub.follow(file_path, resume_offset, is_done):
+            yield (end, *parse_block(data))
     except HTTPException as http_exc:
         raise http_exc
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error reading the data file: {str(e)}")
 
+async def read_data_file(
+    file_path: str,
+    variable: str,
+    max_points: Optional[int] = None,
+    method: str = "lttb",
+    bucket: Optional[int] = None,
+    resume_offset: Optional[int] = None,
+    is_done=None,
+) -> Generator[str, None, None]:
+    """
+    Generator function to yield existing and new data as it is written
+    to the file, as server-sent events (see series_blocks).  Event IDs
+    are byte offsets in the file.
+    """
+    async for end, t, v in series_blocks(
+        file_path, variable, max_points, method, bucket, resume_offset, is_done
+    ):
+        points = list(zip(t.tolist(), v.tolist()))
+        for i, (first_column_value, data_value) in enumerate(points):
+            event_id = f"id: {end}\n" if i == len(points) - 1 else ""
+            yield f"{event_id}data: {first_column_value},{data_value}\n\n"
+
+# Left out of job downloads unless asked for: copies of the model executable
+DOWNLOAD_DEFAULT_EXCLUDE = ["carrotcake-*.exe"]
+
 @app.get("/jobs/{job_name}/download")
-async def download_job_zip(job_name: str, background_tasks: BackgroundTasks, current_user=Depends(get_current_user)):
+async def download_job_zip(
+    job_name: str,
+    include: Optional[List[str]] = Query(None),
+    exclude: Optional[List[str]] = Query(None),
+    level: int = Query(6, ge=0, le=9),
+    current_user=Depends(get_current_user),
+):
     """
-    Package the entire job directory into a zip and stream it back.
+    Package the job directory into a zip, streamed back as it is compressed.
+
+    include/exclude are glob patterns matched against paths relative to
+    the job directory or against file and directory names (e.g.
+    exclude=restart/&exclude=input/).  Without exclude, copies of the
+    model executable are left out.  level is the deflate compression
+    level; 0 stores files uncompressed.
     """
     if not job_name:
         raise HTTPException(status_code=400, detail="Job name is required")
@@ -1258,21 +2299,18 @@ async def download_job_zip(job_name: str, background_tasks: BackgroundTasks, cur
     if not os.path.isdir(job_path):
         raise HTTPException(status_code=404, detail="Job not found")
 
-    # Create a temporary directory to hold the archive
-    tmpdir = tempfile.mkdtemp(prefix=f"{job_name}_zip_")
-    zip_base = os.path.join(tmpdir, job_name)
-    archive_path = shutil.make_archive(zip_base, "zip", job_path)
+    if exclude is None:
+        exclude = DOWNLOAD_DEFAULT_EXCLUDE
 
-    # Cleanup temp dir after response is sent
-    def _cleanup():
-        shutil.rmtree(tmpdir, ignore_errors=True)
-    background_tasks.add_task(_cleanup)
+    def generate():
+        files = iter_files(job_path, include, exclude)
+        yield from zip_stream(job_path, list(files), level)
 
-    return FileResponse(
-        path=archive_path,
+    # Compress in the archive pool, a block at a time
+    return StreamingResponse(
+        blocking_pools.iterate("archive", generate()),
         media_type="application/zip",
-        filename=f"{job_name}.zip",
-        background=background_tasks,
+        headers={"Content-Disposition": f'attachment; filename="{job_name}.zip"'},
     )
 
 @app.get("/get-plot-data-stream")
@@ -1280,26 +2318,39 @@ async def get_plot_data_stream(
     job_name: str = Query(...),
     data_file_name: str = Query(...),
     variable: str = Query(...),
+    max_points: Optional[int] = Query(None, ge=3),
+    downsample_method: str = Query("lttb", alias="downsample"),
+    bucket: Optional[int] = Query(None, ge=2),
+    last_event_id: Optional[str] = Header(None),
     current_user=Depends(get_current_user),
 ):
-    """GET API to stream data for plotting in real-time."""
+    """
+    GET API to stream data for plotting in real-time.  max_points
+    downsamples the data already in the file; bucket sends new data as
+    per-bucket minima and maxima instead of every line.  A client
+    reconnecting with Last-Event-ID gets only the rows it has not seen,
+    and the stream ends once the job has finished.
+    """
+    if downsample_method not in ("lttb", "minmax"):
+        raise HTTPException(status_code=400, detail=f"Unknown downsampling method '{downsample_method}'")
     job_path = get_user_job_path(current_user, job_name)
     if not os.path.isdir(job_path):
         raise HTTPException(status_code=404, detail="Job not found")
 
-    plot_data_path = None
-    for root, dirs, files in os.walk(job_path):
-        if "output/biogem" in root:
-            plot_data_path = root
-            break
-
-    if not plot_data_path:
-        raise HTTPException(status_code=404, detail="Output/biogem path not found")
-
-    data_file_path = os.path.join(plot_data_path, data_file_name)
-    if not os.path.isfile(data_file_path):
-        raise HTTPException(status_code=404, detail="Data file not found")
+    data_file_path = resolve_series_file(job_path, data_file_name)
 
     # Return streaming response for real-time data
-    return StreamingResponse(read_data_file(data_file_path, variable), media_type="text/event-stream")
+    user_id = current_user["id"]
+    return StreamingResponse(
+        read_data_file(
+            data_file_path,
+            variable,
+            max_points,
+            downsample_method,
+            bucket,
+            parse_event_id(last_event_id),
+            lambda: job_run_finished(user_id, job_name, job_path),
+        ),
+        media_type="text/event-stream",
+    )
 
@@ -0,0 +1,892 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess as sp
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# Load test and benchmark harness for the REST API (tools/REST.py).
+#
+# Three steps, run from the cTOASTER root directory:
+#
+#   python -m tools.benchmark generate --root /tmp/bench --jobs 200 --rows 20000
+#   python -m tools.benchmark run --root /tmp/bench --out before.json
+#   python -m tools.benchmark compare before.json after.json
+#
+# "generate" writes a synthetic cTOASTER installation: users' job
+# directories with status files, logs and BIOGEM time series files of
+# a given size, plus base and user configurations for setup requests.
+# "run" points the API at it, drives a mix of requests from a number of
+# concurrent clients for a fixed time, and reports latency percentiles,
+# throughput and memory use per kind of request, optionally saving them
+# as JSON, along with the API's event loop lag.  The API runs in this
+# process (--mode inprocess, driven directly through ASGI) or as a
+# uvicorn server (--mode uvicorn, needs httpx).  "compare" lines up two
+# sets of saved results.
+
+TREE_FILENAME = "bench-tree.json"
+
+BENCH_PASSWORD = "benchmark"
+
+# Request mix: relative weights of the scenarios.
+DEFAULT_MIX = {
+    "list_jobs": 15,
+    "job_details": 15,
+    "outputs": 5,
+    "variables": 10,
+    "plot": 20,
+    "plot_batch": 10,
+    "log_tail": 10,
+    "plot_stream": 5,
+    "log_stream": 3,
+    "job_events": 2,
+    "setup": 5,
+    # Not in the default mix (CPU-heavy; see tools/tests/test_loop_lag.py)
+    "login": 0,
+    "download": 0,
+}
+
+SERIES_NAMES = [
+    "biogem_series_atm_temp.res",
+    "biogem_series_ocn_temp.res",
+    "biogem_series_ocn_sal.res",
+    "biogem_series_atm_pCO2.res",
+]
+
+BENCH_BASE_CONFIG = """\
+# Benchmark base configuration
+ma_flag_ebatmos=.TRUE.
+ma_flag_goldsteinocean=.TRUE.
+ma_flag_goldsteinseaice=.TRUE.
+ma_flag_biogem=.TRUE.
+ma_flag_atchem=.TRUE.
+ma_flag_sedgem=.FALSE.
+GOLDSTEINNLONS=$(DEFINE)GOLDSTEINNLONS=36
+GOLDSTEINNLATS=$(DEFINE)GOLDSTEINNLATS=36
+GOLDSTEINNLEVS=$(DEFINE)GOLDSTEINNLEVS=16
+ea_topo="worbe2"
+go_topo="worbe2"
+"""
+
+BENCH_USER_CONFIG = "bg_par_infile_sig_name='save_sig.dat'\n"
+
+
+# ----------------------------------------------------------------------
+#
+#  SYNTHETIC JOB TREES
+#
+
+
+def write_series_file(path: str, rows: int, columns: int, rng: random.Random) -> None:
+    """
+    A BIOGEM time series file: a "%" header naming the columns, then
+    one row per year.
+    """
+    names = ["time (yr)"] + [f"variable {i + 1}" for i in range(columns)]
+    levels = [rng.uniform(1, 100) for _ in range(columns)]
+    with open(path, "w") as fp:
+        fp.write("% " + " / ".join(names) + "\n")
+        for row in range(rows):
+            values = (lv * (1 + 0.01 * rng.random()) for lv in levels)
+            fp.write(f"{row + 0.5:12.3f}" + "".join(f" {v:14.6e}" for v in values) + "\n")
+
+
+def write_job(
+    job_dir: str,
+    user_id: int,
+    email: str,
+    status: str,
+    rows: int,
+    columns: int,
+    series_files: int,
+    log_lines: int,
+    rng: random.Random,
+) -> None:
+    os.makedirs(os.path.join(job_dir, "config"))
+    with open(os.path.join(job_dir, "owner.json"), "w") as fp:
+        json.dump({"user_id": user_id, "email": email}, fp)
+    with open(os.path.join(job_dir, "config", "config"), "w") as fp:
+        fp.write("base_config: bench\nuser_config: bench\nrun_length: 10\nt100: False\n")
+    if status == "UNCONFIGURED":
+        return
+    os.makedirs(os.path.join(job_dir, "data_genie"))
+    koverall = rows * 100 if status == "COMPLETE" else rng.randrange(1, rows * 100)
+    with open(os.path.join(job_dir, "status"), "w") as fp:
+        fp.write(f"{status} {koverall} {rows * 100} {koverall / 100:.2f}\n")
+    with open(os.path.join(job_dir, "run.log"), "w") as fp:
+        for i in range(log_lines):
+            fp.write(f" $N$ {i:8d}  step {i * 100:10d}  global mean temp {rng.uniform(10, 20):8.4f}\n")
+    biogem_dir = os.path.join(job_dir, "output", "biogem")
+    os.makedirs(biogem_dir)
+    for name in SERIES_NAMES[:series_files]:
+        write_series_file(os.path.join(biogem_dir, name), rows, columns, rng)
+
+
+def generate_tree(
+    root: str,
+    users: int,
+    jobs: int,
+    rows: int,
+    columns: int,
+    series_files: int,
+    log_lines: int,
+    running: float,
+    setup_jobs: int,
+    seed: int,
+) -> dict:
+    """
+    Write a synthetic cTOASTER installation under root.
+
+    :param jobs: Jobs per user (besides the setup_jobs kept for setup requests).
+    :param running: Fraction of jobs with a RUNNING status.
+    :return: Description of the tree (also saved in the tree file).
+    """
+    rng = random.Random(seed)
+    jobs_root = os.path.join(root, "jobs")
+    data_root = os.path.join(root, "data")
+    for d in ("jobs", "data/base-configs", "data/user-configs", "test", "home"):
+        os.makedirs(os.path.join(root, d), exist_ok=True)
+    with open(os.path.join(data_root, "base-configs", "bench.config"), "w") as fp:
+        fp.write(BENCH_BASE_CONFIG)
+    with open(os.path.join(data_root, "user-configs", "bench"), "w") as fp:
+        fp.write(BENCH_USER_CONFIG)
+
+    ctoaster_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with open(os.path.join(root, "home", ".ctoasterrc"), "w") as fp:
+        fp.write(f"ctoaster_root: {ctoaster_root}\n")
+        fp.write(f"ctoaster_data: {data_root}\n")
+        fp.write(f"ctoaster_test: {os.path.join(root, 'test')}\n")
+        fp.write(f"ctoaster_jobs: {jobs_root}\n")
+        fp.write("ctoaster_version: DEVELOPMENT\n")
+
+    tree = {
+        "users": [],
+        "series_files": SERIES_NAMES[:series_files],
+        "columns": [f"variable {i + 1}" for i in range(columns)],
+        "params": {
+            "users": users,
+            "jobs": jobs,
+            "rows": rows,
+            "columns": columns,
+            "series_files": series_files,
+            "log_lines": log_lines,
+            "running": running,
+            "setup_jobs": setup_jobs,
+            "seed": seed,
+        },
+    }
+    # User IDs are given out in registration order, starting from 1.
+    for user_id in range(1, users + 1):
+        email = f"bench{user_id}@example.org"
+        user = {"id": user_id, "email": email, "jobs": [], "setup_jobs": []}
+        for j in range(jobs):
+            name = f"job{j:05d}"
+            status = "RUNNING" if rng.random() < running else "COMPLETE"
+            write_job(
+                os.path.join(jobs_root, str(user_id), name),
+                user_id, email, status, rows, columns, series_files, log_lines, rng,
+            )
+            user["jobs"].append({"name": name, "status": status})
+        for j in range(setup_jobs):
+            name = f"setup{j:03d}"
+            write_job(
+                os.path.join(jobs_root, str(user_id), name),
+                user_id, email, "UNCONFIGURED", rows, columns, series_files, log_lines, rng,
+            )
+            user["setup_jobs"].append(name)
+        tree["users"].append(user)
+
+    with open(os.path.join(root, TREE_FILENAME), "w") as fp:
+        json.dump(tree, fp, indent=2)
+    return tree
+
+
+# ----------------------------------------------------------------------
+#
+#  CLIENTS
+#
+# Both clients have the same interface: request() returns the status
+# code, the number of body bytes and (with keep_body set) the body.
+# With first_event set, only the first chunk of the body (the first
+# server-sent event) is waited for and the connection is then closed.
+
+
+def _request_headers(token: Optional[str], extra: Optional[dict]) -> Dict[str, str]:
+    headers = {}
+    if token:
+        headers["authorization"] = f"Bearer {token}"
+    headers.update(extra or {})
+    return headers
+
+
+class AsgiClient:
+    """
+    Calls an ASGI application directly, in this process and event loop.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+        self.lifespan_messages: Optional[asyncio.Queue] = None
+        self.lifespan_task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self.lifespan_messages = asyncio.Queue()
+        await self.lifespan_messages.put({"type": "lifespan.startup"})
+        started = asyncio.get_running_loop().create_future()
+
+        async def send(message):
+            if message["type"].startswith("lifespan.startup") and not started.done():
+                started.set_result(message)
+
+        self.lifespan_task = asyncio.create_task(
+            self.app({"type": "lifespan", "asgi": {"version": "3.0"}}, self.lifespan_messages.get, send)
+        )
+        message = await started
+        if message["type"] == "lifespan.startup.failed":
+            raise RuntimeError(f"Application startup failed: {message.get('message')}")
+
+    async def stop(self) -> None:
+        if self.lifespan_task is not None:
+            await self.lifespan_messages.put({"type": "lifespan.shutdown"})
+            try:
+                await asyncio.wait_for(self.lifespan_task, 5)
+            except (asyncio.TimeoutError, Exception):
+                self.lifespan_task.cancel()
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        token: Optional[str] = None,
+        body=None,
+        headers: Optional[dict] = None,
+        first_event: bool = False,
+        keep_body: bool = False,
+    ) -> Tuple[int, int, Optional[bytes]]:
+        path, _, query = path.partition("?")
+        data = json.dumps(body).encode() if body is not None else b""
+        header_list = [(b"host", b"bench")]
+        header_list += [(k.encode(), v.encode()) for k, v in _request_headers(token, headers).items()]
+        if body is not None:
+            header_list += [(b"content-type", b"application/json"), (b"content-length", str(len(data)).encode())]
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query.encode(),
+            "root_path": "",
+            "headers": header_list,
+            "client": ("127.0.0.1", 50000),
+            "server": ("bench", 80),
+        }
+        request_sent = False
+        disconnected = asyncio.Event()
+        done = asyncio.Event()
+        state = {"status": 500, "bytes": 0}
+        chunks = []
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": data, "more_body": False}
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                chunk = message.get("body", b"")
+                state["bytes"] += len(chunk)
+                if keep_body:
+                    chunks.append(chunk)
+                if not message.get("more_body", False) or (first_event and chunk):
+                    done.set()
+
+        task = asyncio.create_task(self.app(scope, receive, send))
+        waiter = asyncio.create_task(done.wait())
+        await asyncio.wait([task, waiter], return_when=asyncio.FIRST_COMPLETED)
+        waiter.cancel()
+        if not task.done():
+            disconnected.set()
+            try:
+                await asyncio.wait_for(task, 5)
+            except asyncio.TimeoutError:
+                pass
+        if task.done() and not task.cancelled() and task.exception() is not None:
+            state["status"] = 500
+        return state["status"], state["bytes"], b"".join(chunks) if keep_body else None
+
+
+class HttpClient:
+    """
+    Sends requests to a server over HTTP (with httpx).
+    """
+
+    def __init__(self, base_url: str, connections: int) -> None:
+        if httpx is None:
+            sys.exit("The uvicorn mode needs httpx: pip install httpx")
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=120,
+            limits=httpx.Limits(max_connections=connections, max_keepalive_connections=connections),
+        )
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        await self.client.aclose()
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        token: Optional[str] = None,
+        body=None,
+        headers: Optional[dict] = None,
+        first_event: bool = False,
+        keep_body: bool = False,
+    ) -> Tuple[int, int, Optional[bytes]]:
+        nbytes = 0
+        chunks = []
+        async with self.client.stream(
+            method, path, headers=_request_headers(token, headers), json=body
+        ) as response:
+            async for chunk in response.aiter_raw():
+                nbytes += len(chunk)
+                if keep_body:
+                    chunks.append(chunk)
+                if first_event and chunk:
+                    break
+            return response.status_code, nbytes, b"".join(chunks) if keep_body else None
+
+
+# ----------------------------------------------------------------------
+#
+#  SCENARIOS
+#
+# Each scenario picks a user and job and returns the request to make:
+# (method, path, body, extra headers, first_event).
+
+
+def _pick(rng: random.Random, tree: dict, user: dict, status: Optional[str] = None):
+    jobs = [j for j in user["jobs"] if status is None or j["status"] == status] or user["jobs"]
+    job = rng.choice(jobs)["name"]
+    return job, rng.choice(tree["series_files"]), rng.choice(tree["columns"])
+
+
+def scenario_request(name: str, rng: random.Random, tree: dict, user: dict):
+    job, series, variable = _pick(rng, tree, user)
+    if name == "list_jobs":
+        return "GET", "/jobs?limit=50&sort=updated&order=desc", None, None, False
+    if name == "job_details":
+        return "GET", f"/job/{job}", None, None, False
+    if name == "outputs":
+        return "GET", f"/jobs/{job}/outputs", None, None, False
+    if name == "variables":
+        return "GET", f"/get-variables/{job}/{series}", None, None, False
+    if name == "plot":
+        body = {"job_name": job, "data_file_name": series, "variable": variable, "max_points": 1000}
+        return "POST", "/get-plot-data", body, None, False
+    if name == "plot_batch":
+        items = [{"data_file_name": f, "variables": tree["columns"][:3]} for f in tree["series_files"]]
+        return "POST", "/get-plot-data-batch", {"job_name": job, "items": items, "max_points": 1000}, None, False
+    if name == "log_tail":
+        return "GET", f"/get-log/{job}?tail=100", None, None, False
+    if name == "plot_stream":
+        # A finished job's file, sent in full (downsampled); the stream then ends.
+        job, series, variable = _pick(rng, tree, user, "COMPLETE")
+        query = f"job_name={job}&data_file_name={series}&variable={variable.replace(' ', '%20')}&max_points=1000"
+        return "GET", f"/get-plot-data-stream?{query}", None, None, False
+    if name == "log_stream":
+        # A client catching up with a finished job's whole log.
+        job, _, _ = _pick(rng, tree, user, "COMPLETE")
+        return "GET", f"/stream-output/{job}", None, {"last-event-id": "0"}, False
+    if name == "job_events":
+        return "GET", "/job-events", None, None, True
+    if name == "setup":
+        body = {"base_config": "bench", "user_config": "bench", "run_length": "10", "modifications": ""}
+        return "POST", f"/setup/{rng.choice(user['setup_jobs'])}", body, None, False
+    if name == "login":
+        body = {"email": user["email"], "password": BENCH_PASSWORD}
+        return "POST", "/auth/login", body, None, False
+    if name == "download":
+        return "GET", f"/jobs/{job}/download", None, None, False
+    raise ValueError(f"Unknown scenario '{name}'")
+
+
+# ----------------------------------------------------------------------
+#
+#  LOAD GENERATION AND RESULTS
+#
+
+
+def rss_bytes(pid: int) -> Optional[int]:
+    """
+    Resident memory of a process and its children (Linux only).
+    """
+    try:
+        children = {}
+        for entry in os.listdir("/proc"):
+            if entry.isdigit():
+                try:
+                    with open(f"/proc/{entry}/stat") as fp:
+                        ppid = int(fp.read().rsplit(")", 1)[1].split()[1])
+                except (OSError, IndexError, ValueError):
+                    continue
+                children.setdefault(ppid, []).append(int(entry))
+        total = 0
+        pids = [pid]
+        while pids:
+            p = pids.pop()
+            pids.extend(children.get(p, []))
+            with open(f"/proc/{p}/statm") as fp:
+                total += int(fp.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        return total
+    except (OSError, ValueError):
+        return None
+
+
+async def login_users(client, tree: dict) -> Dict[int, str]:
+    """
+    Tokens for the tree's users, registering them on first use.
+    """
+    tokens = {}
+    for user in tree["users"]:
+        credentials = {"email": user["email"], "password": BENCH_PASSWORD}
+        await client.request("POST", "/auth/register", body=credentials)  # 400 if registered
+        status, _, body = await client.request("POST", "/auth/login", body=credentials, keep_body=True)
+        payload = json.loads(body or b"{}")
+        if status != 200 or "token" not in payload:
+            sys.exit(f"Could not log in as {user['email']}: {payload}")
+        tokens[user["id"]] = payload["token"]
+    return tokens
+
+
+async def run_load(
+    client,
+    tree: dict,
+    tokens: Dict[int, str],
+    mix: Dict[str, float],
+    concurrency: int,
+    duration: float,
+    warmup: float,
+    seed: int,
+    server_pid: int,
+) -> dict:
+    """
+    Drive the request mix from concurrent closed-loop clients: each
+    sends its next request as soon as the previous one has finished.
+    Requests finishing during the warm-up period aren't counted.
+    """
+    names = [n for n, w in mix.items() if w > 0]
+    weights = [mix[n] for n in names]
+    samples: Dict[str, List[float]] = {n: [] for n in names}
+    errors: Dict[str, int] = {n: 0 for n in names}
+    nbytes: Dict[str, int] = {n: 0 for n in names}
+    start = time.perf_counter()
+    measure_from = start + warmup
+    stop_at = measure_from + duration
+    rss = {"start": rss_bytes(server_pid), "peak": 0}
+
+    async def worker(i: int):
+        rng = random.Random(seed * 1000 + i)
+        while True:
+            name = rng.choices(names, weights)[0]
+            user = rng.choice(tree["users"])
+            method, path, body, headers, first_event = scenario_request(name, rng, tree, user)
+            t0 = time.perf_counter()
+            try:
+                status, n, _ = await client.request(
+                    method, path, tokens[user["id"]], body, headers, first_event
+                )
+            except Exception:
+                status, n = 599, 0
+            t1 = time.perf_counter()
+            if t1 >= stop_at:
+                return
+            if t1 >= measure_from:
+                samples[name].append(t1 - t0)
+                nbytes[name] += n
+                if status >= 400:
+                    errors[name] += 1
+
+    async def watch_memory():
+        while True:
+            value = rss_bytes(server_pid)
+            if value:
+                rss["peak"] = max(rss["peak"], value)
+            await asyncio.sleep(0.5)
+
+    watcher = asyncio.create_task(watch_memory())
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    watcher.cancel()
+    rss["end"] = rss_bytes(server_pid)
+    return summarise(samples, errors, nbytes, duration, rss)
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """
+    Nearest-rank percentile of sorted values.
+    """
+    if not values:
+        return None
+    rank = max(1, int(round(q / 100 * len(values) + 0.5)))
+    return values[min(rank, len(values)) - 1]
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def _mb(nbytes: Optional[int]) -> Optional[float]:
+    return None if not nbytes else round(nbytes / 2**20, 1)
+
+
+def _latency_stats(values: List[float], duration: float) -> dict:
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "throughput_rps": round(len(values) / duration, 2),
+        "mean_ms": _ms(sum(values) / len(values)) if values else None,
+        "p50_ms": _ms(percentile(values, 50)),
+        "p95_ms": _ms(percentile(values, 95)),
+        "p99_ms": _ms(percentile(values, 99)),
+        "max_ms": _ms(values[-1]) if values else None,
+    }
+
+
+def summarise(samples, errors, nbytes, duration: float, rss: dict) -> dict:
+    scenarios = {}
+    for name, values in samples.items():
+        stats = _latency_stats(values, duration)
+        stats["errors"] = errors[name]
+        stats["bytes"] = nbytes[name]
+        scenarios[name] = stats
+    overall = _latency_stats([v for values in samples.values() for v in values], duration)
+    overall["errors"] = sum(errors.values())
+    return {
+        "overall": overall,
+        "scenarios": scenarios,
+        "memory": {
+            "rss_start_mb": _mb(rss["start"]),
+            "rss_peak_mb": _mb(rss["peak"]),
+            "rss_end_mb": _mb(rss["end"]),
+        },
+    }
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return sp.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, sp.CalledProcessError):
+        return None
+
+
+def parse_mix(spec: Optional[str]) -> Dict[str, float]:
+    """
+    Request mix from "name=weight,..." (scenarios not named keep their
+    default weight; weight 0 leaves one out) or "only:name,...".
+    """
+    mix = dict(DEFAULT_MIX)
+    if not spec:
+        return mix
+    if spec.startswith("only:"):
+        names = [n.strip() for n in spec[5:].split(",") if n.strip()]
+        mix = {n: (1 if n in names else 0) for n in mix}
+        unknown = set(names) - set(DEFAULT_MIX)
+    else:
+        unknown = set()
+        for item in spec.split(","):
+            name, _, weight = item.partition("=")
+            name = name.strip()
+            if name not in mix:
+                unknown.add(name)
+                continue
+            mix[name] = float(weight)
+    if unknown:
+        sys.exit(f"Unknown scenario(s): {', '.join(sorted(unknown))}")
+    return mix
+
+
+async def loop_lag(client) -> Optional[dict]:
+    """
+    The API's event loop lag (ctoaster_event_loop_lag_seconds from
+    /metrics), in milliseconds.
+    """
+    status, _, body = await client.request("GET", "/metrics", keep_body=True)
+    if status != 200:
+        return None
+    lag = {}
+    for line in (body or b"").decode().splitlines():
+        if line.startswith("ctoaster_event_loop_lag_seconds{"):
+            labels, _, value = line.rpartition(" ")
+            quantile = labels.split('quantile="', 1)[1].split('"', 1)[0]
+            lag[f"{quantile}_ms"] = _ms(float(value))
+    return lag or None
+
+
+async def _run(args, tree: dict, client, server_pid: int) -> dict:
+    await client.start()
+    try:
+        tokens = await login_users(client, tree)
+        results = await run_load(
+            client,
+            tree,
+            tokens,
+            parse_mix(args.mix),
+            args.concurrency,
+            args.duration,
+            args.warmup,
+            args.seed,
+            server_pid,
+        )
+        # (Over the monitor's recent window; max since the API started.)
+        results["loop_lag"] = await loop_lag(client)
+        return results
+    finally:
+        await client.stop()
+
+
+def start_uvicorn(root: str, port: int, workers: int) -> sp.Popen:
+    ctoaster_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env["HOME"] = os.path.join(root, "home")  # For the tree's .ctoasterrc
+    env["PYTHONPATH"] = ctoaster_root + os.pathsep + env.get("PYTHONPATH", "")
+    cmd = [
+        sys.executable, "-m", "uvicorn", "tools.REST:app",
+        "--host", "127.0.0.1", "--port", str(port),
+        "--workers", str(workers), "--log-level", "warning",
+    ]
+    proc = sp.Popen(cmd, cwd=ctoaster_root, env=env)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            sys.exit(f"uvicorn exited with code {proc.returncode}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/healthz", timeout=1).status_code == 200:
+                return proc
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.25)
+    proc.kill()
+    sys.exit("uvicorn did not start")
+
+
+def run(args) -> dict:
+    tree_path = os.path.join(args.root, TREE_FILENAME)
+    if not os.path.exists(tree_path):
+        sys.exit(f"No benchmark tree at {args.root}: run generate first")
+    with open(tree_path) as fp:
+        tree = json.load(fp)
+
+    server = None
+    if args.mode == "uvicorn":
+        if httpx is None:
+            sys.exit("The uvicorn mode needs httpx: pip install httpx")
+        server = start_uvicorn(args.root, args.port, args.workers)
+        client = HttpClient(f"http://127.0.0.1:{args.port}", args.concurrency)
+        server_pid = server.pid
+    else:
+        # Point the API at the tree before importing it.
+        from tools import utils as U
+
+        U.ctoaster_cfgfile = os.path.join(args.root, "home", ".ctoasterrc")
+        from tools.REST import app
+
+        client = AsgiClient(app)
+        server_pid = os.getpid()
+
+    try:
+        results = asyncio.run(_run(args, tree, client, server_pid))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    results["meta"] = {
+        "revision": _git_revision(),
+        "label": args.label,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "mode": args.mode,
+        "workers": args.workers if args.mode == "uvicorn" else None,
+        "concurrency": args.concurrency,
+        "duration": args.duration,
+        "warmup": args.warmup,
+        "mix": parse_mix(args.mix),
+        "tree": tree["params"],
+    }
+    return results
+
+
+# ----------------------------------------------------------------------
+#
+#  REPORTS
+#
+
+
+def _fmt(value) -> str:
+    return "-" if value is None else f"{value:.1f}" if isinstance(value, float) else str(value)
+
+
+def print_results(results: dict) -> None:
+    rows = [("scenario", "count", "err", "rps", "p50 ms", "p95 ms", "p99 ms", "max ms")]
+    items = sorted(results["scenarios"].items()) + [("overall", results["overall"])]
+    for name, s in items:
+        rows.append((name, s["count"], s["errors"], s["throughput_rps"], s["p50_ms"], s["p95_ms"], s["p99_ms"], s["max_ms"]))
+    _print_table(rows)
+    memory = results["memory"]
+    print(
+        f"\nRSS: {_fmt(memory['rss_start_mb'])} MB at start, "
+        f"{_fmt(memory['rss_peak_mb'])} MB peak, {_fmt(memory['rss_end_mb'])} MB at end"
+    )
+    lag = results.get("loop_lag")
+    if lag:
+        print(
+            f"Event loop lag: {_fmt(lag.get('p50_ms'))} ms p50, "
+            f"{_fmt(lag.get('p99_ms'))} ms p99, {_fmt(lag.get('max_ms'))} ms max"
+        )
+
+
+def _print_table(rows) -> None:
+    rows = [[_fmt(c) for c in row] for row in rows]
+    widths = [max(len(r[i]) for r in rows) for i in range(len(rows[0]))]
+    for row in rows:
+        print("  ".join(c.ljust(w) if i == 0 else c.rjust(w) for i, (c, w) in enumerate(zip(row, widths))))
+
+
+def _change(old, new) -> str:
+    if old is None or new is None:
+        return "-"
+    if old == 0:
+        return "-" if new == 0 else "+inf"
+    return f"{(new - old) / old * 100:+.1f}%"
+
+
+def compare(base: dict, new: dict) -> None:
+    """
+    Print the changes between two sets of results, per scenario.
+    """
+    for label, results in (("base", base), ("new", new)):
+        meta = results.get("meta", {})
+        name = " ".join(str(x) for x in (meta.get("revision"), meta.get("label")) if x)
+        print(
+            f"{label}: {name} ({meta.get('mode')}, concurrency {meta.get('concurrency')}, "
+            f"{meta.get('time')})"
+        )
+    if base.get("meta", {}).get("tree") != new.get("meta", {}).get("tree"):
+        print("warning: the two runs used different benchmark trees")
+    print()
+    rows = [("scenario", "rps", "change", "p50 ms", "change", "p95 ms", "change", "p99 ms", "change")]
+    names = sorted(set(base["scenarios"]) | set(new["scenarios"]))
+    pairs = [(n, base["scenarios"].get(n), new["scenarios"].get(n)) for n in names]
+    pairs.append(("overall", base["overall"], new["overall"]))
+    for name, b, n in pairs:
+        if not b or not n:
+            continue
+        row = [name]
+        for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms"):
+            row += [n[key], _change(b[key], n[key])]
+        rows.append(row)
+    _print_table(rows)
+    bm, nm = base["memory"], new["memory"]
+    print(
+        f"\nRSS peak: {_fmt(bm['rss_peak_mb'])} -> {_fmt(nm['rss_peak_mb'])} MB "
+        f"({_change(bm['rss_peak_mb'], nm['rss_peak_mb'])})"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the cTOASTER REST API.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    gen = commands.add_parser("generate", help="Write a synthetic job tree")
+    gen.add_argument("--root", required=True, help="Directory for the tree (must not exist)")
+    gen.add_argument("--users", type=int, default=4, help="Number of users")
+    gen.add_argument("--jobs", type=int, default=50, help="Jobs per user")
+    gen.add_argument("--rows", type=int, default=10000, help="Rows per time series file")
+    gen.add_argument("--columns", type=int, default=8, help="Variables per time series file")
+    gen.add_argument("--series-files", type=int, default=2, choices=range(1, len(SERIES_NAMES) + 1), help="Time series files per job")
+    gen.add_argument("--log-lines", type=int, default=2000, help="Lines per job log")
+    gen.add_argument("--running", type=float, default=0.1, help="Fraction of jobs with RUNNING status")
+    gen.add_argument("--setup-jobs", type=int, default=3, help="Jobs per user for setup requests")
+    gen.add_argument("--seed", type=int, default=1)
+
+    run_cmd = commands.add_parser("run", help="Run the benchmark against a tree")
+    run_cmd.add_argument("--root", required=True, help="Tree written by generate")
+    run_cmd.add_argument("--mode", choices=("inprocess", "uvicorn"), default="inprocess")
+    run_cmd.add_argument("--port", type=int, default=8765, help="Port for the uvicorn server")
+    run_cmd.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    run_cmd.add_argument("--concurrency", type=int, default=16, help="Concurrent clients")
+    run_cmd.add_argument("--duration", type=float, default=30, help="Seconds measured")
+    run_cmd.add_argument("--warmup", type=float, default=5, help="Seconds before measuring")
+    run_cmd.add_argument("--mix", help='Request mix: "name=weight,..." or "only:name,..."')
+    run_cmd.add_argument("--seed", type=int, default=1)
+    run_cmd.add_argument("--label", help="Label saved with the results")
+    run_cmd.add_argument("--out", help="Save the results to this JSON file")
+
+    cmp_cmd = commands.add_parser("compare", help="Compare two saved results")
+    cmp_cmd.add_argument("base", help="Results to compare against")
+    cmp_cmd.add_argument("new", help="Results to compare")
+
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        if os.path.exists(args.root) and os.listdir(args.root):
+            sys.exit(f"{args.root} exists and is not empty")
+        t0 = time.time()
+        tree = generate_tree(
+            args.root,
+            args.users,
+            args.jobs,
+            args.rows,
+            args.columns,
+            args.series_files,
+            args.log_lines,
+            args.running,
+            args.setup_jobs,
+            args.seed,
+        )
+        jobs = sum(len(u["jobs"]) + len(u["setup_jobs"]) for u in tree["users"])
+        print(f"Wrote {jobs} jobs for {len(tree['users'])} users to {args.root} in {time.time() - t0:.1f} s")
+    elif args.command == "run":
+        results = run(args)
+        print_results(results)
+        if args.out:
+            with open(args.out, "w") as fp:
+                json.dump(results, fp, indent=2)
+            print(f"Results saved to {args.out}")
+    else:
+        with open(args.base) as fp:
+            base = json.load(fp)
+        with open(args.new) as fp:
+            new = json.load(fp)
+        compare(base, new)
+
+
+if __name__ == "__main__":
+    main()
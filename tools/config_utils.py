@@ -5,8 +5,12 @@ import os
 import re
 import shutil
 import sys
+import threading
 
-import utils as U
+if __package__:
+    from tools import utils as U
+else:
+    import utils as U
 
 # Regex for matching floating point values.
 fp_re = r"[+-]?(\d+(\.\d*)?|\.\d+)([eE][+-]?\d+)?"
@@ -65,9 +69,14 @@ def set_dirs(src, data):
 
 module_info = {}
 flagname_to_mod = {}
+# Loading is done once, by whichever thread asks first (the REST API
+# configures jobs from several threads at a time).
+_module_info_lock = threading.Lock()
 
 
 def load_module_info():
+    info = {}
+    flags = {}
     try:
         with open(os.path.join(U.ctoaster_root, "src/module-info.csv")) as fp:
             reader = csv.reader(fp, skipinitialspace=True)
@@ -75,13 +84,13 @@ def load_module_info():
                 if row[0].startswith("#"):
                     continue  # Correctly skip comment lines
                 flag = f"ma_flag_{row[1]}" if row[1] != "NONE" else row[1]
-                module_info[row[0]] = {
+                info[row[0]] = {
                     "flag_name": flag,
                     "prefix": row[2],
                     "nml_file": row[3],
                     "nml_name": row[4],
                 }
-                flagname_to_mod[flag] = row[0]
+                flags[flag] = row[0]
     except Exception as e:  # Catch and handle exceptions more specifically
         error_msg = "Couldn't open module info file " + os.path.join(
             srcdir, "module-info.csv"
@@ -89,17 +98,26 @@ def load_module_info():
         if not srcdir:
             error_msg = "Internal error: source directory not set!"
         sys.exit(error_msg)
+    # Filled in only once complete: other threads take non-empty
+    # tables as loaded.
+    module_info.update(info)
+    flagname_to_mod.update(flags)
 
 
-def module_from_flagname(flagname):
+def ensure_module_info():
     if not flagname_to_mod:
-        load_module_info()
+        with _module_info_lock:
+            if not flagname_to_mod:
+                load_module_info()
+
+
+def module_from_flagname(flagname):
+    ensure_module_info()
     return flagname_to_mod[flagname]
 
 
 def lookup_module(modname):
-    if not module_info:
-        load_module_info()
+    ensure_module_info()
     return module_info[modname]
 
 
@@ -412,12 +430,15 @@ def copy_data_files(m, nml, outdir, extras):
 # Copy restart files: if restarting from an old ctoaster job, assume
 # that the job is in ~/ctoaster_output.
 
+# Output files a restarted job reads from the job it restarts from
+# (output compaction leaves files matching these alone).
+RESTART_FILE_PATTERNS = ("*rst*", "*restart*", "sedcore.nc")
+
 
 def copy_restart_files(m, nml, outdir, restart_path):
     indir = os.path.join(restart_path, m)
-    fs = glob.glob(os.path.join(indir, "*rst*"))
-    fs += glob.glob(os.path.join(indir, "*restart*"))
-    if os.path.exists(os.path.join(indir, "sedcore.nc")):
-        fs += [os.path.join(indir, "sedcore.nc")]
+    fs = []
+    for pattern in RESTART_FILE_PATTERNS:
+        fs += glob.glob(os.path.join(indir, pattern))
     for f in fs:
         shutil.copy(f, outdir)
@@ -16,6 +16,7 @@ from tkinter import ttk
 from gui import *
 
 # General cTOASTER utilities.
+import exe_store
 import utils as U
 
 # from gui.tooltip import *
@@ -309,9 +310,7 @@ class Application(AfterHandler, ttk.Frame):
             d = BuildExecutableDialog(self, self.job.jobdir)
             if not d.result:
                 return
-        if os.path.exists(runexe):
-            os.remove(runexe)
-        shutil.copy(exe, runexe)
+        exe_store.link_executable(exe, runexe)
 
         # Set up GUI_RESTART command file if this is a restart after a
         # pause.
@@ -336,9 +335,10 @@ class Application(AfterHandler, ttk.Frame):
         # running as being in use, which means you can't overwrite it.
         # If you run a job to completion from the GUI, then extend its
         # run length and try to continue it, this means that you can't
-        # update the cTOASTER executable, as we do above in the line that
-        # says "shutil.copy(exe, runexe)".  If you try to do that, you
-        # get an error saying something like "Text file busy".  The
+        # update the cTOASTER executable in place.  If you try to do
+        # that, you get an error saying something like "Text file
+        # busy".  (link_executable above sidesteps this by renaming a
+        # new link over the old one, but zombies still pile up.)  The
         # solution is to explicitly clean up these child processes
         # when they finish.  If the GUI exits before the model
         # processes that it starts, those processes become orphaned,
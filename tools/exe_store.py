@@ -0,0 +1,214 @@
+import errno
+import hashlib
+import os
+import shutil
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+if __package__:
+    from tools import utils as U
+else:
+    import utils as U
+
+# Content-addressed store for model executables.
+#
+# Each executable is kept once under MODELS/.store in the jobs
+# directory, named by the SHA-256 of its contents, and linked into job
+# directories instead of being copied into every one of them on every
+# run.  Links are hard links where possible (the store lives on the
+# same volume as the jobs), otherwise symbolic links, with a plain copy
+# as the last resort.  The link is made under a temporary name and
+# renamed into place, so a job never sees a half-written executable,
+# and replacing the executable of a model that is still running doesn't
+# fail with "Text file busy".
+#
+# Stored files are read-only: a hard link shares its contents with
+# every other job using the same executable.
+#
+# Each job records the hash of the executable it was given in
+# EXE_HASH_FILENAME, so that a run can be traced back to the exact
+# binary it used.
+#
+# prune_store() removes stored executables that no job links to any
+# more: a stored file with a link count of 1 is only in the store.
+# Symbolic links don't show in the link count, so an executable that
+# has been symlinked into a job is marked (SYMLINKED_SUFFIX) and kept.
+
+STORE_DIRNAME = ".store"
+EXE_HASH_FILENAME = "executable.sha256"
+SYMLINKED_SUFFIX = ".symlinked"
+
+_CHUNK = 1 << 20
+
+# Hashes of source executables, keyed on (path, device, inode, size,
+# mtime), so an unchanged executable is only read once per process.
+_hashes: Dict[Tuple, str] = {}
+_hashes_lock = threading.Lock()
+
+
+def store_dir() -> str:
+    """
+    The executable store of the configured jobs directory.
+    """
+    return os.path.join(U.ctoaster_jobs, "MODELS", STORE_DIRNAME)
+
+
+def file_hash(path: str) -> str:
+    """
+    SHA-256 (hex) of a file's contents.
+    """
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+    with _hashes_lock:
+        digest = _hashes.get(key)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(path, "rb") as fp:
+            for chunk in iter(lambda: fp.read(_CHUNK), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        with _hashes_lock:
+            _hashes[key] = digest
+    return digest
+
+
+def _tmp_name(path: str) -> str:
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def store_executable(exe: str, store: Optional[str] = None) -> Tuple[str, str]:
+    """
+    Add an executable to the store (if it isn't there already).
+
+    :param exe: Path to the executable.
+    :param store: Store directory (default: store_dir()).
+    :return: The executable's hash and the path of the stored copy.
+    """
+    store = store or store_dir()
+    digest = file_hash(exe)
+    stored = os.path.join(store, digest)
+    if os.path.exists(stored):
+        try:
+            os.utime(stored)  # In use: keep prune_store off it
+        except OSError:
+            pass
+    else:
+        os.makedirs(store, exist_ok=True)
+        tmp = _tmp_name(stored)
+        try:
+            shutil.copyfile(exe, tmp)
+            if os.name != "nt":  # Windows can't delete read-only files
+                os.chmod(tmp, 0o555)
+            os.replace(tmp, stored)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    return digest, stored
+
+
+def _same_file(a: str, b: str) -> bool:
+    try:
+        return os.path.samefile(a, b)
+    except OSError:
+        return False
+
+
+def link_executable(exe: str, dest: str, store: Optional[str] = None) -> str:
+    """
+    Put an executable at dest, linked to its copy in the store.
+
+    :param exe: Path to the executable (e.g. a freshly built carrotcake.exe).
+    :param dest: Where the job expects it (e.g. <job>/carrotcake-ship.exe).
+    :param store: Store directory (default: store_dir()).
+    :return: The executable's hash, which is also recorded in
+             EXE_HASH_FILENAME next to dest.
+    """
+    digest, stored = store_executable(exe, store)
+    if not _same_file(dest, stored):
+        tmp = _tmp_name(dest)
+        try:
+            try:
+                os.link(stored, tmp)
+            except OSError as e:
+                # Different device, or a filesystem without hard links.
+                if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP, errno.EACCES):
+                    raise
+                try:
+                    open(stored + SYMLINKED_SUFFIX, "a").close()
+                    os.symlink(os.path.abspath(stored), tmp)
+                except (OSError, NotImplementedError):
+                    shutil.copy(stored, tmp)
+            os.replace(tmp, dest)
+        finally:
+            if os.path.lexists(tmp):
+                os.remove(tmp)
+    record_hash(os.path.dirname(os.path.abspath(dest)), digest, os.path.basename(dest))
+    return digest
+
+
+def record_hash(job_dir: str, digest: str, name: str) -> None:
+    """
+    Record the hash of the executable a job was given.
+    """
+    path = os.path.join(job_dir, EXE_HASH_FILENAME)
+    line = f"{digest}  {name}\n"
+    try:
+        with open(path) as fp:
+            if fp.read() == line:
+                return
+    except OSError:
+        pass
+    tmp = _tmp_name(path)
+    with open(tmp, "w") as fp:
+        fp.write(line)
+    os.replace(tmp, path)
+
+
+def recorded_hash(job_dir: str) -> Optional[str]:
+    """
+    The hash of the executable last linked into a job, if any.
+    """
+    try:
+        with open(os.path.join(job_dir, EXE_HASH_FILENAME)) as fp:
+            return fp.read().split()[0]
+    except (OSError, IndexError):
+        return None
+
+
+def prune_store(store: Optional[str] = None, min_age: float = 3600.0) -> int:
+    """
+    Remove stored executables that no job links to, and temporary files
+    left behind by interrupted links.
+
+    :param store: Store directory (default: store_dir()).
+    :param min_age: Leave files stored or reused more recently than this
+                    (seconds) alone: they may be about to be linked.
+    :return: The number of files removed.
+    """
+    store = store or store_dir()
+    try:
+        entries = list(os.scandir(store))
+    except FileNotFoundError:
+        return 0
+    names = {entry.name for entry in entries}
+    cutoff = time.time() - min_age
+    removed = 0
+    for entry in entries:
+        try:
+            st = entry.stat(follow_symlinks=False)
+            if st.st_mtime > cutoff:
+                continue
+            if entry.name.endswith(".tmp"):
+                os.remove(entry.path)
+                removed += 1
+            elif (
+                len(entry.name) == 64
+                and st.st_nlink == 1
+                and entry.name + SYMLINKED_SUFFIX not in names
+            ):
+                os.remove(entry.path)
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
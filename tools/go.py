@@ -13,6 +13,7 @@ try:
 except ImportError:
     gui_available = False
 
+import exe_store
 import utils as U
 
 
@@ -308,6 +309,9 @@ def clean(clean_model):
         model_config.clean()  # calls method 'clean' for class ModelConfig [utils.py]
         for exe in glob.iglob('carrotcake-*.exe'):
             os.remove(exe)  # finds and removes 'carrotcake-*.exe' files
+        if os.path.exists(exe_store.EXE_HASH_FILENAME):
+            os.remove(exe_store.EXE_HASH_FILENAME)  # and the record of their hash
+        exe_store.prune_store()  # drops stored executables no job uses now
         if os.path.exists('build.log'):
             os.remove('build.log')  # removes 'build.log' if it exists
     if os.path.exists('run.log'):
@@ -345,7 +349,7 @@ def build(cont):
 
     if not need_build:
         message('Build is up to date')
-        shutil.copy(os.path.join(model_dir, 'carrotcake.exe'), os.path.join(os.curdir, exe_name))
+        exe_store.link_executable(os.path.join(model_dir, 'carrotcake.exe'), os.path.join(os.curdir, exe_name))
         if cont: cont()
         return
 
@@ -360,8 +364,8 @@ def build2(result, cont):
     if result == 0:
         line('')
         message('Build OK')
-        shutil.copy(os.path.join(model_dir, 'carrotcake.exe'),
-                    os.path.join(os.curdir, exe_name))
+        exe_store.link_executable(os.path.join(model_dir, 'carrotcake.exe'),
+                                  os.path.join(os.curdir, exe_name))
         if cont: cont()
     else:
         message('BUILD FAILED: see build.log for details')
@@ -10,6 +10,7 @@ import tkinter as tk
 import tkinter.messagebox as tkMB
 from typing import Dict, Optional, Tuple
 
+import jobconfig as J
 import utils as U
 
 # ----------------------------------------------------------------------
@@ -295,8 +296,34 @@ class Job:
 
     def gen_namelists(self) -> None:
         """
-        Generates cTOASTER namelists by running the new-job script.
+        Generates cTOASTER namelists (in-process, or by running the
+        new-job script for model versions set up from their own
+        repository).
         """
+        modfile = None
+        if self.mods:
+            modfile = os.path.join(self.jobdir, "config", "config_mods")
+            with open(modfile, "w") as fp:
+                fp.write(self.mods)
+
+        if not J.needs_version_repo():
+            try:
+                J.configure_job(
+                    self.jobid,
+                    int(self.runlen),
+                    self.base_jobdir,
+                    base_config=self.base_config,
+                    user_config=self.user_config,
+                    config_mods=modfile,
+                    full_config=self.full_config,
+                    restart=self.restart,
+                    t100=bool(self.t100),
+                    gui=True,
+                )
+            except Exception as e:
+                tkMB.showerror("Error", str(e))
+            return
+
         new_job_script = os.path.join(U.ctoaster_root, "tools", "new-job.py")
 
         # Create command line for running new-job.
@@ -309,10 +336,7 @@ class Job:
             cmd.extend(["-c", self.full_config])
         if self.restart:
             cmd.extend(["-r", self.restart])
-        if self.mods:
-            modfile = os.path.join(self.jobdir, "config", "config_mods")
-            with open(modfile, "w") as fp:
-                fp.write(self.mods)
+        if modfile:
             cmd.extend(["-m", modfile])
         cmd.extend(["-j", self.base_jobdir])
         if self.t100:
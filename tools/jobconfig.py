@@ -0,0 +1,412 @@
+import copy
+import datetime
+import os
+import shutil
+import subprocess as sp
+import sys
+import threading
+
+if __package__:
+    from tools import config_utils as C
+    from tools import utils as U
+else:
+    import config_utils as C
+    import utils as U
+
+# Job configuration: set up a job directory (namelists, input data,
+# restart files) from base/user, full or test configurations.
+#
+# This is the body of new-job.py as a function, so that the REST API
+# and the GUI can configure jobs in-process instead of starting a new
+# interpreter for every setup change.  Things that don't change while
+# the process is running -- the list of model versions, the module
+# information, the parsed "*-defaults.nml" namelists and configuration
+# files -- are cached here (files keyed on their modification times).
+# The REST API configures jobs from several threads at once, so the
+# caches are only touched under _lock, and the module information and
+# directories shared through config_utils are set up once.
+
+
+class JobConfigError(Exception):
+    """
+    A job could not be configured; the message says why.
+    """
+
+
+_versions = None
+_git_revision = None
+_namelists = {}
+_configs = {}
+_dirs_set = False
+_lock = threading.RLock()
+
+
+def available_versions():
+    """
+    Model versions (cached U.available_versions()).
+    """
+    global _versions
+    with _lock:
+        if _versions is None:
+            _versions = U.available_versions()
+        return _versions
+
+
+def needs_version_repo(model_version=None):
+    """
+    Whether a model version has to be configured from its own
+    repository clone (by running new-job.py, which switches to it)
+    rather than from this installation.
+    """
+    if model_version is None:
+        model_version = U.ctoaster_version
+    repo_version = "DEVELOPMENT"
+    repo_version_file = os.path.join(U.ctoaster_root, "repo-version")
+    if os.path.exists(repo_version_file):
+        with open(repo_version_file) as fp:
+            repo_version = fp.readline().strip()
+    return model_version != repo_version
+
+
+def _development_revision():
+    global _git_revision
+    with _lock:
+        if _git_revision is None:
+            try:
+                result = sp.run(
+                    ["git", "describe", "--tags", "HEAD"],
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                )
+                _git_revision = result.stdout.strip()
+            except Exception:
+                _git_revision = "UNKNOWN"
+        return _git_revision
+
+
+def _cached(cache, path, load):
+    with _lock:
+        key = os.stat(path).st_mtime
+        entry = cache.get(path)
+        if entry is None or entry[0] != key:
+            entry = (key, load(path))
+            cache[path] = entry
+        return entry[1]
+
+
+def _setup_config_utils():
+    # Source directory and module information, once per process
+    global _dirs_set
+    with _lock:
+        if not _dirs_set:
+            C.set_dirs(os.path.join(U.ctoaster_root, "src"), "data")
+            _dirs_set = True
+    try:
+        C.ensure_module_info()
+    except SystemExit as e:
+        raise JobConfigError(str(e.code))
+
+
+def read_config(path, msg):
+    """
+    Parsed configuration file (cached C.read_config()).
+    """
+    if not os.path.exists(path):
+        raise JobConfigError(f"{msg} not found: {path}")
+    return dict(_cached(_configs, path, lambda p: C.read_config(p, msg)))
+
+
+def defaults_namelist(path):
+    """
+    A fresh copy of a parsed defaults namelist.
+    """
+
+    def load(p):
+        with open(p) as fp:
+            return C.Namelist(fp)
+
+    return copy.deepcopy(_cached(_namelists, path, load))
+
+
+def lookup_module(modname):
+    try:
+        return C.lookup_module(modname)
+    except SystemExit as e:
+        raise JobConfigError(str(e.code))
+
+
+def clear_caches():
+    global _versions, _git_revision
+    with _lock:
+        _versions = None
+        _git_revision = None
+        _namelists.clear()
+        _configs.clear()
+
+
+def configure_job(
+    job_name,
+    run_length,
+    job_dir_base,
+    base_config=None,
+    user_config=None,
+    config_mods=None,
+    full_config=None,
+    restart=None,
+    old_restart=False,
+    t100=False,
+    test_job=None,
+    model_version=None,
+    overwrite=False,
+    gui=False,
+):
+    """
+    Set up a job directory.
+
+    :param job_name: Job name (the test name for test jobs).
+    :param run_length: Run length in years (ignored for test jobs).
+    :param job_dir_base: Directory in which the job directory lives.
+    :param gui: The caller has created the job directory and written
+        its config/config (and config_mods) files already.
+    :return: The job directory.
+    :raises JobConfigError: if the configuration is invalid.
+    """
+    if model_version is None:
+        model_version = U.ctoaster_version
+    if model_version not in available_versions():
+        raise JobConfigError(f'Model version "{model_version}" does not exist')
+
+    # Check configuration file options.
+
+    base_and_user_config = base_config and user_config
+    if not base_and_user_config and not full_config and not test_job:
+        raise JobConfigError(
+            "Either base and user, full configuration or test must be specified"
+        )
+    if not base_and_user_config and config_mods:
+        raise JobConfigError(
+            "Configuration mods can only be specified if using base and user configuration"
+        )
+    if sum(1 for x in (base_and_user_config, full_config, test_job) if x) > 1:
+        raise JobConfigError(
+            "Only one of base and user, full configuration, or test may be specified"
+        )
+
+    if test_job:
+        test_dir = os.path.join(U.ctoaster_test, test_job)
+        with open(os.path.join(test_dir, "test_info")) as fp:
+            for line in fp:
+                k, _, v = line.partition(":")
+                k = k.strip()
+                v = v.strip()
+                if k == "restart_from":
+                    restart = v
+                elif k == "run_length":
+                    run_length = int(v)
+                elif k == "t100":
+                    t100 = v == "True"
+
+    # Check for existence of any restart job.
+
+    restart_path = None
+    if restart:
+        if old_restart:
+            restart_path = os.path.join(os.path.expanduser("~/ctoaster_output"), restart)
+        elif os.path.exists(restart):
+            restart_path = restart
+        else:
+            restart_path = os.path.join(job_dir_base, restart, "output")
+        if not os.path.exists(restart_path):
+            raise JobConfigError(
+                f'Old ctoaster restart job "{restart}" does not exist'
+                if old_restart
+                else f'Restart job "{restart}" does not exist'
+            )
+
+    # Read and parse configuration files.
+
+    if base_and_user_config:
+        if not os.path.exists(base_config):
+            base_config_dir = os.path.join(U.ctoaster_data, "base-configs")
+            base_config_path = os.path.join(base_config_dir, base_config + ".config")
+        else:
+            base_config_dir = os.getcwd()
+            base_config_path = base_config
+        base = read_config(base_config_path, "Base configuration")
+        if not os.path.exists(user_config):
+            user_config_dir = os.path.join(U.ctoaster_data, "user-configs")
+            user_config_path = os.path.join(user_config_dir, user_config)
+        else:
+            user_config_dir = os.getcwd()
+            user_config_path = user_config
+        user = read_config(user_config_path, "User configuration")
+        configs = [base, user]
+        if config_mods:
+            configs.append(read_config(config_mods, "Configuration modifications"))
+    elif full_config:
+        if not os.path.exists(full_config):
+            full_config_dir = os.path.join(U.ctoaster_data, "full-configs")
+            full_config_path = os.path.join(full_config_dir, full_config + ".config")
+        else:
+            full_config_dir = os.getcwd()
+            full_config_path = full_config
+        configs = [read_config(full_config_path, "Full configuration")]
+    else:
+        # Test job -- read base_config, user_config and full_config files
+        # as they exist.
+        if os.path.exists(os.path.join(test_dir, "full_config")):
+            configs = [read_config(os.path.join(test_dir, "full_config"), "Full configuration")]
+        else:
+            configs = [
+                read_config(os.path.join(test_dir, "base_config"), "Base configuration"),
+                read_config(os.path.join(test_dir, "user_config"), "User configuration"),
+            ]
+
+    # Set up source and per-module input data directories.
+
+    srcdir = os.path.join(U.ctoaster_root, "src")
+    _setup_config_utils()
+
+    # Determine modules used in job.
+
+    mod_flags = [{k: v for k, v in c.items() if k.startswith("ma_flag_")} for c in configs]
+    merged_mod_flags = C.merge_flags(mod_flags)
+    try:
+        modules = [C.module_from_flagname(k) for k, v in merged_mod_flags.items() if v]
+    except SystemExit as e:
+        raise JobConfigError(str(e.code))
+
+    # Set up job directory and per-module sub-directories.
+
+    job_dir = os.path.join(job_dir_base, job_name)
+    if not gui:
+        if overwrite:
+            shutil.rmtree(job_dir, ignore_errors=True)
+        try:
+            os.makedirs(job_dir, exist_ok=True)
+        except OSError:
+            raise JobConfigError("Can't create job directory: " + job_dir)
+    try:
+        for m in modules + ["main"]:
+            os.makedirs(os.path.join(job_dir, "input", m), exist_ok=True)
+            os.makedirs(os.path.join(job_dir, "output", m), exist_ok=True)
+            if restart:
+                os.makedirs(os.path.join(job_dir, "restart", m), exist_ok=True)
+    except Exception as e:
+        print(e, file=sys.stderr)
+
+    # Write configuration information to job directory.
+
+    cfg_dir = os.path.join(job_dir, "config")
+    if not gui:
+        if os.path.exists(cfg_dir) and overwrite:
+            shutil.rmtree(cfg_dir)
+        os.makedirs(cfg_dir, exist_ok=True)
+
+        if not test_job:
+            with open(os.path.join(cfg_dir, "config"), "w") as fp:
+                if base_config:
+                    print(f"base_config_dir: {base_config_dir}", file=fp)
+                    print(f"base_config: {base_config}", file=fp)
+                if user_config:
+                    print(f"user_config_dir: {user_config_dir}", file=fp)
+                    print(f"user_config: {user_config}", file=fp)
+                if full_config:
+                    print(f"full_config_dir: {full_config_dir}", file=fp)
+                    print(f"full_config: {full_config}", file=fp)
+                if config_mods:
+                    print(f"config_mods: {config_mods}", file=fp)
+                print(f"config_date: {datetime.datetime.today()}", file=fp)
+                print(f"run_length: {run_length}", file=fp)
+                print(f"t100: {t100}", file=fp)
+                if restart:
+                    print(f"restart: {restart}", file=fp)
+
+    if test_job:
+        shutil.copyfile(os.path.join(test_dir, "test_info"), os.path.join(cfg_dir, "config"))
+        for name in ["base_config", "user_config", "full_config"]:
+            if os.path.exists(os.path.join(test_dir, name)):
+                shutil.copyfile(os.path.join(test_dir, name), os.path.join(cfg_dir, name))
+    else:
+        if base_config:
+            shutil.copyfile(base_config_path, os.path.join(cfg_dir, "base_config"))
+        if user_config:
+            shutil.copyfile(user_config_path, os.path.join(cfg_dir, "user_config"))
+        if full_config:
+            shutil.copyfile(full_config_path, os.path.join(cfg_dir, "full_config"))
+        if config_mods and not gui:
+            shutil.copyfile(config_mods, os.path.join(cfg_dir, "config_mods"))
+
+    # Extract coordinate definitions from configuration.
+
+    defines = C.extract_defines(configs)
+
+    # Set up timestepping and restart options: this is only done if we
+    # have a base+user configuration (i.e. the normal case); some test
+    # configurations already include timestepping options.
+
+    if len(configs) > 1:
+        tsopts = C.timestepping_options(run_length, defines, t100=t100, quiet=gui)
+        rstopts = C.restart_options(restart)
+        configs = [configs[0], tsopts, rstopts] + configs[1:]
+
+    # Create model version file for build.
+
+    with open(os.path.join(cfg_dir, "model-version"), "w") as fp:
+        if model_version == "DEVELOPMENT":
+            print(f"DEVELOPMENT:{_development_revision()}", file=fp)
+        else:
+            print(model_version, file=fp)
+
+    # Create "go" script for job.
+
+    shutil.copy(os.path.join(U.ctoaster_root, "tools", "go"), job_dir)
+    shutil.copy(os.path.join(U.ctoaster_root, "tools", "go.bat"), job_dir)
+
+    # Set up per-module extra data files (these are files that don't
+    # appear in any configuration information...).
+
+    extra_data_files = {}
+    if "embm" in modules and "ents" in modules:
+        extra_data_files["embm"] = [
+            "inv_linterp_matrix.dat",
+            "NCEP_airt_monthly.dat",
+            "NCEP_pptn_monthly.dat",
+            "NCEP_RH_monthly.dat",
+            "atm_albedo_monthly.dat",
+            "uvic_windx.silo",
+            "uvic_windy.silo",
+            "monthly_windspd.silo",
+        ]
+    if "ents" in modules:
+        extra_data_files["ents"] = ["ents_config.par", "sealevel_config.par"]
+    if "sedgem" in modules:
+        extra_data_files["sedgem"] = ["lookup_calcite_4.dat", "lookup_opal_5.dat"]
+
+    # Construct namelists and copy data files.
+
+    configs.append(C.make_coordinates(defines))
+    for m in modules + ["main", "gem"]:
+        minfo = lookup_module(m)
+        if minfo["flag_name"] == "NONE":
+            nmlin = os.path.join(srcdir, m + "-defaults.nml")
+        else:
+            nmlin = os.path.join(srcdir, m, m + "-defaults.nml")
+        nmlout = os.path.join(job_dir, "data_" + minfo["nml_file"])
+        nml = defaults_namelist(nmlin)
+        nml.merge(minfo["prefix"], configs)
+        with open(nmlout, "w") as ofp:
+            nml.write(ofp)
+        C.copy_data_files(m, nml, os.path.join(job_dir, "input", m), extra_data_files.get(m))
+        if restart:
+            C.copy_restart_files(m, nml, os.path.join(job_dir, "restart", m), restart_path)
+
+    # Extra data files for main program.
+
+    jobmaindatadir = os.path.join(job_dir, "input", "main")
+    srcmaindatadir = os.path.join(U.ctoaster_root, "data", "main")
+    for s in ["atm", "ocn", "sed"]:
+        shutil.copy(os.path.join(srcmaindatadir, "tracer_define." + s), jobmaindatadir)
+
+    return job_dir
@@ -0,0 +1,128 @@
+# server/__init__.py content
+#
+# Support modules for the cTOASTER REST API (tools/REST.py): run
+# scheduling, job status handling and friends.  These are kept out of
+# REST.py so that they can be shared with stand-alone entry points.
+
+from .archive import *
+from .blocking import *
+from .channel import *
+from .compaction import *
+from .conditional import *
+from .disk_usage import *
+from .downsample import *
+from .encoding import *
+from .job_index import *
+from .launch import *
+from .metrics import *
+from .outputs import *
+from .profiler import *
+from .run_queue import *
+from .scheduler import *
+from .selection import *
+from .series_cache import *
+from .status import *
+from .status_watch import *
+from .supervisor import *
+from .tail import *
+from .user_store import *
+
+__all__ = [
+    "RunScheduler",
+    "QueuedRun",
+    "RunQueue",
+    "RunWorker",
+    "SharedRunScheduler",
+    "RUN_QUEUE_FILENAME",
+    "BlockingPools",
+    "LoopLagMonitor",
+    "Channel",
+    "ChannelError",
+    "merge_updates",
+    "OutputCompactor",
+    "COMPACTION_INDEX",
+    "expand_outputs",
+    "PRIVATE_REVALIDATE",
+    "PUBLIC_SHORT",
+    "conditional",
+    "file_validator",
+    "http_date",
+    "is_not_modified",
+    "tree_validator",
+    "ARROW_STREAM_TYPE",
+    "COLUMNS_TYPE",
+    "JSON_TYPE",
+    "CompressionMiddleware",
+    "arrow_stream",
+    "available_encodings",
+    "available_series_types",
+    "negotiate",
+    "pack_columns",
+    "unpack_columns",
+    "is_compactable",
+    "open_output",
+    "read_output",
+    "split_codec",
+    "stored_file",
+    "DiskUsage",
+    "USAGE_FILENAME",
+    "QUOTA_OK",
+    "QUOTA_SOFT",
+    "QUOTA_HARD",
+    "measure_tree",
+    "parse_size",
+    "quota_state",
+    "iter_files",
+    "zip_stream",
+    "downsample",
+    "downsample_indices",
+    "lttb_indices",
+    "minmax_indices",
+    "minmax_buckets",
+    "JobIndex",
+    "JOB_INDEX_FILENAME",
+    "read_job_config",
+    "JobSelection",
+    "SELECTION_FILENAME",
+    "launch_model",
+    "METRICS_CONTENT_TYPE",
+    "Counter",
+    "Gauge",
+    "Histogram",
+    "HttpMetrics",
+    "MetricsMiddleware",
+    "MetricsRegistry",
+    "ModelMetrics",
+    "StepRates",
+    "serve_metrics",
+    "volume_usage",
+    "OutputCatalogue",
+    "ProfilerMiddleware",
+    "RequestProfiler",
+    "read_netcdf_header",
+    "is_series_file",
+    "is_output_file",
+    "model_executable",
+    "read_status_file",
+    "job_status",
+    "SeriesCache",
+    "SeriesData",
+    "parse_header",
+    "parse_rows",
+    "StatusWatcher",
+    "parse_status_line",
+    "ModelSupervisor",
+    "SupervisedProcess",
+    "RUNS_DIRNAME",
+    "default_supervisor",
+    "parse_cpu_list",
+    "read_run_records",
+    "TailHub",
+    "last_line_end",
+    "last_lines_offset",
+    "read_range",
+    "parse_event_id",
+    "split_lines",
+    "TTLCache",
+    "UserStore",
+]
@@ -0,0 +1,137 @@
+import fnmatch
+import os
+import zipfile
+from typing import Iterator, List, Optional, Sequence
+
+from tools.server.compaction import COMPACTION_FILES, open_stored, split_codec
+
+# Streaming zip archives of job directories.
+#
+# The archive is written by zipfile into a write-only buffer that is
+# drained after every block of input, so the response starts with the
+# first compressed bytes and memory use doesn't depend on the size of
+# the job.  Because the output can't be seeked, each member's sizes
+# and CRC follow its data (zipfile handles this by itself when the
+# file object has no tell()/seek()).
+#
+# Compressed outputs of completed jobs (see compaction.py) go into the
+# archive decompressed, under their original names.
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class _ChunkWriter:
+    """
+    Write-only, unseekable file object collecting zipfile's output.
+    """
+
+    def __init__(self) -> None:
+        self.chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _matches(relpath: str, patterns: Sequence[str]) -> bool:
+    # A pattern matches a path relative to the job directory, or just
+    # its last component; "dir/" patterns match directories.
+    name = relpath.rsplit("/", 1)[-1]
+    for pattern in patterns:
+        pattern = pattern.rstrip("/")
+        if fnmatch.fnmatchcase(relpath, pattern) or fnmatch.fnmatchcase(name, pattern):
+            return True
+    return False
+
+
+def iter_files(
+    root: str,
+    include: Optional[Sequence[str]] = None,
+    exclude: Optional[Sequence[str]] = None,
+) -> Iterator[str]:
+    """
+    Paths (relative, "/"-separated) of the files under root, in a stable
+    order.  Excluded directories are not descended into.
+
+    :param include: If given, only files matching one of these glob
+        patterns, or inside a directory that does, are listed.
+    :param exclude: Files and directories matching any of these glob
+        patterns are left out.
+    """
+    exclude = exclude or ()
+    for dirpath, dirnames, filenames in os.walk(root):
+        rel_dir = os.path.relpath(dirpath, root).replace(os.sep, "/")
+        rel_dir = "" if rel_dir == "." else rel_dir + "/"
+        dirnames[:] = sorted(d for d in dirnames if not _matches(rel_dir + d, exclude))
+        names = set(filenames)
+        for filename in sorted(filenames):
+            if filename in COMPACTION_FILES:
+                continue
+            original, codec = split_codec(filename)
+            if codec is not None and original in names:
+                continue  # Being compressed right now: take the original.
+            # Patterns match the names files had before compression.
+            relpath = rel_dir + original
+            if _matches(relpath, exclude):
+                continue
+            if include:
+                parts = relpath.split("/")
+                if not any(
+                    _matches("/".join(parts[: i + 1]), include) for i in range(len(parts))
+                ):
+                    continue
+            yield rel_dir + filename
+
+
+def zip_stream(
+    root: str,
+    files: Sequence[str],
+    compresslevel: int = 6,
+    chunk_size: int = CHUNK_SIZE,
+) -> Iterator[bytes]:
+    """
+    Generate a zip archive of files (relative to root) a block at a time.
+
+    :param compresslevel: 0 (store) to 9 (best deflate compression).
+    """
+    out = _ChunkWriter()
+    compression = zipfile.ZIP_STORED if compresslevel == 0 else zipfile.ZIP_DEFLATED
+    with zipfile.ZipFile(out, "w", compression=compression, compresslevel=compresslevel or None) as zf:
+        for relpath in files:
+            path = os.path.join(root, relpath)
+            member, codec = split_codec(relpath)
+            try:
+                src = open_stored(path, codec)
+            except (OSError, ValueError):
+                continue  # Removed (or unreadable) since it was listed.
+            with src:
+                zinfo = zipfile.ZipInfo.from_file(path, member)
+                zinfo.compress_type = compression
+                # As ZipFile.write does: members opened from a ZipInfo
+                # take their compression level from it.
+                zinfo._compresslevel = zf.compresslevel
+                # (The size of a decompressed file isn't known up front.)
+                with zf.open(zinfo, "w", force_zip64=codec is not None) as dest:
+                    while True:
+                        block = src.read(chunk_size)
+                        if not block:
+                            break
+                        dest.write(block)
+                        data = out.drain()
+                        if data:
+                            yield data
+            data = out.drain()
+            if data:
+                yield data
+    # Central directory.
+    data = out.drain()
+    if data:
+        yield data
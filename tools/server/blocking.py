@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Thread pools for blocking work done by async request handlers.
+#
+# Anything that blocks -- password hashing, running the job setup
+# script, reading files on the jobs volume, compressing archives -- is
+# handed to a pool for its category, so the event loop (and with it
+# every open SSE stream) keeps running.  Each category has its own
+# bounded pool, so that e.g. a burst of logins can't use up the threads
+# needed to read files.  PBKDF2 and zlib release the GIL, so threads
+# are enough here; no process pool is needed.
+#
+# The event loop lag monitor measures how late a periodic timer fires,
+# which is how long the loop was kept from running anything else.
+
+DEFAULT_POOL_SIZES = {
+    "hash": 4,  # Password hashing (PBKDF2)
+    "subprocess": 4,  # External commands (new-job.py)
+    "io": 16,  # File reads and writes on the jobs volume
+    "archive": 2,  # Zip downloads
+}
+
+
+class BlockingPools:
+    """
+    One bounded thread pool per category of blocking work.
+    """
+
+    def __init__(self, sizes: Optional[Dict[str, int]] = None) -> None:
+        """
+        :param sizes: Threads per category (defaults: DEFAULT_POOL_SIZES).
+        """
+        self.sizes = dict(DEFAULT_POOL_SIZES)
+        self.sizes.update(sizes or {})
+        self.executors: Dict[str, ThreadPoolExecutor] = {}
+        self.active: Dict[str, int] = {name: 0 for name in self.sizes}
+        self.waiting: Dict[str, int] = {name: 0 for name in self.sizes}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "BlockingPools":
+        """
+        Pool sizes from CTOASTER_POOL_<CATEGORY> environment variables.
+        """
+        sizes = {}
+        for name in DEFAULT_POOL_SIZES:
+            value = os.environ.get(f"CTOASTER_POOL_{name.upper()}")
+            if value:
+                sizes[name] = max(1, int(value))
+        return cls(sizes)
+
+    def _executor(self, category: str) -> ThreadPoolExecutor:
+        with self.lock:
+            executor = self.executors.get(category)
+            if executor is None:
+                if category not in self.sizes:
+                    raise ValueError(f"Unknown pool category '{category}'")
+                executor = ThreadPoolExecutor(
+                    max_workers=self.sizes[category], thread_name_prefix=f"pool-{category}"
+                )
+                self.executors[category] = executor
+            return executor
+
+    async def run(self, category: str, fn: Callable, *args, **kwargs):
+        """
+        Run fn(*args, **kwargs) in the category's pool and wait for it.
+        """
+        executor = self._executor(category)
+        with self.lock:
+            self.waiting[category] += 1
+
+        def call():
+            with self.lock:
+                self.waiting[category] -= 1
+                self.active[category] += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self.lock:
+                    self.active[category] -= 1
+
+        return await asyncio.get_running_loop().run_in_executor(executor, call)
+
+    async def iterate(self, category: str, iterator):
+        """
+        Drive a blocking iterator from the category's pool, one item at a time.
+        """
+        sentinel = object()
+        while True:
+            item = await self.run(category, next, iterator, sentinel)
+            if item is sentinel:
+                return
+            yield item
+
+    def stats(self) -> Dict[str, dict]:
+        with self.lock:
+            return {
+                name: {
+                    "size": size,
+                    "active": self.active[name],
+                    "waiting": self.waiting[name],
+                }
+                for name, size in self.sizes.items()
+            }
+
+    def shutdown(self) -> None:
+        with self.lock:
+            executors, self.executors = self.executors, {}
+        for executor in executors.values():
+            executor.shutdown(wait=False)
+
+
+class LoopLagMonitor:
+    """
+    Measures event loop lag: how late a timer firing every interval is.
+    """
+
+    def __init__(self, interval: float = 0.25, warn_after: float = 0.5, window: int = 240) -> None:
+        """
+        :param interval: Seconds between measurements.
+        :param warn_after: Log a warning for lags longer than this.
+        :param window: Number of recent measurements kept.
+        """
+        self.interval = interval
+        self.warn_after = warn_after
+        self.samples = deque(maxlen=window)
+        self.max_lag = 0.0
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """
+        Start measuring on the running event loop.
+        """
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - start - self.interval)
+            self.samples.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag > self.warn_after:
+                logger.warning(f"Event loop blocked for {lag:.3f} s")
+
+    def stats(self) -> dict:
+        samples = sorted(self.samples)
+        if not samples:
+            return {"samples": 0, "p50": None, "p99": None, "last": None, "max": None}
+        return {
+            "samples": len(samples),
+            "p50": samples[len(samples) // 2],
+            "p99": samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+            "last": self.samples[-1],
+            "max": self.max_lag,
+        }
@@ -0,0 +1,198 @@
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Multiplexed update channel, one per client connection.
+#
+# A client watching jobs used to hold one streaming HTTP connection per
+# thing it watched: a job's log, each plotted series, status changes.
+# A Channel carries any number of such subscriptions over one
+# connection (the /ws WebSocket), each under an ID the client chose.
+#
+# Flow control is per subscription, by credit: the client says how many
+# messages it is ready for, and grants more as it handles them.  Updates
+# arriving while a subscription has no credit (or while the previous
+# message is still being sent) are coalesced into one pending update --
+# lists are joined, dicts merged, other values replaced by the newer --
+# and sent as a single message when credit comes.  Once the pending
+# update reaches max_pending items the subscription stops reading its
+# source altogether; the sources used here (the shared file tailer, the
+# status watcher) catch up by themselves or drop the oldest events, so a
+# slow subscriber holds back nobody else.
+
+Update = Dict[str, Any]
+
+
+def merge_updates(old: Update, new: Update) -> Update:
+    """
+    Coalesce two updates: lists are joined, dicts merged (newer values
+    win) and anything else replaced by the newer value.
+    """
+    merged = dict(old)
+    for key, value in new.items():
+        if isinstance(value, list) and isinstance(merged.get(key), list):
+            merged[key] = merged[key] + value
+        elif isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = {**merged[key], **value}
+        else:
+            merged[key] = value
+    return merged
+
+
+def update_size(update: Update) -> int:
+    """
+    Number of items (list entries and dict values) in an update.
+    """
+    return sum(len(v) for v in update.values() if isinstance(v, (list, dict))) or 1
+
+
+class ChannelError(Exception):
+    """
+    A client request on a channel that can't be carried out.
+    """
+
+
+class _Subscription:
+    def __init__(self, sub_id: str, source: AsyncIterator[Update], credit: int) -> None:
+        self.id = sub_id
+        self.source = source
+        self.credit = credit
+        self.pending: Optional[Update] = None
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.changed = asyncio.Condition()
+        self.task: Optional[asyncio.Task] = None
+
+
+class Channel:
+    """
+    Subscriptions multiplexed over one connection, with per-subscription
+    credit and coalescing.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[dict], Awaitable[None]],
+        max_subscriptions: int = 64,
+        max_pending: int = 10000,
+    ) -> None:
+        """
+        :param send: Sends one message (a dict) to the client.
+        :param max_subscriptions: Most subscriptions open at once.
+        :param max_pending: Items coalesced for a subscription before its
+            source is left unread until the client catches up.
+        """
+        self._send = send
+        self.max_subscriptions = max_subscriptions
+        self.max_pending = max_pending
+        self.subscriptions: Dict[str, _Subscription] = {}
+        self.send_lock = asyncio.Lock()
+
+    def subscription_count(self) -> int:
+        return len(self.subscriptions)
+
+    async def send(self, message: dict) -> None:
+        # Messages of different subscriptions must not interleave.
+        async with self.send_lock:
+            await self._send(message)
+
+    def subscribe(self, sub_id: str, source: AsyncIterator[Update], credit: int = 1) -> None:
+        """
+        Start sending a source's updates as "data" messages, followed by
+        an "end" message when the source is exhausted (or "error" if it fails).
+
+        :raises ChannelError: if the ID is in use or there are too many
+            subscriptions.
+        """
+        if sub_id in self.subscriptions:
+            raise ChannelError(f"Subscription '{sub_id}' already exists")
+        if len(self.subscriptions) >= self.max_subscriptions:
+            raise ChannelError(f"At most {self.max_subscriptions} subscriptions per connection")
+        sub = _Subscription(sub_id, source, max(credit, 0))
+        self.subscriptions[sub_id] = sub
+        sub.task = asyncio.get_running_loop().create_task(self._run(sub))
+
+    async def unsubscribe(self, sub_id: str) -> bool:
+        """
+        :return: Whether there was such a subscription.
+        """
+        sub = self.subscriptions.pop(sub_id, None)
+        if sub is None:
+            return False
+        sub.task.cancel()
+        try:
+            await sub.task
+        except (asyncio.CancelledError, Exception):
+            pass
+        return True
+
+    async def grant(self, sub_id: str, credit: int) -> None:
+        """
+        Let a subscription send `credit` more messages.
+
+        :raises ChannelError: if there is no such subscription.
+        """
+        sub = self.subscriptions.get(sub_id)
+        if sub is None:
+            raise ChannelError(f"No subscription '{sub_id}'")
+        async with sub.changed:
+            sub.credit += max(credit, 0)
+            sub.changed.notify_all()
+
+    async def close(self) -> None:
+        for sub_id in list(self.subscriptions):
+            await self.unsubscribe(sub_id)
+
+    async def _run(self, sub: _Subscription) -> None:
+        pump = asyncio.get_running_loop().create_task(self._pump(sub))
+        try:
+            while True:
+                async with sub.changed:
+                    await sub.changed.wait_for(
+                        lambda: (sub.credit > 0 and sub.pending is not None)
+                        or (sub.done and sub.pending is None)
+                    )
+                    if sub.pending is None:
+                        break
+                    update, sub.pending = sub.pending, None
+                    sub.credit -= 1
+                    sub.changed.notify_all()
+                await self.send({"type": "data", "id": sub.id, **update})
+            if sub.error is not None:
+                await self.send({"type": "error", "id": sub.id, **_error_fields(sub.error)})
+            else:
+                await self.send({"type": "end", "id": sub.id})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # (The connection has most likely gone.)
+            logger.info(f"Subscription '{sub.id}' stopped: {e}")
+        finally:
+            pump.cancel()
+            if self.subscriptions.get(sub.id) is sub:
+                del self.subscriptions[sub.id]
+
+    async def _pump(self, sub: _Subscription) -> None:
+        try:
+            async for update in sub.source:
+                async with sub.changed:
+                    sub.pending = update if sub.pending is None else merge_updates(sub.pending, update)
+                    sub.changed.notify_all()
+                    # Back-pressure: stop reading until some of it is sent.
+                    await sub.changed.wait_for(
+                        lambda: sub.pending is None or update_size(sub.pending) < self.max_pending
+                    )
+        except Exception as e:
+            sub.error = e
+        finally:
+            async with sub.changed:
+                sub.done = True
+                sub.changed.notify_all()
+
+
+def _error_fields(error: BaseException) -> dict:
+    status = getattr(error, "status_code", None)
+    detail = getattr(error, "detail", None) or str(error) or type(error).__name__
+    return {"status": status or 500, "detail": detail}
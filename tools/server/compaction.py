@@ -0,0 +1,337 @@
+import fnmatch
+import gzip
+import json
+import logging
+import os
+import shutil
+import time
+from typing import BinaryIO, Dict, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from tools.config_utils import RESTART_FILE_PATTERNS
+from tools.server.status import job_status
+
+logger = logging.getLogger(__name__)
+
+# Compression of the outputs of completed jobs.
+#
+# Once a job is COMPLETE its output files never change again, and the
+# ASCII series files in particular compress several times over.  The
+# compactor replaces each output file of a finished job with a
+# compressed copy (x.res -> x.res.gz, or .zst with zstandard installed)
+# and records what it did in an index in the job's output directory.
+# Readers ask for the original name and go through open_output(), which
+# finds whichever copy is there and decompresses it on the fly; the
+# output catalogue, series cache and job downloads all do so, so
+# clients can't tell the difference.
+#
+# Only plot outputs are compressed.  Restart files (anything
+# copy_restart_files would copy, sedcore.nc included) are left alone, as
+# are netCDF-4 files (HDF5, already compressed internally, and read by
+# netCDF4, which needs a real file): new jobs restarting from this one
+# and the model itself must be able to read them as they are.  A job
+# that is run again has its outputs expanded first (expand_outputs, called
+# by launch_model).
+
+COMPACTION_INDEX = ".compacted.json"
+_LOCK_FILE = ".compacted.lock"
+
+# Bookkeeping files, not outputs (left out of downloads).
+COMPACTION_FILES = (COMPACTION_INDEX, _LOCK_FILE)
+
+CODEC_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
+_CHUNK = 1 << 20
+
+
+def available_codecs() -> Tuple[str, ...]:
+    return ("gzip", "zstd") if zstandard is not None else ("gzip",)
+
+
+def is_compactable(name: str) -> bool:
+    """
+    Whether an output file may be compressed once its job is complete.
+    """
+    name = os.path.basename(name)
+    # The files copy_restart_files takes, which it reads by their plain names
+    if any(fnmatch.fnmatchcase(name, pattern) for pattern in RESTART_FILE_PATTERNS):
+        return False
+    return name.endswith(".res") or name.endswith(".nc")
+
+
+def split_codec(name: str) -> Tuple[str, Optional[str]]:
+    """
+    The original name of a compressed output file, and its codec (None
+    for a file that isn't one).
+    """
+    for codec, suffix in CODEC_SUFFIXES.items():
+        if name.endswith(suffix) and is_compactable(name[: -len(suffix)]):
+            return name[: -len(suffix)], codec
+    return name, None
+
+
+def stored_file(path: str) -> Tuple[str, Optional[str]]:
+    """
+    Where the contents of an output file are: the file itself if it is
+    there, otherwise its compressed copy.
+
+    :return: (path, codec), codec None for an uncompressed file.
+    """
+    if os.path.exists(path):
+        return path, None
+    for codec in available_codecs():
+        stored = path + CODEC_SUFFIXES[codec]
+        if os.path.exists(stored):
+            return stored, codec
+    return path, None
+
+
+def open_stored(stored: str, codec: Optional[str]) -> BinaryIO:
+    """
+    Open a stored file for reading, decompressing it if need be.
+    """
+    if codec is None:
+        return open(stored, "rb")
+    if codec == "gzip":
+        return gzip.open(stored, "rb")
+    if codec == "zstd" and zstandard is not None:
+        return zstandard.ZstdDecompressor().stream_reader(open(stored, "rb"), closefd=True)
+    raise ValueError(f"Cannot read {stored}: no {codec} support")
+
+
+def open_output(path: str) -> BinaryIO:
+    """
+    Open an output file by its original name, compressed or not.
+    """
+    return open_stored(*stored_file(path))
+
+
+def read_output(path: str, offset: int = 0) -> bytes:
+    """
+    An output file's contents (by its original name) from offset on.
+    """
+    with open_output(path) as fp:
+        fp.seek(offset)
+        return fp.read()
+
+
+def read_index(output_dir: str) -> dict:
+    try:
+        with open(os.path.join(output_dir, COMPACTION_INDEX)) as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {"files": {}}
+
+
+def original_size(path: str) -> Optional[int]:
+    """
+    The size before compression of a compressed output file (by its
+    original name), from the job's index.
+    """
+    module_dir = os.path.dirname(path)
+    index = read_index(os.path.dirname(module_dir))
+    entry = index["files"].get(f"{os.path.basename(module_dir)}/{os.path.basename(path)}")
+    return entry["size"] if entry else None
+
+
+def _write_index(output_dir: str, index: dict) -> None:
+    path = os.path.join(output_dir, COMPACTION_INDEX)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as fp:
+        json.dump(index, fp, indent=1)
+    os.replace(tmp, path)
+
+
+def _is_classic_netcdf(path: str) -> bool:
+    with open(path, "rb") as fp:
+        return fp.read(3) == b"CDF"
+
+
+class _JobLock:
+    """
+    Lock on a job's outputs, so that two API replicas don't compact the
+    same job at once (and expanding waits for compacting to finish).
+    """
+
+    def __init__(self, output_dir: str, wait: bool = False) -> None:
+        self.path = os.path.join(output_dir, _LOCK_FILE)
+        self.wait = wait
+        self.fp = None
+
+    def __enter__(self) -> bool:
+        self.fp = open(self.path, "a")
+        if fcntl is None:
+            return True
+        try:
+            fcntl.flock(self.fp, fcntl.LOCK_EX if self.wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def __exit__(self, *exc) -> None:
+        self.fp.close()
+
+
+def expand_outputs(job_path: str) -> int:
+    """
+    Decompress a job's compressed outputs (before it runs again).
+
+    :return: The number of files expanded.
+    """
+    output_dir = os.path.join(job_path, "output")
+    if not os.path.exists(os.path.join(output_dir, COMPACTION_INDEX)):
+        return 0
+    count = 0
+    with _JobLock(output_dir, wait=True):
+        index = read_index(output_dir)
+        for relpath in index["files"]:
+            path = os.path.join(output_dir, *relpath.split("/"))
+            stored, codec = stored_file(path)
+            if codec is not None:
+                tmp = f"{path}.{os.getpid()}.tmp"
+                try:
+                    with open_stored(stored, codec) as fin, open(tmp, "wb") as fout:
+                        shutil.copyfileobj(fin, fout, _CHUNK)
+                    st = os.stat(stored)
+                    os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+                    os.replace(tmp, path)
+                finally:
+                    if os.path.exists(tmp):
+                        os.remove(tmp)
+                os.remove(stored)
+                count += 1
+        os.remove(os.path.join(output_dir, COMPACTION_INDEX))
+    return count
+
+
+class OutputCompactor:
+    """
+    Compresses the outputs of completed jobs.
+    """
+
+    def __init__(
+        self,
+        series_cache=None,
+        codec: Optional[str] = None,
+        level: Optional[int] = None,
+        min_size: int = 4096,
+    ) -> None:
+        """
+        :param series_cache: SeriesCache to bring up to date before a
+            series file is compressed (so it needn't be parsed again).
+        :param codec: "gzip" or "zstd" (default: zstd if available).
+        :param level: Compression level (default: the codec's own).
+        :param min_size: Files smaller than this are left as they are.
+        """
+        codec = codec or available_codecs()[-1]
+        if codec not in available_codecs():
+            raise ValueError(f"Compression codec '{codec}' is not available")
+        self.series_cache = series_cache
+        self.codec = codec
+        self.level = level
+        self.min_size = min_size
+
+    def _compress(self, src: str, dest: str) -> None:
+        with open(src, "rb") as fin, open(dest, "wb") as fout:
+            if self.codec == "gzip":
+                # mtime=0 keeps the output the same for the same input.
+                with gzip.GzipFile(
+                    fileobj=fout, mode="wb", compresslevel=self.level or 6, mtime=0
+                ) as gz:
+                    shutil.copyfileobj(fin, gz, _CHUNK)
+            else:
+                cctx = zstandard.ZstdCompressor(level=self.level or 3)
+                cctx.copy_stream(fin, fout, read_size=_CHUNK, write_size=_CHUNK)
+
+    def compact_job(self, job_path: str) -> Dict[str, int]:
+        """
+        Compress the outputs of a COMPLETE job (others are left alone).
+
+        :return: Number of files compressed and bytes before and after.
+        """
+        stats = {"files": 0, "bytes_before": 0, "bytes_after": 0}
+        output_dir = os.path.join(job_path, "output")
+        if job_status(job_path) != "COMPLETE" or not os.path.isdir(output_dir):
+            return stats
+        with _JobLock(output_dir) as locked:
+            if not locked:
+                return stats
+            index = read_index(output_dir)
+            candidates = [
+                (module, name)
+                for module in sorted(os.listdir(output_dir))
+                if os.path.isdir(os.path.join(output_dir, module))
+                for name in sorted(os.listdir(os.path.join(output_dir, module)))
+                if is_compactable(name)
+            ]
+            try:
+                for module, name in candidates:
+                    path = os.path.join(output_dir, module, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    if st.st_size < self.min_size:
+                        continue
+                    if name.endswith(".nc") and not _is_classic_netcdf(path):
+                        continue
+                    if job_status(job_path) != "COMPLETE":
+                        break  # Started again under us.
+                    stored = path + CODEC_SUFFIXES[self.codec]
+                    self._compact_file(path, stored, st)
+                    compressed_size = os.path.getsize(stored)
+                    index["files"][f"{module}/{name}"] = {
+                        "codec": self.codec,
+                        "size": st.st_size,
+                        "compressed_size": compressed_size,
+                        "mtime": st.st_mtime,
+                    }
+                    stats["files"] += 1
+                    stats["bytes_before"] += st.st_size
+                    stats["bytes_after"] += compressed_size
+            finally:
+                # Whatever has been compressed must be in the index.
+                index["compacted_at"] = time.time()
+                _write_index(output_dir, index)
+        if stats["files"]:
+            logger.info(
+                f"Compacted {stats['files']} output files of {job_path}: "
+                f"{stats['bytes_before']} -> {stats['bytes_after']} bytes"
+            )
+        return stats
+
+    def _compact_file(self, path: str, stored: str, st: os.stat_result) -> None:
+        if self.series_cache is not None and path.endswith(".res"):
+            # Parse whatever is left while the plain file is still there.
+            self.series_cache.load(path)
+        tmp = f"{stored}.{os.getpid()}.tmp"
+        try:
+            self._compress(path, tmp)
+            os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+            os.replace(tmp, stored)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        # Readers take the plain file while it is there, so the cache
+        # can be handed over before it goes.
+        if self.series_cache is not None and path.endswith(".res"):
+            self.series_cache.adopt_compressed(path)
+        os.remove(path)
+
+    @staticmethod
+    def is_compacted(job_path: str, since: Optional[float] = None) -> bool:
+        """
+        Whether a job has been compacted (after time since, if given).
+        """
+        index = read_index(os.path.join(job_path, "output"))
+        compacted_at = index.get("compacted_at")
+        return compacted_at is not None and (since is None or compacted_at >= since)
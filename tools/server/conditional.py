@@ -0,0 +1,134 @@
+import datetime
+import email.utils
+import hashlib
+import os
+from typing import Iterable, Optional, Tuple
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+# Conditional GET support: validators, 304 Not Modified and caching
+# policies.
+#
+# Validators for files are built from their inode, size and
+# modification time (in nanoseconds) -- all of which a stat() gives
+# without reading the file -- hashed into a strong ETag.  Responses
+# derived from files (plot data) hash the files' validators together
+# with the request parameters.  A client sending the ETag back in
+# If-None-Match (or the Last-Modified date in If-Modified-Since) gets
+# a 304 with no body, so neither the file read nor the serialisation
+# happens again.
+
+# Caching policies.
+#
+# Per-user data that can change (namelists, setup, logs, plot data):
+# caches may keep it but must check with the server every time.
+PRIVATE_REVALIDATE = "private, no-cache"
+# Shared reference data (the base and user configuration lists).
+PUBLIC_SHORT = "public, max-age=300"
+
+Validator = Tuple[str, Optional[float]]
+
+
+def _stat_key(path: str) -> Tuple[str, Optional[float]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return f"{path}:-", None
+    return f"{path}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}", st.st_mtime
+
+
+def _etag(parts: Iterable[str]) -> str:
+    h = hashlib.sha1()
+    for part in parts:
+        h.update(part.encode("utf-8", "surrogateescape"))
+        h.update(b"\0")
+    return f'"{h.hexdigest()[:32]}"'
+
+
+def file_validator(*paths: str, extra: Iterable[str] = ()) -> Validator:
+    """
+    ETag and last-modified time for the state of some files (missing
+    files count too, so their appearing changes the ETag).
+
+    :param extra: Anything else the response depends on (request
+        parameters, for data derived from the files).
+    """
+    keys = [_stat_key(path) for path in paths]
+    mtimes = [mtime for _, mtime in keys if mtime is not None]
+    return _etag([key for key, _ in keys] + list(extra)), max(mtimes) if mtimes else None
+
+
+def tree_validator(root: str) -> Validator:
+    """
+    ETag and last-modified time for the listing of a directory tree
+    (from the directories' own stat() only).
+    """
+    paths = []
+    for dirpath, dirnames, _ in os.walk(root):
+        dirnames.sort()
+        paths.append(dirpath)
+    return file_validator(*paths)
+
+
+def http_date(timestamp: float) -> str:
+    return email.utils.formatdate(timestamp, usegmt=True)
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    # Weak comparison, as If-None-Match uses.
+    if header.strip() == "*":
+        return True
+    tags = (t.strip() for t in header.split(","))
+    return etag in (t[2:] if t.startswith("W/") else t for t in tags)
+
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[float]) -> bool:
+    """
+    Whether the client's copy (named by its conditional headers) is
+    still current.  If-None-Match takes precedence over If-Modified-Since.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    # (If-Modified-Since only means anything for GET and HEAD.)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None and request.method in ("GET", "HEAD"):
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=datetime.timezone.utc)
+        # HTTP dates have whole seconds.
+        return int(last_modified) <= since.timestamp()
+    return False
+
+
+def conditional(
+    request: Request,
+    response: Response,
+    validator: Validator,
+    cache_control: str = PRIVATE_REVALIDATE,
+    vary: Optional[str] = None,
+) -> Optional[Response]:
+    """
+    Set the validator and caching headers on an endpoint's response,
+    and check the request's conditional headers against them.
+
+    :param response: The response FastAPI will send (the endpoint's
+        `response: Response` parameter).
+    :param vary: Request headers the response depends on (Vary header).
+    :return: A 304 response to send instead, if the client's copy is
+        still current; None if the endpoint should go on and build the body.
+    """
+    etag, last_modified = validator
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    if vary is not None:
+        headers["Vary"] = vary
+    if is_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
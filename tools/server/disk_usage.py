@@ -0,0 +1,406 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Disk usage accounting and quotas for the jobs volume.
+#
+# The bytes used by each job are kept in an SQLite table on the jobs
+# volume, so that a user's total is a sum over their rows rather than
+# a walk over all of their job directories.  A job is measured again
+# (one directory walk) when something changes it: creation, setup, a
+# run stopping, deletion.  A reconcile pass measures everything every
+# so often, to pick up whatever the events missed.
+#
+# Sizes are allocated bytes (st_blocks), not file lengths.  A file
+# with several hard links -- an executable linked from the executable
+# store -- is charged to each link in equal shares.
+#
+# Every user has a soft and a hard quota (either may be unset), from
+# the defaults given to DiskUsage or from a per-user override.  Past
+# the soft quota, requests that use more space still go ahead but
+# carry a warning; past the hard quota they are refused.
+#
+# With several API replicas sharing the volume, only one reconciles at a
+# time, and a reconcile is skipped if any replica did one recently.
+
+USAGE_FILENAME = "usage.db"
+_RECONCILE_LOCK_SUFFIX = ".reconcile-lock"
+
+QUOTA_OK = "ok"
+QUOTA_SOFT = "soft"
+QUOTA_HARD = "hard"
+
+_SIZE_SUFFIXES = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+
+def parse_size(text: Optional[str]) -> Optional[int]:
+    """
+    Bytes from a size such as "500M", "2Gi" or "1048576" (None for an
+    empty string).
+
+    :raises ValueError: if the size is malformed.
+    """
+    if text is None or not text.strip():
+        return None
+    text = text.strip().upper()
+    for suffix in ("IB", "I", "B"):
+        if text.endswith(suffix) and text[:-len(suffix)]:
+            text = text[: -len(suffix)]
+            break
+    number, suffix = (text[:-1], text[-1]) if text[-1] in _SIZE_SUFFIXES else (text, "")
+    return int(float(number) * _SIZE_SUFFIXES[suffix])
+
+
+def measure_tree(path: str) -> Tuple[int, int]:
+    """
+    Allocated bytes and number of files under a directory.
+    """
+    total = 0
+    files = 0
+    stack = [path]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                    continue
+                size = st.st_blocks * 512 if hasattr(st, "st_blocks") else st.st_size
+                total += size // max(st.st_nlink, 1)
+                files += 1
+    return total, files
+
+
+def quota_state(used: int, soft: Optional[int], hard: Optional[int]) -> str:
+    if hard is not None and used >= hard:
+        return QUOTA_HARD
+    if soft is not None and used >= soft:
+        return QUOTA_SOFT
+    return QUOTA_OK
+
+
+class DiskUsage:
+    """
+    Per-job and per-user byte totals for the jobs volume, and quotas.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        jobs_root: str,
+        soft_quota: Optional[int] = None,
+        hard_quota: Optional[int] = None,
+    ) -> None:
+        """
+        :param db_path: Path of the usage database.
+        :param jobs_root: Root of the per-user job directories.
+        :param soft_quota: Default soft quota per user, in bytes.
+        :param hard_quota: Default hard quota per user, in bytes.
+        """
+        self.db_path = db_path
+        self.jobs_root = jobs_root
+        self.soft_quota = soft_quota
+        self.hard_quota = hard_quota
+        self.dirty: Set[Tuple[int, str]] = set()
+        self.lock = threading.Lock()
+        conn = self._connect()
+        try:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS job_usage (
+                    user_id INTEGER NOT NULL,
+                    name TEXT NOT NULL,
+                    bytes INTEGER NOT NULL,
+                    files INTEGER NOT NULL,
+                    measured_at REAL NOT NULL,
+                    PRIMARY KEY (user_id, name)
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS reconciles (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    finished_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS quotas (
+                    user_id INTEGER PRIMARY KEY,
+                    soft_bytes INTEGER,
+                    hard_bytes INTEGER
+                )
+                """
+            )
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _user_root(self, user_id: int) -> str:
+        return os.path.join(self.jobs_root, str(user_id))
+
+    # ------------------------------------------------------------------
+    #  Updates
+
+    def measure(self, user_id: int, name: str) -> Optional[dict]:
+        """
+        Measure one job and store its usage (removing the entry if the
+        job has gone).
+
+        :return: The job's entry, or None if the job does not exist.
+        """
+        path = os.path.join(self._user_root(user_id), name)
+        if not os.path.isdir(path):
+            self.remove(user_id, name)
+            return None
+        size, files = measure_tree(path)
+        entry = {
+            "user_id": user_id,
+            "name": name,
+            "bytes": size,
+            "files": files,
+            "measured_at": time.time(),
+        }
+        conn = self._connect()
+        try:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO job_usage (user_id, name, bytes, files, measured_at)
+                VALUES (:user_id, :name, :bytes, :files, :measured_at)
+                """,
+                entry,
+            )
+        finally:
+            conn.close()
+        return entry
+
+    def remove(self, user_id: int, name: str) -> None:
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM job_usage WHERE user_id = ? AND name = ?", (user_id, name))
+        finally:
+            conn.close()
+
+    def mark_dirty(self, user_id: int, name: str) -> None:
+        """
+        Have a job measured again at the next flush().
+        """
+        with self.lock:
+            self.dirty.add((user_id, name))
+
+    def flush(self) -> int:
+        """
+        Measure the jobs marked dirty since the last flush.
+
+        :return: The number of jobs measured.
+        """
+        with self.lock:
+            dirty, self.dirty = self.dirty, set()
+        for user_id, name in dirty:
+            try:
+                self.measure(user_id, name)
+            except Exception as e:
+                logger.error(f"Disk usage measurement failed for job '{name}' of user {user_id}: {e}")
+        return len(dirty)
+
+    def reconcile(self, user_id: int) -> None:
+        """
+        Measure all of one user's jobs, and drop entries for jobs that
+        have gone.
+        """
+        user_root = self._user_root(user_id)
+        try:
+            names = {e.name for e in os.scandir(user_root) if e.is_dir()}
+        except OSError:
+            names = set()
+        conn = self._connect()
+        try:
+            known = {
+                row[0]
+                for row in conn.execute("SELECT name FROM job_usage WHERE user_id = ?", (user_id,))
+            }
+        finally:
+            conn.close()
+        for name in known - names:
+            self.remove(user_id, name)
+        for name in names:
+            self.measure(user_id, name)
+
+    def reconcile_all(self, min_interval: float = 0.0) -> bool:
+        """
+        Reconcile every user directory under the jobs root, unless
+        another replica is reconciling already.
+
+        :param min_interval: Skip the reconcile if the last one (by any
+            replica) finished less than this many seconds ago.
+        :return: Whether a reconcile was done.
+        """
+        with _ReconcileLock(self.db_path + _RECONCILE_LOCK_SUFFIX) as locked:
+            if not locked:
+                return False
+            conn = self._connect()
+            try:
+                row = conn.execute("SELECT finished_at FROM reconciles WHERE id = 0").fetchone()
+                if row is not None and time.time() - row[0] < min_interval:
+                    return False
+                for entry in os.scandir(self.jobs_root):
+                    if entry.is_dir() and entry.name.isdigit():
+                        try:
+                            self.reconcile(int(entry.name))
+                        except Exception as e:
+                            logger.error(f"Disk usage reconcile failed for user {entry.name}: {e}")
+                conn.execute(
+                    "INSERT OR REPLACE INTO reconciles (id, finished_at) VALUES (0, ?)",
+                    (time.time(),),
+                )
+            finally:
+                conn.close()
+            return True
+
+    def set_quota(
+        self, user_id: int, soft_bytes: Optional[int], hard_bytes: Optional[int]
+    ) -> None:
+        """
+        Override the default quotas for one user.
+        """
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO quotas (user_id, soft_bytes, hard_bytes) VALUES (?, ?, ?)",
+                (user_id, soft_bytes, hard_bytes),
+            )
+        finally:
+            conn.close()
+
+    def clear_quota(self, user_id: int) -> None:
+        """
+        Put a user back on the default quotas.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM quotas WHERE user_id = ?", (user_id,))
+        finally:
+            conn.close()
+
+    # ------------------------------------------------------------------
+    #  Queries
+
+    def quota(self, user_id: int) -> Tuple[Optional[int], Optional[int]]:
+        """
+        A user's (soft, hard) quotas in bytes; None means no limit.
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT soft_bytes, hard_bytes FROM quotas WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return self.soft_quota, self.hard_quota
+        return row["soft_bytes"], row["hard_bytes"]
+
+    def user_total(self, user_id: int) -> int:
+        conn = self._connect()
+        try:
+            return conn.execute(
+                "SELECT COALESCE(SUM(bytes), 0) FROM job_usage WHERE user_id = ?", (user_id,)
+            ).fetchone()[0]
+        finally:
+            conn.close()
+
+    def check(self, user_id: int) -> str:
+        """
+        Where a user stands against their quotas: QUOTA_OK, QUOTA_SOFT
+        (soft quota reached) or QUOTA_HARD (hard quota reached).
+        """
+        soft, hard = self.quota(user_id)
+        if soft is None and hard is None:
+            return QUOTA_OK
+        return quota_state(self.user_total(user_id), soft, hard)
+
+    def usage(self, user_id: int) -> dict:
+        """
+        A user's usage, quotas and per-job breakdown (largest first).
+        """
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT name, bytes, files, measured_at FROM job_usage WHERE user_id = ? ORDER BY bytes DESC, name",
+                (user_id,),
+            ).fetchall()
+        finally:
+            conn.close()
+        jobs = [dict(row) for row in rows]
+        used = sum(job["bytes"] for job in jobs)
+        soft, hard = self.quota(user_id)
+        return {
+            "used_bytes": used,
+            "files": sum(job["files"] for job in jobs),
+            "soft_quota_bytes": soft,
+            "hard_quota_bytes": hard,
+            "quota_state": quota_state(used, soft, hard),
+            "jobs": jobs,
+        }
+
+    def totals(self) -> List[dict]:
+        """
+        Every user's total usage (largest first).
+        """
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                """
+                SELECT user_id, SUM(bytes) AS bytes, SUM(files) AS files, COUNT(*) AS jobs
+                FROM job_usage GROUP BY user_id ORDER BY bytes DESC
+                """
+            ).fetchall()
+        finally:
+            conn.close()
+        return [dict(row) for row in rows]
+
+
+class _ReconcileLock:
+    """
+    Non-blocking lock, so that only one API replica reconciles at a time.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.fp = None
+
+    def __enter__(self) -> bool:
+        self.fp = open(self.path, "a")
+        if fcntl is None:
+            return True
+        try:
+            fcntl.flock(self.fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def __exit__(self, *exc) -> None:
+        self.fp.close()
@@ -0,0 +1,155 @@
+from typing import List, Tuple
+
+import numpy as np
+
+# Shape-preserving downsampling of (time, value) series for plotting.
+#
+# Two methods:
+#
+#  - "lttb": Largest-Triangle-Three-Buckets (Steinarsson, 2013).  Keeps
+#    the first and last points, and from each bucket in between the
+#    point that makes the largest triangle with the point kept from the
+#    previous bucket and the mean of the next bucket.  Visually the
+#    closest match to the full series.
+#
+#  - "minmax": the minimum and maximum of each bucket, in time order.
+#    Keeps every extreme, so spikes are never lost; cheaper than LTTB.
+#
+# Both return indices into the input, so any number of columns sharing
+# the same time axis can be reduced consistently.
+
+METHODS = ("lttb", "minmax")
+
+
+def _bucket_edges(n: int, buckets: int) -> np.ndarray:
+    # Bucket boundaries over points 1 .. n-2 (first and last are kept).
+    return np.linspace(1, n - 1, buckets + 1).astype(np.int64)
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Indices of the points kept by LTTB downsampling to max_points.
+    """
+    n = len(x)
+    if max_points >= n:
+        return np.arange(n)
+    if max_points < 3:
+        return np.array([0, n - 1])[:max_points]
+    buckets = max_points - 2
+    edges = _bucket_edges(n, buckets)
+    # Mean of each bucket, used as the third triangle vertex for the
+    # bucket before it (the last bucket looks ahead to the last point).
+    sums_x = np.add.reduceat(x[1 : n - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[1 : n - 1], edges[:-1] - 1)
+    counts = np.diff(edges)
+    means_x = np.append(sums_x / counts, x[-1])
+    means_y = np.append(sums_y / counts, y[-1])
+    out = np.empty(max_points, dtype=np.int64)
+    out[0] = 0
+    out[-1] = n - 1
+    a = 0
+    for i in range(buckets):
+        lo, hi = edges[i], edges[i + 1]
+        cx, cy = means_x[i + 1], means_y[i + 1]
+        ax, ay = x[a], y[a]
+        # Twice the triangle areas for every candidate in the bucket.
+        area = np.abs((ax - cx) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (cy - ay))
+        a = lo + int(np.argmax(area))
+        out[i + 1] = a
+    return out
+
+
+def minmax_indices(x: np.ndarray, y: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Indices of the per-bucket minima and maxima (plus the end points),
+    at most max_points of them, in time order.
+    """
+    n = len(x)
+    if max_points >= n:
+        return np.arange(n)
+    if max_points < 4:
+        # No room for a bucket's minimum and maximum: keep the end
+        # points and (with 3) the inner point furthest from their mean.
+        if max_points < 3:
+            return np.array([0, n - 1][:max(max_points, 0)], dtype=np.int64)
+        distance = np.abs(y[1 : n - 1] - (y[0] + y[n - 1]) / 2)
+        extreme = 1 + int(np.argmax(np.where(np.isnan(distance), -1.0, distance)))
+        return np.array([0, extreme, n - 1])
+    # Each bucket gives two points: first + 2 * buckets + last <= max_points
+    buckets = (max_points - 2) // 2
+    edges = _bucket_edges(n, buckets)
+    inner = np.arange(1, n - 1)
+    bucket = np.searchsorted(edges, inner, side="right") - 1
+    # Sort by bucket, then value: each bucket's first entry is its
+    # minimum and its last entry its maximum.
+    order = np.lexsort((y[1 : n - 1], bucket))
+    starts = edges[:-1] - 1
+    ends = edges[1:] - 2
+    keep = np.concatenate(([0], inner[order[starts]], inner[order[ends]], [n - 1]))
+    return np.unique(keep)
+
+
+def downsample(
+    x: np.ndarray, y: np.ndarray, max_points: int, method: str = "lttb"
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Reduce a series to at most max_points points.
+
+    :param method: "lttb" or "minmax".
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown downsampling method '{method}'")
+    if max_points is None or len(x) <= max_points:
+        return x, y
+    fn = lttb_indices if method == "lttb" else minmax_indices
+    idx = fn(x, y, max_points)
+    return x[idx], y[idx]
+
+
+def minmax_buckets(x: np.ndarray, y: np.ndarray, bucket_size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Aggregate consecutive runs of bucket_size points into their minimum
+    and maximum (in time order).  Used to thin out live updates.
+    """
+    n = len(x)
+    if bucket_size <= 1 or n <= 2:
+        return x, y
+    starts = np.arange(0, n, bucket_size)
+    bucket = np.repeat(np.arange(len(starts)), bucket_size)[:n]
+    order = np.lexsort((y, bucket))
+    ends = np.append(starts[1:], n) - 1
+    idx = np.unique(np.concatenate((order[starts], order[ends])))
+    return x[idx], y[idx]
+
+
+def downsample_indices(
+    x: np.ndarray, columns: List[np.ndarray], max_points: int, method: str = "lttb"
+) -> np.ndarray:
+    """
+    Indices of the points to keep from several columns sharing one time
+    axis: the union of the end points and the points chosen for each
+    column, with the max_points budget split between the columns, at
+    most max_points of them.  NaNs in a column are ignored when choosing
+    its points.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown downsampling method '{method}'")
+    n = len(x)
+    if max_points is None or n <= max_points or not columns:
+        return np.arange(n)
+    if max_points < 2:
+        return np.arange(max(max_points, 0))
+    fn = lttb_indices if method == "lttb" else minmax_indices
+    # Columns without NaNs pick the end points themselves, so an even
+    # split usually fits; if not, leave room for the end points (which
+    # always fits: 2 + columns * budget <= max_points).
+    for budget in (max_points // len(columns), (max_points - 2) // len(columns)):
+        keep = [np.array([0, n - 1])]
+        for y in columns:
+            valid = np.flatnonzero(~np.isnan(y))
+            if len(valid) and budget > 0:
+                keep.append(valid[fn(x[valid], y[valid], budget)])
+        idx = np.unique(np.concatenate(keep))
+        if len(idx) <= max_points:
+            break
+    return idx
@@ -0,0 +1,287 @@
+import json
+import zlib
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+# Response encodings: binary column formats for numeric data, and
+# compression of response bodies.
+#
+# Plot data can be sent in one of three formats, chosen from the
+# request's Accept header:
+#
+#   application/json                     [[t, v], ...] lists (the default)
+#   application/x-ctoaster-columns      raw columns, described below
+#   application/vnd.apache.arrow.stream  an Arrow IPC stream (with pyarrow)
+#
+# The raw columns format is a little-endian uint32 giving the length of
+# a UTF-8 JSON header, the header itself (padded with spaces so that the
+# data starts on an 8-byte boundary), then the columns one after
+# another as little-endian float64.  The header's "arrays" lists each
+# column's name and length, in order; missing values are NaN.  In a
+# browser:
+#
+#   const n = new DataView(buf).getUint32(0, true);
+#   const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buf, 4, n)));
+#   let pos = 4 + n;
+#   for (const [name, length] of header.arrays) {
+#       columns[name] = new Float64Array(buf, pos, length);
+#       pos += 8 * length;
+#   }
+#
+# (Float64Array uses the platform's byte order, which is little-endian
+# everywhere that matters.)
+#
+# CompressionMiddleware compresses text and JSON responses with brotli
+# (if installed) or gzip, whichever the client prefers.  Server-sent
+# event streams are left alone: compressors hold data back, and events
+# must go out as soon as they are sent.
+
+JSON_TYPE = "application/json"
+COLUMNS_TYPE = "application/x-ctoaster-columns"
+ARROW_STREAM_TYPE = "application/vnd.apache.arrow.stream"
+
+
+def available_series_types() -> Tuple[str, ...]:
+    types = (JSON_TYPE, COLUMNS_TYPE)
+    return types + (ARROW_STREAM_TYPE,) if pyarrow is not None else types
+
+
+def _parse_accept(header: str) -> List[Tuple[str, float]]:
+    entries = []
+    for item in header.split(","):
+        media_type, *params = (p.strip() for p in item.split(";"))
+        if not media_type:
+            continue
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        entries.append((media_type.lower(), q))
+    return entries
+
+
+def negotiate(header: Optional[str], offers: Sequence[str]) -> Optional[str]:
+    """
+    The best of the offered media types for an Accept (or
+    Accept-Encoding) header.  Ties go to the earlier offer.
+
+    :param offers: What the server can send, most preferred first.
+    :return: The chosen type: the first offer if the header is missing,
+        None if the client accepts none of them.
+    """
+    if not header:
+        return offers[0]
+    entries = _parse_accept(header)
+    best, best_q = None, 0.0
+    for offer in offers:
+        major = offer.split("/")[0]
+        q = None
+        for media_type, entry_q in entries:
+            if media_type == offer:
+                q = entry_q
+                break
+            if media_type in ("*/*", "*", f"{major}/*"):
+                q = entry_q if q is None else max(q, entry_q)
+        if q is not None and q > best_q:
+            best, best_q = offer, q
+    return best
+
+
+def pack_columns(header: dict, arrays: Sequence[Tuple[str, np.ndarray]]) -> bytes:
+    """
+    Encode columns in the raw columns format.
+
+    :param header: Fields for the JSON header ("arrays" is added).
+    :param arrays: (name, values) for each column, in order.
+    """
+    columns = [np.ascontiguousarray(values, dtype="<f8") for _, values in arrays]
+    header = {**header, "arrays": [[name, len(c)] for (name, _), c in zip(arrays, columns)]}
+    text = json.dumps(header, allow_nan=False).encode("utf-8")
+    text += b" " * (-(4 + len(text)) % 8)
+    return b"".join([len(text).to_bytes(4, "little"), text] + [c.tobytes() for c in columns])
+
+
+def unpack_columns(data: bytes) -> Tuple[dict, Dict[str, np.ndarray]]:
+    """
+    Decode the raw columns format: the header and each column by name.
+    """
+    n = int.from_bytes(data[:4], "little")
+    header = json.loads(data[4 : 4 + n])
+    columns = {}
+    pos = 4 + n
+    for name, length in header["arrays"]:
+        columns[name] = np.frombuffer(data, dtype="<f8", count=length, offset=pos)
+        pos += 8 * length
+    return header, columns
+
+
+def arrow_stream(metadata: dict, arrays: Sequence[Tuple[str, np.ndarray]]) -> bytes:
+    """
+    Encode columns of equal length as an Arrow IPC stream with one
+    record batch; metadata goes in the schema's metadata, as JSON.
+    """
+    if pyarrow is None:
+        raise RuntimeError("pyarrow is not installed")
+    batch = pyarrow.RecordBatch.from_arrays(
+        [pyarrow.array(values, type=pyarrow.float64()) for _, values in arrays],
+        names=[name for name, _ in arrays],
+    )
+    schema = batch.schema.with_metadata({k: json.dumps(v) for k, v in metadata.items()})
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, schema) as writer:
+        writer.write_batch(batch.replace_schema_metadata(schema.metadata))
+    return sink.getvalue().to_pybytes()
+
+
+# ----------------------------------------------------------------------
+#  Compression
+
+def available_encodings() -> Tuple[str, ...]:
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def _is_compressible(content_type: str) -> bool:
+    content_type = content_type.split(";")[0].strip().lower()
+    if content_type == "text/event-stream":
+        return False
+    return (
+        content_type.startswith("text/")
+        or content_type in (JSON_TYPE, COLUMNS_TYPE, ARROW_STREAM_TYPE)
+        or content_type.endswith("+json")
+    )
+
+
+class _Compressor:
+    def __init__(self, encoding: str, level: Optional[int]) -> None:
+        if encoding == "br":
+            self.obj = brotli.Compressor(quality=4 if level is None else level)
+        else:
+            # wbits 16 + 15: gzip container
+            self.obj = zlib.compressobj(1 if level is None else level, zlib.DEFLATED, 31)
+        self.encoding = encoding
+
+    def compress(self, data: bytes, flush: bool) -> bytes:
+        """
+        :param flush: Emit everything compressed so far (for a chunk of
+            a streamed response).
+        """
+        if self.encoding == "br":
+            out = self.obj.process(data)
+            return out + self.obj.flush() if flush else out
+        out = self.obj.compress(data)
+        return out + self.obj.flush(zlib.Z_SYNC_FLUSH) if flush else out
+
+    def finish(self, data: bytes = b"") -> bytes:
+        if self.encoding == "br":
+            return self.obj.process(data) + self.obj.finish()
+        return self.obj.compress(data) + self.obj.flush()
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing response bodies (brotli or gzip, from
+    Accept-Encoding) of compressible types.  Bodies below minimum_size,
+    responses that already have a Content-Encoding and server-sent event
+    streams are passed through as they are.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, level: Optional[int] = None) -> None:
+        """
+        :param minimum_size: Smallest body (bytes) worth compressing.
+        :param level: Compression level (default: gzip 1, brotli quality
+            4 -- higher levels cost several times the CPU time for a
+            few percent smaller responses).
+        """
+        self.app = app
+        self.minimum_size = minimum_size
+        self.level = level
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept_encoding = dict(scope.get("headers") or ()).get(b"accept-encoding")
+        encoding = negotiate(accept_encoding.decode("latin-1"), available_encodings()) if accept_encoding else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        state = {"start": None, "compressor": None, "passthrough": False}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                response_headers = dict(message.get("headers") or ())
+                if (
+                    b"content-encoding" in response_headers
+                    or not _is_compressible(response_headers.get(b"content-type", b"").decode("latin-1"))
+                ):
+                    state["passthrough"] = True
+                    await send(message)
+                else:
+                    state["start"] = message  # Held until the first body
+                return
+            if message["type"] != "http.response.body" or state["passthrough"]:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            start = state["start"]
+            if start is not None:
+                state["start"] = None
+                if not more_body and len(body) < self.minimum_size:
+                    state["passthrough"] = True
+                    await send(start)
+                    await send(message)
+                    return
+                state["compressor"] = _Compressor(encoding, self.level)
+                if not more_body:
+                    body = state["compressor"].finish(body)
+                    await send(self._compressed_start(start, encoding, len(body)))
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                await send(self._compressed_start(start, encoding))
+            compressor = state["compressor"]
+            if more_body:
+                body = compressor.compress(body, flush=True)
+            else:
+                body = compressor.finish(body)
+            await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
+
+    @staticmethod
+    def _compressed_start(start: dict, encoding: str, length: Optional[int] = None) -> dict:
+        headers = []
+        vary = None
+        for key, value in start.get("headers") or ():
+            lower = key.lower()
+            if lower == b"content-length":
+                continue
+            if lower == b"vary":
+                vary = value
+                continue
+            if lower == b"etag" and not value.startswith(b"W/"):
+                # Not byte-for-byte the same representation any more
+                value = b"W/" + value
+            headers.append((key, value))
+        if length is not None:
+            headers.append((b"content-length", str(length).encode("latin-1")))
+        headers.append((b"content-encoding", encoding.encode("latin-1")))
+        headers.append((b"vary", vary + b", Accept-Encoding" if vary else b"Accept-Encoding"))
+        return {**start, "headers": headers}
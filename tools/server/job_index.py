@@ -0,0 +1,304 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from tools.server.status import job_status
+
+logger = logging.getLogger(__name__)
+
+# Job metadata index.
+#
+# Listing a user's jobs used to mean opening every job's status and
+# config files, which on a network volume with thousands of jobs takes
+# seconds.  Instead, the job name, status, run length and timestamps
+# are kept in an SQLite catalogue on the jobs volume.  The API updates
+# entries whenever it changes a job (create, setup, run, pause,
+# delete), and a reconcile pass compares the catalogue with the job
+# directories -- using only stat() calls, and re-reading a job's files
+# only when their modification times have changed -- to pick up status
+# changes made by the model itself and anything done outside the API.
+
+JOB_INDEX_FILENAME = "jobs.db"
+
+SORT_COLUMNS = {
+    "name": "name",
+    "status": "status",
+    "created": "created_at",
+    "updated": "updated_at",
+}
+
+
+def _mtime(path: str) -> Optional[float]:
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def read_job_config(job_path: str) -> Tuple[str, bool]:
+    """
+    Run length and T100 flag from a job's config/config file.
+
+    :return: (run_length, t100); run_length is "n/a" if not set.
+    """
+    run_length = "n/a"
+    t100 = False
+    config_path = os.path.join(job_path, "config", "config")
+    if os.path.exists(config_path):
+        with open(config_path) as f:
+            for line in f:
+                if line.startswith("run_length:"):
+                    run_length = line.split(":")[1].strip()
+                if line.startswith("t100:"):
+                    t100 = line.split(":")[1].strip().lower() == "true"
+    return run_length, t100
+
+
+class JobIndex:
+    """
+    SQLite catalogue of job metadata, keyed by user ID and job name.
+    """
+
+    def __init__(self, db_path: str, jobs_root: str) -> None:
+        """
+        :param db_path: Path of the index database.
+        :param jobs_root: Root of the per-user job directories.
+        """
+        self.db_path = db_path
+        self.jobs_root = jobs_root
+        self.reconciled_users = set()
+        self.lock = threading.Lock()
+        conn = self._connect()
+        try:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    user_id INTEGER NOT NULL,
+                    name TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    run_length TEXT NOT NULL,
+                    t100 INTEGER NOT NULL,
+                    status_mtime REAL,
+                    config_mtime REAL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (user_id, name)
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (user_id, status)"
+            )
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _user_root(self, user_id: int) -> str:
+        return os.path.join(self.jobs_root, str(user_id))
+
+    # ------------------------------------------------------------------
+    #  Updates
+
+    def refresh(self, user_id: int, name: str, force: bool = False) -> Optional[dict]:
+        """
+        Bring one job's entry up to date with its directory.
+
+        Files are only re-read if their modification times have changed
+        since the entry was written (or if force is set).  Entries for
+        jobs whose directory has gone are removed.
+
+        :return: The job's entry, or None if the job does not exist.
+        """
+        path = os.path.join(self._user_root(user_id), name)
+        conn = self._connect()
+        try:
+            if not os.path.isdir(path):
+                conn.execute(
+                    "DELETE FROM jobs WHERE user_id = ? AND name = ?", (user_id, name)
+                )
+                return None
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE user_id = ? AND name = ?", (user_id, name)
+            ).fetchone()
+            return self._refresh_row(conn, user_id, name, path, row, force)
+        finally:
+            conn.close()
+
+    def remove(self, user_id: int, name: str) -> None:
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM jobs WHERE user_id = ? AND name = ?", (user_id, name))
+        finally:
+            conn.close()
+
+    def _refresh_row(
+        self,
+        conn: sqlite3.Connection,
+        user_id: int,
+        name: str,
+        path: str,
+        row: Optional[sqlite3.Row],
+        force: bool = False,
+    ) -> dict:
+        status_mtime = _mtime(os.path.join(path, "status"))
+        config_mtime = _mtime(os.path.join(path, "config", "config"))
+        # "data_genie" appearing moves a job from UNCONFIGURED to RUNNABLE
+        # without touching the status file, so that is part of the check.
+        configured = os.path.exists(os.path.join(path, "data_genie"))
+        if (
+            row is not None
+            and not force
+            and row["status_mtime"] == status_mtime
+            and row["config_mtime"] == config_mtime
+            and (row["status"] != "UNCONFIGURED") == configured
+        ):
+            return dict(row)
+        now = time.time()
+        run_length, t100 = read_job_config(path)
+        entry = {
+            "user_id": user_id,
+            "name": name,
+            "path": path,
+            "status": job_status(path),
+            "run_length": run_length,
+            "t100": int(t100),
+            "status_mtime": status_mtime,
+            "config_mtime": config_mtime,
+            "created_at": row["created_at"] if row else now,
+            "updated_at": now,
+        }
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO jobs
+            (user_id, name, path, status, run_length, t100, status_mtime, config_mtime, created_at, updated_at)
+            VALUES (:user_id, :name, :path, :status, :run_length, :t100, :status_mtime, :config_mtime, :created_at, :updated_at)
+            """,
+            entry,
+        )
+        return entry
+
+    def reconcile(self, user_id: int) -> None:
+        """
+        Compare one user's entries with their job directories.
+        """
+        user_root = self._user_root(user_id)
+        os.makedirs(user_root, exist_ok=True)
+        names = {
+            entry.name
+            for entry in os.scandir(user_root)
+            if entry.is_dir() and entry.name.strip() != "MODELS"
+        }
+        conn = self._connect()
+        try:
+            rows = {
+                row["name"]: row
+                for row in conn.execute(
+                    "SELECT * FROM jobs WHERE user_id = ?", (user_id,)
+                ).fetchall()
+            }
+            conn.execute("BEGIN")
+            for name in set(rows) - names:
+                conn.execute(
+                    "DELETE FROM jobs WHERE user_id = ? AND name = ?", (user_id, name)
+                )
+            for name in names:
+                self._refresh_row(
+                    conn, user_id, name, os.path.join(user_root, name), rows.get(name)
+                )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        with self.lock:
+            self.reconciled_users.add(user_id)
+
+    def reconcile_all(self) -> None:
+        """
+        Reconcile every user directory under the jobs root.
+        """
+        for entry in os.scandir(self.jobs_root):
+            if entry.is_dir() and entry.name.isdigit():
+                try:
+                    self.reconcile(int(entry.name))
+                except Exception as e:
+                    logger.error(f"Job index reconcile failed for user {entry.name}: {e}")
+
+    def ensure_reconciled(self, user_id: int) -> None:
+        """
+        Reconcile a user the first time this process serves them.
+        """
+        with self.lock:
+            done = user_id in self.reconciled_users
+        if not done:
+            self.reconcile(user_id)
+
+    # ------------------------------------------------------------------
+    #  Queries
+
+    def get(self, user_id: int, name: str) -> Optional[dict]:
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE user_id = ? AND name = ?", (user_id, name)
+            ).fetchone()
+            return dict(row) if row else None
+        finally:
+            conn.close()
+
+    def with_status(self, status: str) -> List[dict]:
+        """
+        Every user's jobs with a given status.
+        """
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT * FROM jobs WHERE status = ?", (status,)).fetchall()
+            return [dict(row) for row in rows]
+        finally:
+            conn.close()
+
+    def list(
+        self,
+        user_id: int,
+        status: Optional[List[str]] = None,
+        sort: str = "name",
+        order: str = "asc",
+        limit: Optional[int] = None,
+        offset: int = 0,
+    ) -> Tuple[List[dict], int]:
+        """
+        One page of a user's jobs.
+
+        :param status: Only return jobs with one of these statuses.
+        :param sort: One of the keys of SORT_COLUMNS.
+        :param order: "asc" or "desc".
+        :return: (entries, total number of matching jobs)
+        """
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"Invalid sort key '{sort}'")
+        if order not in ("asc", "desc"):
+            raise ValueError(f"Invalid sort order '{order}'")
+        where = "user_id = ?"
+        params: list = [user_id]
+        if status:
+            where += f" AND status IN ({', '.join('?' for _ in status)})"
+            params.extend(status)
+        conn = self._connect()
+        try:
+            total = conn.execute(
+                f"SELECT COUNT(*) FROM jobs WHERE {where}", params
+            ).fetchone()[0]
+            query = f"SELECT * FROM jobs WHERE {where} ORDER BY {SORT_COLUMNS[sort]} {order.upper()}, name"
+            if limit is not None or offset:
+                query += " LIMIT ? OFFSET ?"
+                params = params + [limit if limit is not None else -1, offset]
+            rows = conn.execute(query, params).fetchall()
+            return [dict(row) for row in rows], total
+        finally:
+            conn.close()
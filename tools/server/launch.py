@@ -0,0 +1,75 @@
+import os
+import sys
+from typing import Optional
+
+from tools import exe_store
+from tools import utils as U
+from tools.server.compaction import expand_outputs
+from tools.server.status import read_status_file
+from tools.server.supervisor import ModelSupervisor, SupervisedProcess, default_supervisor
+
+# Starting model runs.  Everything that has to happen between "this
+# job may run now" and a live model process lives here, so that the
+# run scheduler can do it at dispatch time (a job may sit in the queue
+# for a while, and may be paused or resumed in the meantime).
+
+
+def model_executable() -> str:
+    """
+    Path to the shipped model executable for the configured model version.
+    """
+    return os.path.join(
+        U.ctoaster_jobs,
+        "MODELS",
+        U.ctoaster_version,
+        sys.platform.upper(),
+        "ship",
+        "carrotcake.exe",
+    )
+
+
+def launch_model(job_path: str, supervisor: Optional[ModelSupervisor] = None) -> SupervisedProcess:
+    """
+    Link the model executable into a job directory and start it.
+
+    If the job is paused, a GUI_RESTART command is written so that the
+    model picks up from the point it was paused at.  Output goes to
+    run.log in the job directory.  Output files compressed since the
+    job last ran are expanded first.
+
+    :param job_path: The job directory.
+    :param supervisor: Supervisor to run the model under (default: the
+                       process-wide one).
+    :return: The supervised model process.
+    """
+    exe = model_executable()
+    if not os.path.exists(exe):
+        raise FileNotFoundError(f"Executable not found at {exe}")
+
+    # Link the executable into the job directory from the store
+    runexe = os.path.join(job_path, "carrotcake-ship.exe")
+    exe_hash = exe_store.link_executable(exe, runexe)
+
+    expand_outputs(job_path)
+
+    # Handle resuming a paused job
+    command_file_path = os.path.join(job_path, "command")
+    if os.path.exists(command_file_path):
+        os.remove(command_file_path)
+
+    if os.path.exists(os.path.join(job_path, "status")):
+        status_parts = read_status_file(job_path)
+        if status_parts and status_parts[0] == "PAUSED":
+            if len(status_parts) < 4:
+                raise ValueError(
+                    "Status file does not contain the required parameters to resume the job."
+                )
+            _, koverall, _, genie_clock = status_parts[:4]
+            with open(command_file_path, "w") as command_file:
+                command_file.write(f"GUI_RESTART {koverall} {genie_clock}\n")
+
+    # Start executable and direct stdout and stderr to run.log in job directory
+    log_file_path = os.path.join(job_path, "run.log")
+    return (supervisor or default_supervisor()).start(
+        [runexe], job_path, log_file_path, info={"exe_sha256": exe_hash}
+    )
@@ -0,0 +1,482 @@
+import hmac
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from tools.server.status_watch import parse_status_line
+
+# Metrics in the Prometheus text exposition format.
+#
+# A small registry of counters, gauges and histograms, so that /metrics
+# doesn't need prometheus_client.  Values that are cheap to read when
+# asked for (run counts, pool and volume usage) are filled in by
+# collector functions called just before the metrics are rendered;
+# request metrics are recorded as requests go by, by MetricsMiddleware.
+#
+# Model metrics (ModelMetrics) come from whichever process runs the
+# models: the REST API, or stand-alone workers, which serve them with
+# serve_metrics().  The run queue's length comes from the API alone, as
+# a gauge of its own: every API replica sees the whole queue, so take
+# the max of it across pods rather than the sum.
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Request latencies, in seconds.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    if float(value).is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(str(v))}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, object]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"Metric {self.name} takes labels {self.labelnames}, got {tuple(labels)}"
+            )
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def samples(self) -> Iterable[Tuple[str, Sequence[str], Sequence[str], float]]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {_escape(self.help)}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for name, labelnames, labelvalues, value in self.samples():
+            lines.append(f"{name}{_format_labels(labelnames, labelvalues)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """
+    A value that only goes up.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, help, labelnames)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            yield self.name, self.labelnames, key, value
+
+
+class Gauge(_Metric):
+    """
+    A value that goes up and down.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, help, labelnames)
+        self.values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def clear(self) -> None:
+        """
+        Drop every labelled value (for gauges describing a changing set).
+        """
+        with self.lock:
+            self.values.clear()
+
+    def samples(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            yield self.name, self.labelnames, key, value
+
+
+class Histogram(_Metric):
+    """
+    Observations counted in cumulative buckets, with their sum and count.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket (not cumulative), sum, count]
+        self.values: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self.lock:
+            items = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self.values.items())
+        bucket_labels = self.labelnames + ("le",)
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                yield self.name + "_bucket", bucket_labels, key + (_format_value(bound),), cumulative
+            yield self.name + "_bucket", bucket_labels, key + ("+Inf",), count
+            yield self.name + "_sum", self.labelnames, key, total
+            yield self.name + "_count", self.labelnames, key, count
+
+
+class MetricsRegistry:
+    """
+    The metrics exposed by a process, rendered in the text format.
+    """
+
+    def __init__(self) -> None:
+        self.metrics: List[_Metric] = []
+        self.collectors: List[Callable[[], None]] = []
+
+    def _add(self, metric: _Metric) -> _Metric:
+        if any(m.name == metric.name for m in self.metrics):
+            raise ValueError(f"Duplicate metric {metric.name}")
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(name, help, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def add_collector(self, fn: Callable[[], None]) -> None:
+        """
+        Call fn to update gauges every time the metrics are rendered.
+        """
+        self.collectors.append(fn)
+
+    def render(self) -> str:
+        for fn in self.collectors:
+            fn()
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class HttpMetrics:
+    """
+    Request count, latency and concurrency metrics for an HTTP API.
+    """
+
+    def __init__(self, registry: MetricsRegistry, prefix: str = "ctoaster") -> None:
+        self.requests = registry.counter(
+            f"{prefix}_http_requests_total",
+            "HTTP requests handled, by route and status code.",
+            ("method", "route", "status"),
+        )
+        self.latency = registry.histogram(
+            f"{prefix}_http_request_duration_seconds",
+            "Time to complete a request (to the start of the response for event streams).",
+            ("method", "route"),
+        )
+        self.in_flight = registry.gauge(
+            f"{prefix}_http_requests_in_flight",
+            "Requests being handled (event streams not included).",
+        )
+        self.streams = registry.gauge(
+            f"{prefix}_sse_streams_open",
+            "Open server-sent event streams, by route.",
+            ("route",),
+        )
+
+
+def route_name(scope: dict) -> str:
+    """
+    The path template of the route that handled a request, so that
+    e.g. every /job/{job_name} request is counted together.
+    """
+    route = scope.get("route")
+    path = getattr(route, "path_format", None) or getattr(route, "path", None)
+    return path or "<unmatched>"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording HttpMetrics for every HTTP request.
+
+    Server-sent event streams stay open for as long as the client
+    watches, so their latency is taken at the start of the response and
+    they are counted as open streams rather than requests in flight.
+    """
+
+    def __init__(self, app, metrics: HttpMetrics) -> None:
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        metrics = self.metrics
+        method = scope["method"]
+        start = time.perf_counter()
+        state = {"status": 500, "stream": False}
+        metrics.in_flight.inc()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                headers = dict(message.get("headers") or ())
+                if headers.get(b"content-type", b"").startswith(b"text/event-stream"):
+                    state["stream"] = True
+                    route = route_name(scope)
+                    metrics.latency.observe(time.perf_counter() - start, method=method, route=route)
+                    metrics.in_flight.dec()
+                    metrics.streams.inc(route=route)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = route_name(scope)
+            if state["stream"]:
+                metrics.streams.dec(route=route)
+            else:
+                metrics.in_flight.dec()
+                metrics.latency.observe(time.perf_counter() - start, method=method, route=route)
+            metrics.requests.inc(method=method, route=route, status=state["status"])
+
+
+class StepRates:
+    """
+    Model progress (time steps per second) of running jobs, from the
+    step counts in their status files.
+
+    The model only rewrites its status file every so often, so a rate
+    is worked out each time the count is seen to change, and kept until
+    the next change (or dropped to zero once none is seen for
+    stale_after seconds).
+    """
+
+    def __init__(self, stale_after: float = 120.0) -> None:
+        self.stale_after = stale_after
+        # Per job directory: (step count, when it was seen, rate)
+        self.jobs: Dict[str, Tuple[int, float, Optional[float]]] = {}
+
+    def update(self, job_dirs: Iterable[str]) -> Dict[str, float]:
+        """
+        :param job_dirs: Directories of the jobs running now.
+        :return: Steps per second for each job (jobs seen only once so
+            far are left out).
+        """
+        now = time.monotonic()
+        jobs = {}
+        for job_dir in job_dirs:
+            try:
+                with open(os.path.join(job_dir, "status")) as fp:
+                    _, koverall, _, _ = parse_status_line(fp.readline())
+            except OSError:
+                continue
+            if koverall is None:
+                continue
+            entry = self.jobs.get(job_dir)
+            if entry is None or koverall < entry[0]:
+                entry = (koverall, now, None)
+            elif koverall > entry[0]:
+                entry = (koverall, now, (koverall - entry[0]) / max(now - entry[1], 1e-6))
+            elif entry[2] is not None and now - entry[1] > self.stale_after:
+                entry = (entry[0], entry[1], 0.0)
+            jobs[job_dir] = entry
+        self.jobs = jobs
+        return {job_dir: e[2] for job_dir, e in jobs.items() if e[2] is not None}
+
+
+class ModelMetrics:
+    """
+    Model run counts, progress, exits and CPU time for a process that
+    runs models.
+    """
+
+    def __init__(self, registry: MetricsRegistry, jobs_root: str, prefix: str = "ctoaster") -> None:
+        """
+        :param jobs_root: Root of the per-user job directories.
+        """
+        self.jobs_root = jobs_root
+        self.runs = registry.gauge(
+            f"{prefix}_model_runs",
+            "Model runs going on in this process.",
+            ("state",),
+        )
+        # The queue is shared, and every process would report all of it:
+        # a gauge of its own, set only by the process that is given it.
+        self.queue_length = registry.gauge(
+            f"{prefix}_run_queue_length",
+            "Model runs waiting in the run queue (the whole queue, not per process).",
+        )
+        self.steps = registry.gauge(
+            f"{prefix}_model_steps_per_second",
+            "Time steps per second of the model runs going on in this process, summed by user.",
+            ("user",),
+        )
+        self.exits = registry.counter(
+            f"{prefix}_model_exits_total",
+            "Model processes that have finished, by how they ended (EXITED or KILLED) and exit code.",
+            ("state", "exit_code"),
+        )
+        self.cpu_seconds = registry.counter(
+            f"{prefix}_model_cpu_seconds_total",
+            "CPU time used by finished model processes.",
+            ("mode",),
+        )
+        self.step_rates = StepRates()
+
+    def count_exit(self, proc) -> None:
+        """
+        Supervisor listener: count a finished model process.
+        """
+        record = proc.record
+        self.exits.inc(state=record["state"], exit_code=record.get("exit_code"))
+        for mode in ("user", "system"):
+            if f"{mode}_cpu_seconds" in record:
+                self.cpu_seconds.inc(record[f"{mode}_cpu_seconds"], mode=mode)
+
+    def update(
+        self, running: int, running_paths: Iterable[str], queued: Optional[int] = None
+    ) -> None:
+        """
+        :param running_paths: Job directories of the runs going on.
+        :param queued: Length of the run queue (None: not exported here).
+        """
+        self.runs.set(running, state="running")
+        if queued is not None:
+            self.queue_length.set(queued)
+        # By user only: a job label would make a new series of every run.
+        by_user: Dict[str, float] = {}
+        for job_path, rate in self.step_rates.update(running_paths).items():
+            user = os.path.relpath(job_path, self.jobs_root).split(os.sep, 1)[0]
+            by_user[user] = by_user.get(user, 0.0) + rate
+        self.steps.clear()
+        for user, rate in by_user.items():
+            self.steps.set(rate, user=user)
+
+
+def volume_usage(path: str) -> Optional[Dict[str, int]]:
+    """
+    Size, free and used bytes of the filesystem holding path.
+    """
+    try:
+        st = os.statvfs(path)
+    except OSError:
+        return None
+    size = st.f_blocks * st.f_frsize
+    free = st.f_bavail * st.f_frsize
+    return {"size": size, "free": free, "used": size - st.f_bfree * st.f_frsize}
+
+
+def serve_metrics(
+    registry: MetricsRegistry, port: int, host: str = "", token: Optional[str] = None
+) -> ThreadingHTTPServer:
+    """
+    Serve GET /metrics from a background thread, for processes that
+    have no HTTP API of their own (the model workers).
+
+    :param token: If given, scrapers must send it as a bearer token.
+    :return: The server (call its shutdown() to stop it).
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            if token and not hmac.compare_digest(
+                self.headers.get("Authorization", ""), f"Bearer {token}"
+            ):
+                self.send_error(401, "Invalid metrics token")
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", METRICS_CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # One line per scrape is just noise
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -0,0 +1,302 @@
+import logging
+import os
+import struct
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import netCDF4
+except ImportError:
+    netCDF4 = None
+
+from tools.server.compaction import open_output, original_size, split_codec, stored_file
+
+logger = logging.getLogger(__name__)
+
+# Catalogue of a job's plottable output files.
+#
+# Each model component writes its output to its own directory under
+# <job>/output (output/biogem, output/sedgem, output/rokgem, ...).
+# Rather than walking the whole job tree -- which includes the input
+# and restart trees -- to find them, the catalogue lists just those
+# module directories, and only lists one again when its modification
+# time has changed.  Per-file details (variables, row counts) are kept
+# until the file's size or modification time changes, or until their
+# job's listing is dropped to make room for others; ASCII series
+# files are read through the series cache, and netCDF files have just
+# their header read, with netCDF4 if it is installed and otherwise
+# with the small classic-format parser below.  Files of completed jobs
+# may have been compressed (see compaction.py); they are listed and
+# resolved by their original names all the same.
+
+DEFAULT_MODULE = "biogem"
+
+
+def is_series_file(name: str) -> bool:
+    """
+    Whether a file is an ASCII time series (e.g. biogem_series_atm_temp.res).
+    """
+    return name.endswith(".res") and "_series" in name
+
+
+def is_output_file(name: str) -> bool:
+    return is_series_file(name) or name.endswith(".nc")
+
+
+# ----------------------------------------------------------------------
+#  netCDF classic (CDF-1, CDF-2 and CDF-5) header parsing
+
+_NC_DIMENSION = 0x0A
+_NC_VARIABLE = 0x0B
+_NC_ATTRIBUTE = 0x0C
+
+# Sizes of the external types, by nc_type code.
+_NC_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 4, 6: 8, 7: 1, 8: 2, 9: 4, 10: 8, 11: 8}
+
+
+class _HeaderReader:
+    def __init__(self, fp, version: int) -> None:
+        self.fp = fp
+        self.version = version
+
+    def read(self, n: int) -> bytes:
+        data = self.fp.read(n)
+        if len(data) != n:
+            raise ValueError("Truncated netCDF header")
+        return data
+
+    def int32(self) -> int:
+        return struct.unpack(">i", self.read(4))[0]
+
+    def count(self) -> int:
+        # Counts and lengths are 64-bit in CDF-5, 32-bit otherwise.
+        if self.version == 5:
+            return struct.unpack(">q", self.read(8))[0]
+        return struct.unpack(">i", self.read(4))[0]
+
+    def name(self) -> str:
+        n = self.count()
+        data = self.read(n)
+        self.read(-n % 4)
+        return data.decode("utf-8", "replace")
+
+    def skip_attributes(self) -> None:
+        tag = self.int32()
+        n = self.count()
+        if tag not in (0, _NC_ATTRIBUTE):
+            raise ValueError("Bad netCDF attribute list")
+        for _ in range(n):
+            self.name()
+            nc_type = self.int32()
+            size = self.count() * _NC_TYPE_SIZES.get(nc_type, 1)
+            self.read(size + (-size % 4))
+
+
+def read_netcdf_header(path: str) -> dict:
+    """
+    Dimensions, variables and record count of a netCDF file.
+
+    :return: {"dimensions": {name: length}, "variables": [{"name",
+        "dimensions"}], "records": number of records (or None)}
+    :raises ValueError: if the file is not a netCDF file that can be read.
+    """
+    if netCDF4 is not None and stored_file(path)[1] is None:
+        with netCDF4.Dataset(path) as ds:
+            records = None
+            for dim in ds.dimensions.values():
+                if dim.isunlimited():
+                    records = len(dim)
+            return {
+                "dimensions": {name: len(dim) for name, dim in ds.dimensions.items()},
+                "variables": [
+                    {"name": name, "dimensions": list(var.dimensions)}
+                    for name, var in ds.variables.items()
+                ],
+                "records": records,
+            }
+
+    with open_output(path) as fp:
+        magic = fp.read(4)
+        if magic[:3] != b"CDF" or magic[3:] not in (b"\x01", b"\x02", b"\x05"):
+            # Most likely netCDF-4 (HDF5), which needs the netCDF4 module.
+            raise ValueError("Not a netCDF classic format file")
+        r = _HeaderReader(fp, magic[3])
+        records = r.count()
+        dims: List[Tuple[str, int]] = []
+        tag, n = r.int32(), r.count()
+        if tag not in (0, _NC_DIMENSION):
+            raise ValueError("Bad netCDF dimension list")
+        for _ in range(n):
+            name = r.name()
+            dims.append((name, r.count()))
+        r.skip_attributes()
+        variables = []
+        tag, n = r.int32(), r.count()
+        if tag not in (0, _NC_VARIABLE):
+            raise ValueError("Bad netCDF variable list")
+        for _ in range(n):
+            name = r.name()
+            dimids = [r.count() for _ in range(r.count())]
+            r.skip_attributes()
+            r.int32()  # nc_type
+            r.count()  # vsize
+            r.read(4 if r.version == 1 else 8)  # begin
+            variables.append({"name": name, "dimensions": [dims[i][0] for i in dimids]})
+    unlimited = any(length == 0 for _, length in dims)
+    return {
+        "dimensions": {name: (records if length == 0 else length) for name, length in dims},
+        "variables": variables,
+        "records": records if unlimited else None,
+    }
+
+
+# ----------------------------------------------------------------------
+
+
+class OutputCatalogue:
+    """
+    Cached listing of the output files of jobs, and their contents.
+    """
+
+    def __init__(self, series_cache, max_jobs: int = 256) -> None:
+        """
+        :param series_cache: SeriesCache used to read ASCII series files.
+        :param max_jobs: Number of jobs whose listings are kept.
+        """
+        self.series_cache = series_cache
+        self.max_jobs = max_jobs
+        self.lock = threading.Lock()
+        # job path -> (output dir mtime, {module: (module dir mtime, [file names])})
+        self.listings: "OrderedDict[str, Tuple[float, Dict[str, Tuple[float, List[str]]]]]" = OrderedDict()
+        # job path -> {file path -> ((size, mtime), details)}, for the
+        # jobs in self.listings.
+        self.details: Dict[str, Dict[str, Tuple[Tuple[int, float], dict]]] = {}
+
+    def _listing(self, job_path: str, force: bool = False) -> Dict[str, List[str]]:
+        output_dir = os.path.join(job_path, "output")
+        try:
+            output_mtime = os.stat(output_dir).st_mtime
+        except OSError:
+            return {}
+        with self.lock:
+            cached = self.listings.get(job_path)
+        old_modules = cached[1] if cached else {}
+        if cached and cached[0] == output_mtime and not force:
+            names = list(old_modules)
+        else:
+            names = sorted(
+                entry.name for entry in os.scandir(output_dir) if entry.is_dir()
+            )
+        modules = {}
+        for module in names:
+            module_dir = os.path.join(output_dir, module)
+            try:
+                mtime = os.stat(module_dir).st_mtime
+            except OSError:
+                continue
+            old = old_modules.get(module)
+            if old and old[0] == mtime and not force:
+                modules[module] = old
+            else:
+                names_in_dir = {split_codec(f)[0] for f in os.listdir(module_dir)}
+                modules[module] = (mtime, sorted(f for f in names_in_dir if is_output_file(f)))
+        with self.lock:
+            self.listings[job_path] = (output_mtime, modules)
+            self.listings.move_to_end(job_path)
+            while len(self.listings) > self.max_jobs:
+                old_job, _ = self.listings.popitem(last=False)
+                self.details.pop(old_job, None)
+        return {module: files for module, (_, files) in modules.items()}
+
+    def files(self, job_path: str, force: bool = False) -> List[Tuple[str, str]]:
+        """
+        (module, file name) for every output file of a job.
+        """
+        return [
+            (module, name)
+            for module, names in self._listing(job_path, force).items()
+            for name in names
+        ]
+
+    def resolve(self, job_path: str, data_file_name: str) -> Optional[str]:
+        """
+        Path of an output file given as "module/name", or as a bare name
+        (looked for in biogem first, then the other modules).  Only
+        files in the catalogue are returned, so names can't escape the
+        output directory.
+        """
+        module, _, name = data_file_name.rpartition("/")
+        for force in (False, True):
+            # Directory mtimes can be coarse (e.g. on NFS), so a file
+            # created just after the last listing gets a second look.
+            listing = self._listing(job_path, force)
+            if module:
+                candidates = [module] if name in listing.get(module, ()) else []
+            else:
+                candidates = [m for m, names in listing.items() if name in names]
+                candidates.sort(key=lambda m: m != DEFAULT_MODULE)
+            if candidates:
+                return os.path.join(job_path, "output", candidates[0], name)
+        return None
+
+    def describe(self, path: str) -> dict:
+        """
+        Details of one output file: format, size, last-modified time,
+        variables and row (or record) count.
+        """
+        stored, codec = stored_file(path)
+        st = os.stat(stored)
+        key = (st.st_size, st.st_mtime)
+        # <job>/output/<module>/<name>
+        job_path = os.path.dirname(os.path.dirname(os.path.dirname(path)))
+        with self.lock:
+            cached = self.details.get(job_path, {}).get(path)
+        if cached and cached[0] == key:
+            return cached[1]
+        name = os.path.basename(path)
+        size = st.st_size if codec is None else (original_size(path) or st.st_size)
+        entry = {"size": size, "modified": st.st_mtime, "variables": None, "rows": None}
+        try:
+            if is_series_file(name):
+                series = self.series_cache.load(path)
+                entry.update(format="series", variables=series.columns[1:], rows=series.rows)
+            else:
+                header = read_netcdf_header(path)
+                entry.update(
+                    format="netcdf",
+                    variables=[v["name"] for v in header["variables"]],
+                    dimensions=header["dimensions"],
+                    rows=header["records"],
+                )
+        except Exception as e:
+            entry.setdefault("format", "series" if is_series_file(name) else "netcdf")
+            entry["error"] = str(e)
+        with self.lock:
+            if job_path in self.listings:
+                self.details.setdefault(job_path, {})[path] = (key, entry)
+        return entry
+
+    def catalogue(self, job_path: str, module: Optional[str] = None) -> List[dict]:
+        """
+        Every output file of a job (optionally just one module's), with details.
+        """
+        out = []
+        for mod, name in self.files(job_path):
+            if module and mod != module:
+                continue
+            path = os.path.join(job_path, "output", mod, name)
+            try:
+                details = self.describe(path)
+            except OSError:
+                continue  # Removed since the listing.
+            out.append({"module": mod, "name": name, "path": f"{mod}/{name}", **details})
+        return out
+
+    def forget(self, job_path: str) -> None:
+        """
+        Drop a job's cached listing and file details.
+        """
+        with self.lock:
+            self.listings.pop(job_path, None)
+            self.details.pop(job_path, None)
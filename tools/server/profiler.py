@@ -0,0 +1,462 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from starlette.routing import compile_path
+
+logger = logging.getLogger(__name__)
+
+# Sampling profiler for API requests.
+#
+# When switched on (for some routes, or for a random sample of
+# requests), a background thread takes the Python stack of every thread
+# in the process every few milliseconds for as long as a profiled
+# request runs, and the stacks are written out when it finishes: as
+# collapsed stacks (for flamegraph.pl and friends) and in speedscope's
+# JSON format.  Async handlers run on the event loop thread and sync
+# ones in worker threads, so the loop thread and the worker pools are
+# sampled (background threads, which mostly sleep, are not).  Threads
+# that are just waiting are left out, but work done for other requests
+# at the same time does show up.
+#
+# The settings are kept in a file in the profile directory on the jobs
+# volume, so that switching profiling on reaches every replica.  When
+# profiling is off, the middleware costs a couple of attribute checks
+# per request (plus a stat() of the settings file every few seconds).
+
+SETTINGS_FILENAME = "settings.json"
+
+DEFAULT_SETTINGS = {
+    "enabled": False,
+    "routes": [],  # Route templates, e.g. "/setup/{job_name}"; all requests are profiled
+    "sample_rate": 0.0,  # Fraction of other requests profiled
+    "interval": 0.005,  # Seconds between samples
+}
+
+# Names of the threads request handlers run in: BlockingPools pools,
+# Starlette's thread pool for sync endpoints, and asyncio's default
+# executor.
+WORKER_THREAD_PREFIXES = ("pool-", "AnyIO worker thread", "ThreadPoolExecutor", "asyncio_")
+
+# Leaf frames of threads that are waiting rather than working.
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+    ("socket.py", "accept"),
+}
+
+Frame = Tuple[str, str, int]  # (name, file, first line)
+
+
+def _stack(frame) -> List[Frame]:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append((getattr(code, "co_qualname", code.co_name), code.co_filename, code.co_firstlineno))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def _is_idle(stack: List[Frame]) -> bool:
+    name, filename, _ = stack[-1]
+    return (os.path.basename(filename), name.rsplit(".", 1)[-1]) in IDLE_FRAMES
+
+
+class _Session:
+    """
+    Samples collected for one profiled request.
+    """
+
+    def __init__(self, label: str, number: int, max_duration: float) -> None:
+        self.label = label
+        self.number = number
+        self.loop_thread = threading.get_ident()
+        self.start = time.monotonic()
+        self.deadline = self.start + max_duration
+        self.end: Optional[float] = None
+        # (thread name, stack) per sample
+        self.samples: List[Tuple[str, List[Frame]]] = []
+        self.truncated = False
+
+
+class _Sampler:
+    """
+    Background thread sampling all thread stacks while sessions are open.
+    """
+
+    def __init__(self) -> None:
+        self.sessions: List[_Session] = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.interval = DEFAULT_SETTINGS["interval"]
+        self.thread: Optional[threading.Thread] = None
+
+    def open(self, session: _Session, interval: float) -> None:
+        with self.lock:
+            self.interval = interval
+            self.sessions.append(session)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self.thread.start()
+        self.wakeup.set()
+
+    def close(self, session: _Session) -> None:
+        with self.lock:
+            if session in self.sessions:
+                self.sessions.remove(session)
+        session.end = time.monotonic()
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while True:
+            with self.lock:
+                sessions = list(self.sessions)
+                interval = self.interval
+            if not sessions:
+                self.wakeup.wait(5)
+                self.wakeup.clear()
+                with self.lock:
+                    if not self.sessions:
+                        self.thread = None
+                        return
+                continue
+            now = time.monotonic()
+            names = {t.ident: t.name for t in threading.enumerate()}
+            loop_threads = {session.loop_thread for session in sessions}
+            stacks = []
+            frames = sys._current_frames()
+            for ident, frame in frames.items():
+                name = names.get(ident, "")
+                if ident == own_id or not (
+                    ident in loop_threads or name.startswith(WORKER_THREAD_PREFIXES)
+                ):
+                    continue
+                stack = _stack(frame)
+                if stack and not _is_idle(stack):
+                    stacks.append((name, stack))
+            del frames, frame
+            for session in sessions:
+                if now > session.deadline:
+                    session.truncated = True
+                    self.close(session)
+                    continue
+                for thread_name, stack in stacks:
+                    session.samples.append((thread_name, stack))
+            time.sleep(interval)
+
+
+def collapsed_stacks(session: _Session) -> str:
+    """
+    Samples as "thread;outer;...;inner count" lines (Brendan Gregg's
+    collapsed stack format).
+    """
+    counts: Dict[str, int] = {}
+    for thread_name, stack in session.samples:
+        key = ";".join([thread_name] + [f"{name} ({os.path.basename(f)}:{line})" for name, f, line in stack])
+        counts[key] = counts.get(key, 0) + 1
+    return "".join(f"{key} {n}\n" for key, n in sorted(counts.items()))
+
+
+def speedscope_profile(session: _Session, interval: float) -> dict:
+    """
+    Samples in speedscope's file format: one sampled profile per thread.
+    """
+    frames: List[dict] = []
+    frame_index: Dict[Frame, int] = {}
+    by_thread: Dict[str, Tuple[List[List[int]], List[float]]] = {}
+    for thread_name, stack in session.samples:
+        indices = []
+        for frame in stack:
+            index = frame_index.get(frame)
+            if index is None:
+                index = frame_index[frame] = len(frames)
+                frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+            indices.append(index)
+        samples, weights = by_thread.setdefault(thread_name, ([], []))
+        samples.append(indices)
+        weights.append(interval)
+    end = (session.end or time.monotonic()) - session.start
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": session.label,
+        "exporter": "ctoaster",
+        "shared": {"frames": frames},
+        "profiles": [
+            {
+                "type": "sampled",
+                "name": thread_name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": end,
+                "samples": samples,
+                "weights": weights,
+            }
+            for thread_name, (samples, weights) in sorted(by_thread.items())
+        ],
+    }
+
+
+class RequestProfiler:
+    """
+    Profiler settings, sampling and profile files.
+    """
+
+    def __init__(
+        self,
+        profile_dir: str,
+        max_profiles: int = 200,
+        max_duration: float = 30.0,
+        max_active: int = 4,
+        check_interval: float = 5.0,
+    ) -> None:
+        """
+        :param profile_dir: Directory for the settings file and profiles.
+        :param max_profiles: Number of profiles kept (oldest are removed).
+        :param max_duration: Seconds after which a request's sampling stops.
+        :param max_active: Number of requests profiled at once.
+        :param check_interval: Seconds between checks of the settings file.
+        """
+        self.profile_dir = profile_dir
+        self.max_profiles = max_profiles
+        self.max_duration = max_duration
+        self.max_active = max_active
+        self.check_interval = check_interval
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.route_patterns: List[re.Pattern] = []
+        self.enabled = False
+        self.settings_mtime: Optional[float] = None
+        self.next_check = 0.0
+        self.active = 0
+        self.counter = 0
+        self.lock = threading.Lock()
+        self.sampler = _Sampler()
+        os.makedirs(profile_dir, exist_ok=True)
+        self.reload()
+
+    # ------------------------------------------------------------------
+    #  Settings
+
+    @property
+    def settings_path(self) -> str:
+        return os.path.join(self.profile_dir, SETTINGS_FILENAME)
+
+    def _apply(self, settings: dict) -> None:
+        self.settings = settings
+        self.route_patterns = [compile_path(r)[0] for r in settings["routes"]]
+        self.enabled = bool(settings["enabled"]) and (
+            bool(settings["routes"]) or settings["sample_rate"] > 0
+        )
+
+    def reload(self) -> None:
+        """
+        Pick up the settings file if it has changed.
+        """
+        self.next_check = time.monotonic() + self.check_interval
+        try:
+            mtime = os.stat(self.settings_path).st_mtime
+        except OSError:
+            mtime = None
+        if mtime == self.settings_mtime:
+            return
+        self.settings_mtime = mtime
+        settings = dict(DEFAULT_SETTINGS)
+        if mtime is not None:
+            try:
+                with open(self.settings_path) as fp:
+                    settings.update(validate_settings(json.load(fp)))
+            except (OSError, ValueError) as e:
+                logger.error(f"Ignoring profiler settings: {e}")
+        self._apply(settings)
+
+    def update(self, changes: dict) -> dict:
+        """
+        Change the settings, for this and every other process sharing
+        the profile directory.
+
+        :raises ValueError: if a setting is invalid.
+        """
+        settings = dict(self.settings)
+        settings.update(validate_settings(changes))
+        tmp_path = f"{self.settings_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as fp:
+            json.dump(settings, fp, indent=2)
+        os.replace(tmp_path, self.settings_path)
+        self.settings_mtime = os.stat(self.settings_path).st_mtime
+        self._apply(settings)
+        return settings
+
+    # ------------------------------------------------------------------
+    #  Sampling
+
+    def wants(self, path: str) -> bool:
+        if any(p.match(path) for p in self.route_patterns):
+            return True
+        rate = self.settings["sample_rate"]
+        return rate > 0 and random.random() < rate
+
+    def start(self, method: str, path: str) -> Optional[_Session]:
+        if time.monotonic() >= self.next_check:
+            self.reload()
+        if not self.enabled or not self.wants(path):
+            return None
+        with self.lock:
+            if self.active >= self.max_active:
+                return None
+            self.active += 1
+            self.counter += 1
+            n = self.counter
+        session = _Session(f"{method} {path}", n, self.max_duration)
+        self.sampler.open(session, self.settings["interval"])
+        return session
+
+    def finish(self, session: _Session, status: int) -> None:
+        """
+        Stop sampling a request and write its profile (call from a
+        worker thread).
+        """
+        self.sampler.close(session)
+        with self.lock:
+            self.active -= 1
+        try:
+            self._write(session, status)
+        except OSError as e:
+            logger.error(f"Could not write profile: {e}")
+
+    # ------------------------------------------------------------------
+    #  Profile files
+
+    def _write(self, session: _Session, status: int) -> None:
+        method, path = session.label.split(" ", 1)
+        slug = re.sub(r"[^A-Za-z0-9]+", "-", path).strip("-") or "root"
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime())
+        base = f"{stamp}-{method.lower()}-{slug[:80]}-{os.getpid()}-{session.number}"
+        duration = session.end - session.start
+        label = f"{session.label} -> {status} in {duration:.3f} s"
+        if session.truncated:
+            label += f" (first {self.max_duration:.0f} s)"
+        session.label = label
+        with open(os.path.join(self.profile_dir, base + ".collapsed"), "w") as fp:
+            fp.write(collapsed_stacks(session))
+        with open(os.path.join(self.profile_dir, base + ".speedscope.json"), "w") as fp:
+            json.dump(speedscope_profile(session, self.settings["interval"]), fp)
+        self._prune()
+
+    def _prune(self) -> None:
+        profiles = self.list()
+        bases = sorted({p["name"].split(".", 1)[0] for p in profiles})
+        for base in bases[: max(0, len(bases) - self.max_profiles)]:
+            for suffix in (".collapsed", ".speedscope.json"):
+                try:
+                    os.remove(os.path.join(self.profile_dir, base + suffix))
+                except OSError:
+                    pass
+
+    def list(self) -> List[dict]:
+        """
+        Profile files, newest first.
+        """
+        profiles = []
+        for entry in os.scandir(self.profile_dir):
+            if entry.name.endswith((".collapsed", ".speedscope.json")):
+                st = entry.stat()
+                profiles.append({"name": entry.name, "size": st.st_size, "modified": st.st_mtime})
+        profiles.sort(key=lambda p: p["name"], reverse=True)
+        return profiles
+
+    def path(self, name: str) -> Optional[str]:
+        """
+        Path of a profile file, or None if there is no such profile.
+        """
+        if os.path.basename(name) != name or not name.endswith((".collapsed", ".speedscope.json")):
+            return None
+        path = os.path.join(self.profile_dir, name)
+        return path if os.path.isfile(path) else None
+
+
+def _number(key: str, value) -> float:
+    # (Not float(value) alone: that raises TypeError for lists and such.)
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(f"{key} must be a number")
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f"{key} must be a number")
+
+
+def validate_settings(settings: dict) -> dict:
+    """
+    Check profiler settings.
+
+    :raises ValueError: if a setting is unknown or has a bad value.
+    """
+    if not isinstance(settings, dict):
+        raise ValueError("Profiler settings must be an object")
+    checked = {}
+    for key, value in settings.items():
+        if key not in DEFAULT_SETTINGS:
+            raise ValueError(f"Unknown profiler setting '{key}'")
+        if key == "enabled":
+            value = bool(value)
+        elif key == "routes":
+            if not isinstance(value, list) or not all(isinstance(r, str) and r.startswith("/") for r in value):
+                raise ValueError("routes must be a list of paths starting with '/'")
+            value = list(value)
+        elif key == "sample_rate":
+            value = _number(key, value)
+            if not 0 <= value <= 1:
+                raise ValueError("sample_rate must be between 0 and 1")
+        elif key == "interval":
+            value = _number(key, value)
+            if not 0.001 <= value <= 1:
+                raise ValueError("interval must be between 0.001 and 1 seconds")
+        checked[key] = value
+    return checked
+
+
+class ProfilerMiddleware:
+    """
+    ASGI middleware profiling the requests a RequestProfiler asks for.
+    """
+
+    def __init__(self, app, profiler: RequestProfiler) -> None:
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        profiler = self.profiler
+        if scope["type"] != "http" or (
+            not profiler.enabled and time.monotonic() < profiler.next_check
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        session = profiler.start(scope["method"], scope["path"])
+        if session is None:
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Formatting and writing the profile is done off the event loop.
+            asyncio.get_running_loop().run_in_executor(
+                None, profiler.finish, session, status["code"]
+            )
@@ -0,0 +1,485 @@
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from tools.server.scheduler import QueuedRun, dispatch_order, pick_next
+from tools.server.status import read_status_file
+
+logger = logging.getLogger(__name__)
+
+# Durable run queue shared by all API replicas and model workers.
+#
+# The queue lives in an SQLite database on the jobs volume.  API pods
+# only ever enqueue, cancel and look up queue positions; workers claim
+# runs under a time-limited lease that they keep renewing while the
+# model process is alive.  If a worker dies, its leases run out and
+# the next worker to look at the queue puts those runs back in the
+# queue (or retires them, if the job's status file says they finished
+# anyway).
+#
+# The database is opened in the default rollback journal mode: WAL
+# needs shared memory between processes, which a ReadWriteMany network
+# volume does not provide.
+
+RUN_QUEUE_FILENAME = "runqueue.db"
+
+# Terminal states for a queued run.
+FINISHED_STATES = ("DONE", "FAILED", "CANCELLED")
+
+# Give up on a run after it has been re-queued this many times.
+MAX_ATTEMPTS = 3
+
+
+class RunQueue:
+    """
+    SQLite-backed queue of model runs with worker leases.
+    """
+
+    def __init__(self, db_path: str, per_user_slots: Optional[int] = None) -> None:
+        """
+        :param db_path: Path of the queue database (on the shared jobs volume).
+        :param per_user_slots: Optional cap on concurrent runs for one user,
+                               across all workers.
+        """
+        self.db_path = db_path
+        self.per_user_slots = per_user_slots
+        dir_path = os.path.dirname(db_path)
+        if dir_path:
+            os.makedirs(dir_path, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS runs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    job_name TEXT NOT NULL,
+                    job_path TEXT NOT NULL,
+                    priority INTEGER NOT NULL DEFAULT 0,
+                    state TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker_id TEXT,
+                    lease_expires REAL,
+                    last_status TEXT,
+                    exit_code INTEGER,
+                    enqueued_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS runs_state ON runs (state, user_id)"
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS served (
+                    user_id INTEGER PRIMARY KEY,
+                    tick INTEGER NOT NULL
+                )
+                """
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    # ------------------------------------------------------------------
+    #  API side
+
+    def enqueue(self, user_id: int, job_name: str, job_path: str, priority: int = 0) -> int:
+        """
+        Add a run to the queue.
+
+        :return: The ID of the queued run.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            active = conn.execute(
+                "SELECT 1 FROM runs WHERE user_id = ? AND job_name = ? AND state IN ('QUEUED', 'RUNNING')",
+                (user_id, job_name),
+            ).fetchone()
+            if active:
+                conn.execute("ROLLBACK")
+                raise ValueError(f"Job '{job_name}' is already queued or running")
+            cur = conn.execute(
+                "INSERT INTO runs (user_id, job_name, job_path, priority, state, enqueued_at) VALUES (?, ?, ?, ?, 'QUEUED', ?)",
+                (user_id, job_name, job_path, priority, time.time()),
+            )
+            conn.execute("COMMIT")
+            return cur.lastrowid
+        finally:
+            conn.close()
+
+    def cancel(self, user_id: int, job_name: str) -> bool:
+        """
+        Cancel a queued run.  Runs that have been claimed are not affected.
+
+        :return: True if a queued run was cancelled.
+        """
+        conn = self._connect()
+        try:
+            cur = conn.execute(
+                "UPDATE runs SET state = 'CANCELLED', finished_at = ? WHERE user_id = ? AND job_name = ? AND state = 'QUEUED'",
+                (time.time(), user_id, job_name),
+            )
+            return cur.rowcount > 0
+        finally:
+            conn.close()
+
+    def run_state(self, user_id: int, job_name: str) -> Optional[str]:
+        """
+        State of the most recent run of a job, or None if it was never queued.
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT state FROM runs WHERE user_id = ? AND job_name = ? ORDER BY id DESC LIMIT 1",
+                (user_id, job_name),
+            ).fetchone()
+            return row["state"] if row else None
+        finally:
+            conn.close()
+
+    def queue_position(self, user_id: int, job_name: str) -> Optional[int]:
+        """
+        1-based position of a queued run in dispatch order, or None if not queued.
+        """
+        conn = self._connect()
+        try:
+            queued = conn.execute(
+                "SELECT 1 FROM runs WHERE user_id = ? AND job_name = ? AND state = 'QUEUED'",
+                (user_id, job_name),
+            ).fetchone()
+            # The dispatch simulation is only needed for runs that are queued.
+            if queued is None:
+                return None
+            order = self._dispatch_order(conn)
+        finally:
+            conn.close()
+        for pos, run in enumerate(order, start=1):
+            if run.user_id == user_id and run.job_name == job_name:
+                return pos
+        return None
+
+    def counts(self) -> Dict[str, int]:
+        """
+        Number of runs in each state that is not yet finished.
+        """
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT state, COUNT(*) AS n FROM runs WHERE state IN ('QUEUED', 'RUNNING') GROUP BY state"
+            ).fetchall()
+            return {row["state"]: row["n"] for row in rows}
+        finally:
+            conn.close()
+
+    # ------------------------------------------------------------------
+    #  Worker side
+
+    def claim(self, worker_id: str, lease_seconds: float) -> Optional[sqlite3.Row]:
+        """
+        Claim the next run in fair-share order.
+
+        :return: The claimed run's row, or None if there is nothing to do.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            self._requeue_expired(conn)
+            queues, running, served, rows = self._snapshot(conn)
+            run = pick_next(queues, running, served, self.per_user_slots)
+            if run is None:
+                conn.execute("COMMIT")
+                return None
+            now = time.time()
+            conn.execute(
+                "UPDATE runs SET state = 'RUNNING', worker_id = ?, lease_expires = ?, started_at = ? WHERE id = ?",
+                (worker_id, now + lease_seconds, now, run.seq),
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO served (user_id, tick) VALUES (?, ?)",
+                (run.user_id, run.seq),
+            )
+            conn.execute("COMMIT")
+            return rows[run.seq]
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def heartbeat(self, run_id: int, worker_id: str, lease_seconds: float) -> bool:
+        """
+        Renew the lease on a claimed run.
+
+        :return: False if the lease has been lost (the run was re-queued).
+        """
+        conn = self._connect()
+        try:
+            cur = conn.execute(
+                "UPDATE runs SET lease_expires = ? WHERE id = ? AND worker_id = ? AND state = 'RUNNING'",
+                (time.time() + lease_seconds, run_id, worker_id),
+            )
+            return cur.rowcount > 0
+        finally:
+            conn.close()
+
+    def finish(self, run_id: int, worker_id: str, state: str, exit_code: Optional[int] = None, last_status: Optional[str] = None) -> None:
+        """
+        Record the end of a claimed run.
+        """
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE runs SET state = ?, exit_code = ?, last_status = ?, finished_at = ?, lease_expires = NULL WHERE id = ? AND worker_id = ?",
+                (state, exit_code, last_status, time.time(), run_id, worker_id),
+            )
+        finally:
+            conn.close()
+
+    def requeue_expired(self) -> int:
+        """
+        Put runs whose worker lease has run out back in the queue.
+
+        :return: The number of runs affected.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            n = self._requeue_expired(conn)
+            conn.execute("COMMIT")
+            return n
+        finally:
+            conn.close()
+
+    # ------------------------------------------------------------------
+    #  Internals
+
+    def _requeue_expired(self, conn: sqlite3.Connection) -> int:
+        # A run whose worker vanished is re-queued from the job's last
+        # recorded status: if the model got as far as finishing (or
+        # failing), the run is retired; otherwise it goes back in the
+        # queue, and a PAUSED status means it will resume rather than
+        # start over (see launch_model).
+        expired = conn.execute(
+            "SELECT id, job_name, job_path, attempts FROM runs WHERE state = 'RUNNING' AND lease_expires < ?",
+            (time.time(),),
+        ).fetchall()
+        for row in expired:
+            status = None
+            if os.path.exists(os.path.join(row["job_path"], "status")):
+                status_parts = read_status_file(row["job_path"])
+                status = status_parts[0] if status_parts else None
+            if status == "COMPLETE":
+                state = "DONE"
+            elif status == "ERRORED" or row["attempts"] + 1 >= MAX_ATTEMPTS:
+                state = "FAILED"
+            else:
+                state = "QUEUED"
+            logger.warning(
+                f"Lease expired for job '{row['job_name']}' (last status {status}): now {state}"
+            )
+            conn.execute(
+                "UPDATE runs SET state = ?, attempts = attempts + 1, worker_id = NULL, lease_expires = NULL, last_status = ? WHERE id = ?",
+                (state, status, row["id"]),
+            )
+        return len(expired)
+
+    def _snapshot(self, conn: sqlite3.Connection):
+        rows = {
+            row["id"]: row
+            for row in conn.execute(
+                "SELECT * FROM runs WHERE state = 'QUEUED'"
+            ).fetchall()
+        }
+        queues: Dict[int, List[QueuedRun]] = {}
+        for row in rows.values():
+            queues.setdefault(row["user_id"], []).append(
+                QueuedRun(row["user_id"], row["job_name"], row["job_path"], row["priority"], row["id"])
+            )
+        running = {
+            row["user_id"]: row["n"]
+            for row in conn.execute(
+                "SELECT user_id, COUNT(*) AS n FROM runs WHERE state = 'RUNNING' GROUP BY user_id"
+            ).fetchall()
+        }
+        served = {
+            row["user_id"]: row["tick"]
+            for row in conn.execute("SELECT user_id, tick FROM served").fetchall()
+        }
+        return queues, running, served, rows
+
+    def _dispatch_order(self, conn: sqlite3.Connection) -> List[QueuedRun]:
+        queues, running, served, _ = self._snapshot(conn)
+        return dispatch_order(queues, running, served, self.per_user_slots)
+
+
+class RunWorker:
+    """
+    Claims runs from a RunQueue and supervises the model processes.
+    """
+
+    def __init__(
+        self,
+        queue: RunQueue,
+        launcher: Callable,
+        slots: int = 1,
+        lease_seconds: float = 60.0,
+        poll_interval: float = 2.0,
+        worker_id: Optional[str] = None,
+    ) -> None:
+        """
+        :param queue: The shared run queue.
+        :param launcher: Called with a job directory; starts the model and
+                         returns its process handle.
+        :param slots: Maximum number of model processes run by this worker.
+        :param lease_seconds: Lease duration; renewed every lease_seconds / 4.
+        :param poll_interval: Seconds between queue checks.
+        :param worker_id: Identifier recorded on claimed runs.
+        """
+        self.queue = queue
+        self.launcher = launcher
+        self.slots = slots
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.running: Dict[int, tuple] = {}  # run ID -> (row, process)
+        self.last_heartbeat = 0.0
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """
+        Run the worker loop in a background thread.
+        """
+        if self.thread is None:
+            self.thread = threading.Thread(
+                target=self.run_forever, name="run-worker", daemon=True
+            )
+            self.thread.start()
+
+    def stop(self) -> None:
+        self.stopping.set()
+        self.wakeup.set()
+
+    def poke(self) -> None:
+        """
+        Claim and start whatever can be started right now.
+        """
+        self.step()
+
+    def running_count(self) -> int:
+        with self.lock:
+            return len(self.running)
+
+    def running_paths(self) -> List[str]:
+        with self.lock:
+            return [row["job_path"] for row, _ in self.running.values()]
+
+    def run_forever(self) -> None:
+        logger.info(f"Run worker {self.worker_id} started with {self.slots} slot(s)")
+        while not self.stopping.is_set():
+            try:
+                self.step()
+            except Exception as e:
+                logger.error(f"Run worker error: {e}")
+            self.wakeup.wait(self.poll_interval)
+            self.wakeup.clear()
+
+    def step(self) -> None:
+        with self.lock:
+            self._reap()
+            if time.time() - self.last_heartbeat > self.lease_seconds / 4:
+                self._heartbeat()
+            while len(self.running) < self.slots:
+                row = self.queue.claim(self.worker_id, self.lease_seconds)
+                if row is None:
+                    break
+                try:
+                    proc = self.launcher(row["job_path"])
+                except Exception as e:
+                    logger.error(f"Failed to start job '{row['job_name']}': {e}")
+                    self.queue.finish(row["id"], self.worker_id, "FAILED")
+                    continue
+                logger.info(f"Started job '{row['job_name']}' for user {row['user_id']}")
+                self.running[row["id"]] = (row, proc)
+
+    def _heartbeat(self) -> None:
+        self.last_heartbeat = time.time()
+        for run_id, (row, proc) in list(self.running.items()):
+            if not self.queue.heartbeat(run_id, self.worker_id, self.lease_seconds):
+                # Someone else has re-queued the run: don't let two
+                # copies of the model write to the same job directory.
+                logger.warning(f"Lost lease on job '{row['job_name']}': stopping model")
+                proc.kill()
+                proc.wait()
+                del self.running[run_id]
+
+    def _reap(self) -> None:
+        for run_id, (row, proc) in list(self.running.items()):
+            if proc.poll() is None:
+                continue
+            status_parts = read_status_file(row["job_path"]) if os.path.exists(
+                os.path.join(row["job_path"], "status")
+            ) else None
+            last_status = status_parts[0] if status_parts else None
+            state = "DONE" if proc.returncode == 0 else "FAILED"
+            self.queue.finish(run_id, self.worker_id, state, proc.returncode, last_status)
+            logger.info(
+                f"Job '{row['job_name']}' for user {row['user_id']} exited with code {proc.returncode}"
+            )
+            del self.running[run_id]
+
+
+class SharedRunScheduler:
+    """
+    Run scheduler front end for the REST API when runs go through the
+    shared queue.  Has the same interface as RunScheduler.  With
+    slots > 0, the API process also runs a worker of its own.
+    """
+
+    def __init__(self, queue: RunQueue, launcher: Callable, slots: int = 0) -> None:
+        self.queue = queue
+        self.worker = RunWorker(queue, launcher, slots=slots) if slots > 0 else None
+        if self.worker:
+            self.worker.start()
+
+    def submit(self, user_id: int, job_name: str, job_path: str, priority: int = 0) -> Optional[int]:
+        self.queue.enqueue(user_id, job_name, job_path, priority)
+        if self.worker:
+            self.worker.poke()
+        if self.queue.run_state(user_id, job_name) == "RUNNING":
+            return None
+        return self.queue.queue_position(user_id, job_name)
+
+    def cancel(self, user_id: int, job_name: str) -> bool:
+        return self.queue.cancel(user_id, job_name)
+
+    def is_running(self, user_id: int, job_name: str) -> bool:
+        return self.queue.run_state(user_id, job_name) == "RUNNING"
+
+    def queue_position(self, user_id: int, job_name: str) -> Optional[int]:
+        return self.queue.queue_position(user_id, job_name)
+
+    def queued_count(self) -> int:
+        return self.queue.counts().get("QUEUED", 0)
+
+    def running_count(self) -> int:
+        return self.worker.running_count() if self.worker else 0
+
+    def running_paths(self) -> List[str]:
+        return self.worker.running_paths() if self.worker else []
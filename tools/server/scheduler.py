@@ -0,0 +1,281 @@
+import itertools
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Bounded run scheduler.  Model runs are expensive (one process pins a
+# CPU for hours), so rather than starting a process for every "Run"
+# click, runs go into per-user queues and are started only while a
+# free slot is available.  When a slot frees up, the next run comes
+# from the user with the fewest runs currently going (ties broken by
+# who was served least recently); within one user's queue, higher
+# priority runs go first, then first come, first served.
+
+RunKey = Tuple[int, str]
+
+
+class QueuedRun:
+    """
+    A run waiting for (or occupying) a scheduler slot.
+    """
+
+    def __init__(
+        self, user_id: int, job_name: str, job_path: str, priority: int, seq: int
+    ) -> None:
+        self.user_id = user_id
+        self.job_name = job_name
+        self.job_path = job_path
+        self.priority = priority
+        self.seq = seq  # Submission order, for FIFO within a priority.
+
+    @property
+    def key(self) -> RunKey:
+        return (self.user_id, self.job_name)
+
+
+def pick_next(
+    queues: Dict[int, List[QueuedRun]],
+    running: Dict[int, int],
+    served: Dict[int, int],
+    per_user_slots: Optional[int] = None,
+) -> Optional[QueuedRun]:
+    """
+    Choose the next run to start: first the user, then the best run in
+    that user's queue.
+
+    :param queues: Queued runs, keyed by user ID.
+    :param running: Number of running jobs, keyed by user ID.
+    :param served: When each user last had a run started (larger is later).
+    :param per_user_slots: Optional cap on concurrent runs for one user.
+    """
+    users = [
+        u
+        for u, q in queues.items()
+        if q and (per_user_slots is None or running.get(u, 0) < per_user_slots)
+    ]
+    if not users:
+        return None
+    user = min(users, key=lambda u: (running.get(u, 0), served.get(u, -1)))
+    return min(queues[user], key=lambda r: (-r.priority, r.seq))
+
+
+def dispatch_order(
+    queues: Dict[int, List[QueuedRun]],
+    running: Dict[int, int],
+    served: Dict[int, int],
+    per_user_slots: Optional[int] = None,
+) -> List[QueuedRun]:
+    """
+    Simulate dispatch over the given queues to find the order in which
+    queued runs will start.
+    """
+    queues = {u: list(q) for u, q in queues.items()}
+    running = dict(running)
+    served = dict(served)
+    tick = max(served.values(), default=0) + 1
+    order = []
+    while True:
+        run = pick_next(queues, running, served, per_user_slots)
+        if run is None:
+            # Anything left is blocked by the per-user cap: it goes
+            # last, in submission order.
+            rest = sorted((r for q in queues.values() for r in q), key=lambda r: r.seq)
+            return order + rest
+        queues[run.user_id].remove(run)
+        running[run.user_id] = running.get(run.user_id, 0) + 1
+        served[run.user_id] = tick
+        tick += 1
+        order.append(run)
+
+
+class RunScheduler:
+    """
+    Fair-share scheduler with a fixed number of model run slots.
+    """
+
+    def __init__(
+        self,
+        slots: int,
+        launcher: Callable,
+        per_user_slots: Optional[int] = None,
+        poll_interval: float = 1.0,
+    ) -> None:
+        """
+        :param slots: Maximum number of model processes running at once.
+        :param launcher: Called with a job directory; starts the model and
+                         returns its process handle.
+        :param per_user_slots: Optional cap on concurrent runs for one user.
+        :param poll_interval: Seconds between checks for finished runs.
+        """
+        self.slots = max(0, slots)
+        self.launcher = launcher
+        self.per_user_slots = per_user_slots
+        self.poll_interval = poll_interval
+        self.queues: Dict[int, List[QueuedRun]] = {}
+        self.running: Dict[RunKey, Tuple[QueuedRun, object]] = {}
+        # Runs taken off the queue whose launcher call is in progress
+        # (the launcher is called without the lock held).
+        self.starting: Dict[RunKey, QueuedRun] = {}
+        # Queue positions in dispatch order, worked out when first asked
+        # for after the queues (or the running set) last changed.
+        self.positions: Optional[Dict[RunKey, int]] = None
+        self.last_served: Dict[int, int] = {}
+        self.counter = itertools.count()
+        self.lock = threading.RLock()
+        self.monitor: Optional[threading.Thread] = None
+
+    # ------------------------------------------------------------------
+    #  Public interface
+
+    def submit(
+        self, user_id: int, job_name: str, job_path: str, priority: int = 0
+    ) -> Optional[int]:
+        """
+        Queue a run and start whatever can be started.
+
+        Launch errors for the submitted run itself are raised to the
+        caller (and the run is dropped from the queue).
+
+        :return: None if the run was started, otherwise its 1-based queue position.
+        """
+        key = (user_id, job_name)
+        with self.lock:
+            if key in self.running or key in self.starting or self.queue_position(user_id, job_name):
+                raise ValueError(f"Job '{job_name}' is already queued or running")
+            run = QueuedRun(user_id, job_name, job_path, priority, next(self.counter))
+            self.queues.setdefault(user_id, []).append(run)
+            self.positions = None
+        self._dispatch(raise_for=key)
+        with self.lock:
+            if key in self.running or key in self.starting:
+                return None
+            return self.queue_position(user_id, job_name)
+
+    def cancel(self, user_id: int, job_name: str) -> bool:
+        """
+        Remove a queued run.  Runs that have already started are not affected.
+
+        :return: True if a queued run was removed.
+        """
+        with self.lock:
+            queue = self.queues.get(user_id, [])
+            for run in queue:
+                if run.job_name == job_name:
+                    queue.remove(run)
+                    self.positions = None
+                    return True
+            return False
+
+    def is_running(self, user_id: int, job_name: str) -> bool:
+        with self.lock:
+            key = (user_id, job_name)
+            return key in self.running or key in self.starting
+
+    def queue_position(self, user_id: int, job_name: str) -> Optional[int]:
+        """
+        1-based position of a queued run in dispatch order, or None if not queued.
+        """
+        with self.lock:
+            if self.positions is None:
+                self.positions = {
+                    run.key: pos for pos, run in enumerate(self._dispatch_order(), start=1)
+                }
+            return self.positions.get((user_id, job_name))
+
+    def queued_count(self) -> int:
+        with self.lock:
+            return sum(len(q) for q in self.queues.values())
+
+    def running_count(self) -> int:
+        with self.lock:
+            return len(self.running)
+
+    def running_paths(self) -> List[str]:
+        """
+        Job directories of the runs going on in this process.
+        """
+        with self.lock:
+            return [run.job_path for run, _ in self.running.values()]
+
+    # ------------------------------------------------------------------
+    #  Dispatch
+
+    def _running_by_user(self) -> Dict[int, int]:
+        counts: Dict[int, int] = {}
+        for user_id, _ in itertools.chain(self.running, self.starting):
+            counts[user_id] = counts.get(user_id, 0) + 1
+        return counts
+
+    def _dispatch_order(self) -> List[QueuedRun]:
+        return dispatch_order(
+            self.queues, self._running_by_user(), self.last_served, self.per_user_slots
+        )
+
+    def _dispatch(self, raise_for: Optional[RunKey] = None) -> None:
+        # Each run is taken off its queue under the lock, but launched
+        # without it: starting a model can take a while, and status
+        # requests shouldn't wait for it.
+        while True:
+            with self.lock:
+                if len(self.running) + len(self.starting) >= self.slots:
+                    break
+                run = pick_next(
+                    self.queues,
+                    self._running_by_user(),
+                    self.last_served,
+                    self.per_user_slots,
+                )
+                if run is None:
+                    break
+                self.queues[run.user_id].remove(run)
+                self.last_served[run.user_id] = next(self.counter)
+                self.starting[run.key] = run
+                self.positions = None
+            try:
+                proc = self.launcher(run.job_path)
+            except Exception as e:
+                with self.lock:
+                    del self.starting[run.key]
+                if run.key == raise_for:
+                    raise
+                logger.error(f"Failed to start queued job '{run.job_name}': {e}")
+                continue
+            logger.info(f"Started job '{run.job_name}' for user {run.user_id}")
+            with self.lock:
+                del self.starting[run.key]
+                self.running[run.key] = (run, proc)
+                self._ensure_monitor()
+
+    # ------------------------------------------------------------------
+    #  Finished run detection
+
+    def _ensure_monitor(self) -> None:
+        if self.monitor is None or not self.monitor.is_alive():
+            self.monitor = threading.Thread(
+                target=self._monitor, name="run-scheduler", daemon=True
+            )
+            self.monitor.start()
+
+    def _monitor(self) -> None:
+        while True:
+            time.sleep(self.poll_interval)
+            with self.lock:
+                finished = [
+                    key for key, (_, proc) in self.running.items() if proc.poll() is not None
+                ]
+                for key in finished:
+                    run, proc = self.running.pop(key)
+                    logger.info(
+                        f"Job '{run.job_name}' for user {run.user_id} exited with code {proc.returncode}"
+                    )
+                if finished:
+                    self.positions = None
+            if finished:
+                self._dispatch()
+            with self.lock:
+                if not self.running:
+                    self.monitor = None
+                    return
@@ -0,0 +1,88 @@
+import sqlite3
+import time
+from typing import Optional
+
+# Selected job per user.
+#
+# Older clients call /run-job, /pause-job and /delete-job without
+# naming the job, acting on the job last opened with /job/{job_name}
+# (or created with /add-job).  That selection used to be held in the
+# API process, so with more than one replica a request could reach a
+# pod that had never seen it.  It is kept in an SQLite table on the
+# jobs volume instead, so every replica sees the same selection.  New
+# clients should name the job in the request and not depend on this.
+
+SELECTION_FILENAME = "selection.db"
+
+
+class JobSelection:
+    """
+    Each user's selected job, shared by all API replicas.
+    """
+
+    def __init__(self, db_path: str) -> None:
+        """
+        :param db_path: Path of the selection database.
+        """
+        self.db_path = db_path
+        conn = self._connect()
+        try:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS selection (
+                    user_id INTEGER PRIMARY KEY,
+                    job_name TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def get(self, user_id: int) -> Optional[str]:
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT job_name FROM selection WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            return row[0] if row else None
+        finally:
+            conn.close()
+
+    def set(self, user_id: int, job_name: str) -> None:
+        """
+        Select a job.  Selecting the job that is already selected (every
+        job details request does) costs a read, not a write.
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT job_name FROM selection WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            if row is not None and row[0] == job_name:
+                return
+            conn.execute(
+                "INSERT OR REPLACE INTO selection (user_id, job_name, updated_at) VALUES (?, ?, ?)",
+                (user_id, job_name, time.time()),
+            )
+        finally:
+            conn.close()
+
+    def clear(self, user_id: int, job_name: Optional[str] = None) -> None:
+        """
+        Clear a user's selection (only if it is job_name, when given).
+        """
+        conn = self._connect()
+        try:
+            if job_name is None:
+                conn.execute("DELETE FROM selection WHERE user_id = ?", (user_id,))
+            else:
+                conn.execute(
+                    "DELETE FROM selection WHERE user_id = ? AND job_name = ?",
+                    (user_id, job_name),
+                )
+        finally:
+            conn.close()
@@ -0,0 +1,381 @@
+import hashlib
+import json
+import logging
+import os
+import struct
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from tools.server.compaction import CODEC_SUFFIXES, open_stored, split_codec, stored_file
+
+logger = logging.getLogger(__name__)
+
+# Columnar cache for ASCII time series output (biogem_series_*.res and
+# friends).
+#
+# A series file is a header line of "/"-separated column names followed
+# by whitespace-separated rows of numbers, and the model only ever
+# appends to it.  Each file is parsed once into a rows x columns array
+# of float64, saved as a .npy file in the cache directory alongside a
+# small JSON record of how many bytes of the source have been parsed.
+# Later requests parse only what has been appended since then: the new
+# rows are written to the end of the .npy file and its header is
+# rewritten in place (the header is padded to a fixed size so that it
+# always fits).  Values that don't parse as numbers are stored as NaN,
+# and rows with a NaN in a requested column are dropped when reading,
+# which matches how the REST API used to skip such lines.  A file that
+# is rewritten from scratch (a job restarted from the beginning) is
+# detected by comparing the last parsed bytes, and re-parsed in full.
+#
+# Files of completed jobs may have been compressed (see compaction.py).
+# Those never change again: the cache entry made from the plain file is
+# handed over to the compressed copy when it is made, and a file the
+# cache hasn't seen is parsed from the decompressed stream a block at a
+# time.
+
+CACHE_FORMAT_VERSION = 2
+
+_CHECK_BYTES = 64
+
+# Decompressed bytes parsed at a time from a compressed series file.
+_PARSE_BLOCK = 4 * 1024 * 1024
+
+_NPY_MAGIC = b"\x93NUMPY\x01\x00"
+_NPY_HEADER_SIZE = 128
+
+
+def _npy_header(rows: int, ncols: int) -> bytes:
+    d = "{'descr': '<f8', 'fortran_order': False, 'shape': (%d, %d), }" % (rows, ncols)
+    pad = _NPY_HEADER_SIZE - len(_NPY_MAGIC) - 2 - len(d) - 1
+    return _NPY_MAGIC + struct.pack("<H", len(d) + pad + 1) + d.encode("latin1") + b" " * pad + b"\n"
+
+
+def parse_header(line: str) -> List[str]:
+    """
+    Column names from a series file header line (the first column keeps its "%").
+    """
+    return [col.strip() for col in line.strip().split("/")]
+
+
+def parse_rows(text: str, ncols: int) -> np.ndarray:
+    """
+    Parse whitespace-separated rows into an (n, ncols) float64 array.
+
+    Blank lines are skipped; missing or unparseable values become NaN
+    and extra values are ignored.
+    """
+    split = [line.split() for line in text.splitlines()]
+    split = [parts for parts in split if parts]
+    if not split:
+        return np.empty((0, ncols), dtype=np.float64)
+    if all(len(parts) == ncols for parts in split):
+        try:
+            return np.array(split, dtype=np.float64)
+        except ValueError:
+            pass
+    out = np.full((len(split), ncols), np.nan)
+    for i, parts in enumerate(split):
+        for j, value in enumerate(parts[:ncols]):
+            try:
+                out[i, j] = float(value)
+            except ValueError:
+                pass
+    return out
+
+
+class SeriesData:
+    """
+    Parsed contents of a series file.
+    """
+
+    def __init__(
+        self, path: str, columns: List[str], data: np.ndarray, offset: int, stamp: tuple = ()
+    ) -> None:
+        self.path = path
+        self.columns = columns  # Column names; the first is the time axis.
+        self.data = data  # rows x columns, float64 (possibly memory-mapped).
+        self.offset = offset  # Bytes of the source file parsed so far.
+        self.stamp = stamp  # (inode, size) of the stored file when last checked.
+
+    @property
+    def rows(self) -> int:
+        return self.data.shape[0]
+
+    def index(self, variable: str) -> int:
+        """
+        Column index of a variable (surrounding spaces ignored).
+        :raises KeyError: if the variable is not in the file.
+        """
+        variable = variable.strip()
+        if variable not in self.columns:
+            raise KeyError(variable)
+        return self.columns.index(variable)
+
+    def series(self, variable: str, start_row: int = 0):
+        """
+        Time and value arrays for one variable, without rows where either is NaN.
+        """
+        idx = self.index(variable)
+        t = np.asarray(self.data[start_row:, 0])
+        v = np.asarray(self.data[start_row:, idx])
+        mask = ~(np.isnan(t) | np.isnan(v))
+        return t[mask], v[mask]
+
+
+class SeriesCache:
+    """
+    Incrementally updated, persistent cache of parsed series files.
+    """
+
+    def __init__(self, cache_dir: str, max_entries: int = 64) -> None:
+        """
+        :param cache_dir: Directory for the cached .npy and .json files.
+        :param max_entries: Number of parsed files kept open in memory.
+        """
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, SeriesData]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.path_locks: Dict[str, threading.Lock] = {}
+
+    def _files(self, path: str):
+        key = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()
+        base = os.path.join(self.cache_dir, key[:2], key)
+        return base + ".npy", base + ".json", base + ".lock"
+
+    def _path_lock(self, path: str) -> threading.Lock:
+        with self.lock:
+            return self.path_locks.setdefault(path, threading.Lock())
+
+    def load(self, path: str) -> SeriesData:
+        """
+        Parsed contents of a series file, bringing the cache up to date first.
+        """
+        path = os.path.abspath(path)
+        with self._path_lock(path):
+            stored, codec = stored_file(path)
+            st = os.stat(stored)
+            with self.lock:
+                entry = self.entries.get(path)
+            # Fresh if the file hasn't changed since it was last checked
+            # (not offset == size: a partly written last line is left
+            # unparsed, and the file would be read again on every call).
+            if entry is not None and entry.stamp == (st.st_ino, st.st_size):
+                with self.lock:
+                    self.entries.move_to_end(path)
+                return entry
+            if codec is None:
+                entry = self._update(path, st)
+            else:
+                entry = self._update_compressed(path, stored, codec, st)
+            with self.lock:
+                self.entries[path] = entry
+                self.entries.move_to_end(path)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+            return entry
+
+    def invalidate(self, path: str) -> None:
+        """
+        Forget a file (e.g. because it is about to be removed).
+        """
+        path = os.path.abspath(path)
+        with self.lock:
+            self.entries.pop(path, None)
+        for f in self._files(path)[:2]:
+            try:
+                os.remove(f)
+            except OSError:
+                pass
+
+    def invalidate_job(self, job_path: str) -> None:
+        """
+        Forget all of a job's output files (before the job is deleted).
+        """
+        output_dir = os.path.join(os.path.abspath(job_path), "output")
+        with self.lock:
+            paths = {p for p in self.entries if p.startswith(output_dir + os.sep)}
+        for dirpath, _, names in os.walk(output_dir):
+            paths.update(os.path.join(dirpath, split_codec(name)[0]) for name in names)
+        for path in paths:
+            self.invalidate(path)
+            try:
+                os.remove(self._files(path)[2])
+            except OSError:
+                pass
+
+    def adopt_compressed(self, path: str) -> None:
+        """
+        Point a file's cache entry at its compressed copy, which has just
+        been made from the (fully parsed) plain file.
+        """
+        path = os.path.abspath(path)
+        for codec, suffix in CODEC_SUFFIXES.items():
+            stored = path + suffix
+            if os.path.exists(stored):
+                break
+        else:
+            return
+        npy_file, meta_file, lock_file = self._files(path)
+        with self._path_lock(path), open(lock_file, "a") as lock_fp:
+            if fcntl:
+                fcntl.flock(lock_fp, fcntl.LOCK_EX)
+            try:
+                meta = self._read_meta(meta_file)
+                if meta and meta["version"] == CACHE_FORMAT_VERSION and os.path.exists(npy_file):
+                    st = os.stat(stored)
+                    meta.update(codec=codec, stored_inode=st.st_ino, stored_size=st.st_size)
+                    self._write_meta(meta_file, meta)
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_fp, fcntl.LOCK_UN)
+
+    # ------------------------------------------------------------------
+
+    def _update_compressed(
+        self, path: str, stored: str, codec: str, st: os.stat_result
+    ) -> SeriesData:
+        npy_file, meta_file, lock_file = self._files(path)
+        os.makedirs(os.path.dirname(npy_file), exist_ok=True)
+        with open(lock_file, "a") as lock_fp:
+            if fcntl:
+                fcntl.flock(lock_fp, fcntl.LOCK_EX)
+            try:
+                meta = self._read_meta(meta_file)
+                if not (
+                    meta
+                    and meta["version"] == CACHE_FORMAT_VERSION
+                    and meta.get("codec") == codec
+                    and meta.get("stored_inode") == st.st_ino
+                    and meta.get("stored_size") == st.st_size
+                    and os.path.exists(npy_file)
+                ):
+                    # Parse the decompressed stream, a block of complete
+                    # lines at a time.
+                    with open_stored(stored, codec) as src:
+                        header_line = src.readline()
+                        meta = self._rebuild(npy_file, header_line, st)
+                        pending = b""
+                        while True:
+                            block = src.read(_PARSE_BLOCK)
+                            data = pending + block
+                            end = len(data) if not block else data.rfind(b"\n") + 1
+                            if end:
+                                rows = parse_rows(data[:end].decode("utf-8", "replace"), meta["ncols"])
+                                self._append(npy_file, meta, rows)
+                                meta["offset"] += end
+                            pending = data[end:]
+                            if not block:
+                                break
+                    meta.update(codec=codec, stored_inode=st.st_ino, stored_size=st.st_size)
+                    self._write_meta(meta_file, meta)
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_fp, fcntl.LOCK_UN)
+        data = np.load(npy_file, mmap_mode="r") if meta["rows"] else np.empty((0, meta["ncols"]))
+        return SeriesData(
+            path, parse_header(meta["header"]), data, meta["offset"], (st.st_ino, st.st_size)
+        )
+
+    def _update(self, path: str, st: os.stat_result) -> SeriesData:
+        npy_file, meta_file, lock_file = self._files(path)
+        os.makedirs(os.path.dirname(npy_file), exist_ok=True)
+        with open(lock_file, "a") as lock_fp:
+            # Other API replicas may be updating the same cache files.
+            if fcntl:
+                fcntl.flock(lock_fp, fcntl.LOCK_EX)
+            try:
+                meta = self._read_meta(meta_file)
+                with open(path, "rb") as src:
+                    header_line = src.readline()
+                    if not (
+                        meta
+                        and meta["version"] == CACHE_FORMAT_VERSION
+                        and meta["inode"] == st.st_ino
+                        and meta["header"] == header_line.decode("utf-8", "replace")
+                        and meta["offset"] <= st.st_size
+                        and self._last_bytes(src, meta["offset"]) == meta.get("last_bytes")
+                        and os.path.exists(npy_file)
+                    ):
+                        meta = self._rebuild(npy_file, header_line, st)
+                    src.seek(meta["offset"])
+                    tail = src.read(st.st_size - meta["offset"])
+                # Only parse complete lines: the model may be part-way
+                # through writing the last one.
+                end = tail.rfind(b"\n") + 1
+                if end:
+                    rows = parse_rows(tail[:end].decode("utf-8", "replace"), meta["ncols"])
+                    self._append(npy_file, meta, rows)
+                    meta["offset"] += end
+                    meta["last_bytes"] = tail[max(0, end - _CHECK_BYTES) : end].hex()
+                    self._write_meta(meta_file, meta)
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_fp, fcntl.LOCK_UN)
+        data = np.load(npy_file, mmap_mode="r") if meta["rows"] else np.empty((0, meta["ncols"]))
+        return SeriesData(
+            path, parse_header(meta["header"]), data, meta["offset"], (st.st_ino, st.st_size)
+        )
+
+    def _rebuild(self, npy_file: str, header_line: bytes, st: os.stat_result) -> dict:
+        header = header_line.decode("utf-8", "replace")
+        ncols = max(1, len(parse_header(header)))
+        # A new file, not truncating the old one: entries loaded before
+        # may still have it memory-mapped, and reading past the end of
+        # a truncated mapping kills the process (SIGBUS).
+        tmp = f"{npy_file}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as fp:
+            fp.write(_npy_header(0, ncols))
+        os.replace(tmp, npy_file)
+        return {
+            "version": CACHE_FORMAT_VERSION,
+            "inode": st.st_ino,
+            "header": header,
+            "ncols": ncols,
+            "rows": 0,
+            "offset": len(header_line),
+            "last_bytes": header_line[-_CHECK_BYTES:].hex(),
+        }
+
+    @staticmethod
+    def _last_bytes(src, offset: int) -> str:
+        # The bytes just before the parsed offset: if a file has been
+        # rewritten in place (same inode, same header) they will differ.
+        start = max(0, offset - _CHECK_BYTES)
+        src.seek(start)
+        return src.read(offset - start).hex()
+
+    def _append(self, npy_file: str, meta: dict, rows: np.ndarray) -> None:
+        if not len(rows):
+            return
+        with open(npy_file, "r+b") as fp:
+            # Data first, then the header that makes it visible.
+            fp.seek(_NPY_HEADER_SIZE + meta["rows"] * meta["ncols"] * 8)
+            fp.write(np.ascontiguousarray(rows, dtype="<f8").tobytes())
+            fp.truncate()
+            meta["rows"] += len(rows)
+            fp.seek(0)
+            fp.write(_npy_header(meta["rows"], meta["ncols"]))
+
+    @staticmethod
+    def _read_meta(meta_file: str) -> Optional[dict]:
+        try:
+            with open(meta_file) as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _write_meta(meta_file: str, meta: dict) -> None:
+        tmp = meta_file + ".tmp"
+        with open(tmp, "w") as fp:
+            json.dump(meta, fp)
+        os.replace(tmp, meta_file)
@@ -0,0 +1,52 @@
+import os
+import time
+from typing import List, Optional
+
+# Job status handling shared between the REST API and the run
+# scheduler.  The model writes its status file by writing "status_tmp"
+# and renaming it over "status" (see write_status in
+# src/wrappers/genie_global.f90), so a reader only ever sees a complete
+# file -- the retry loop below is for Windows, where the rename can
+# transiently lock the file.
+
+
+def read_status_file(job_dir: str) -> Optional[List[str]]:
+    """
+    Attempts to read the status file for a job, handling potential issues on Windows where
+    the file might be locked by another process.
+
+    :param job_dir: The job directory containing the 'status' file.
+    :return: A list containing the status information or None if the file could not be read.
+    """
+    status = None
+    safety = 0
+    while not status and safety < 1000:
+        try:
+            if safety != 0:
+                time.sleep(0.001)
+            safety += 1
+            with open(os.path.join(job_dir, "status")) as fp:
+                status = fp.readline().strip().split()
+        except FileNotFoundError:
+            # No status file: nothing to wait for.
+            return None
+        except IOError:
+            pass  # You may log the error here if needed
+    if safety == 1000:
+        print("Failed to read the status file after multiple attempts.")
+    return status
+
+
+def job_status(job_dir: str) -> str:
+    """
+    Determines the current status of a job from its job directory.
+
+    :param job_dir: Path to the job directory.
+    :return: "UNCONFIGURED", "RUNNABLE", the first word of the status file, or "ERROR".
+    """
+    if not os.path.exists(os.path.join(job_dir, "data_genie")):
+        return "UNCONFIGURED"
+    if not os.path.exists(os.path.join(job_dir, "status")):
+        return "RUNNABLE"
+    status_parts = read_status_file(job_dir)
+    return status_parts[0] if status_parts else "ERROR"
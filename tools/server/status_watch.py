@@ -0,0 +1,381 @@
+import asyncio
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Job status watcher.
+#
+# One watcher per API process follows the status files of every job on
+# the jobs volume and publishes status transitions (RUNNING -> PAUSED
+# -> COMPLETE, ...) and run progress to subscribers, so clients don't
+# have to poll.  The model replaces "status" by renaming "status_tmp"
+# over it, so on Linux a single inotify watch per job directory
+# catches every update.  inotify does not see writes made by other
+# hosts on a network filesystem, though, so there is a stat() polling
+# mode as well: jobs that are running (or have just been started) are
+# checked every poll interval, everything else once per sweep.
+
+try:
+    import ctypes
+    import ctypes.util
+
+    _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    _inotify_init1 = _libc.inotify_init1
+    _inotify_add_watch = _libc.inotify_add_watch
+    _inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    _inotify_rm_watch = _libc.inotify_rm_watch
+    inotify_available = sys.platform.startswith("linux")
+except (OSError, AttributeError):
+    inotify_available = False
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+# Filesystems on which inotify only sees local changes.
+NETWORK_FILESYSTEMS = ("nfs", "nfs4", "cifs", "smbfs", "smb3", "ceph", "glusterfs", "lustre")
+
+ACTIVE_STATUSES = ("RUNNING",)
+
+StatusState = Tuple[str, Optional[int], Optional[int], Optional[float]]
+
+
+def parse_status_line(line: str) -> StatusState:
+    """
+    Split a status file line into (status, koverall, koverall_total, genie_clock).
+    """
+    parts = line.split()
+    if not parts:
+        return ("ERROR", None, None, None)
+    try:
+        koverall = int(parts[1]) if len(parts) > 1 else None
+        total = int(parts[2]) if len(parts) > 2 else None
+        clock = float(parts[3]) if len(parts) > 3 else None
+    except ValueError:
+        koverall, total, clock = None, None, None
+    return (parts[0], koverall, total, clock)
+
+
+def is_network_filesystem(path: str) -> bool:
+    """
+    Whether a path lives on a network filesystem (Linux only; False elsewhere).
+    """
+    try:
+        path = os.path.realpath(path)
+        best, fstype = "", ""
+        with open("/proc/mounts") as fp:
+            for line in fp:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount = fields[1]
+                if (path == mount or path.startswith(mount.rstrip("/") + "/")) and len(mount) > len(best):
+                    best, fstype = mount, fields[2]
+        return fstype.startswith("fuse") or fstype in NETWORK_FILESYSTEMS
+    except OSError:
+        return False
+
+
+class StatusWatcher:
+    """
+    Follows job status files and publishes changes.
+    """
+
+    def __init__(
+        self,
+        jobs_root: str,
+        mode: str = "auto",
+        poll_interval: float = 2.0,
+        sweep_interval: float = 30.0,
+    ) -> None:
+        """
+        :param jobs_root: Root of the per-user job directories.
+        :param mode: "inotify", "poll" or "auto" (inotify on local filesystems).
+        :param poll_interval: Seconds between checks of active jobs when polling.
+        :param sweep_interval: Seconds between full rescans when polling.
+        """
+        self.jobs_root = jobs_root
+        if mode == "auto":
+            mode = "inotify" if inotify_available and not is_network_filesystem(jobs_root) else "poll"
+        if mode == "inotify" and not inotify_available:
+            mode = "poll"
+        self.mode = mode
+        self.poll_interval = poll_interval
+        self.sweep_interval = sweep_interval
+        self.states: Dict[str, StatusState] = {}
+        self.mtimes: Dict[str, Optional[float]] = {}
+        self.active: Set[str] = set()
+        self.listeners: List[Callable] = []
+        self.subscribers: Dict[int, Set[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+
+    # ------------------------------------------------------------------
+    #  Public interface
+
+    def start(self) -> None:
+        if self.thread is None:
+            target = self._run_inotify if self.mode == "inotify" else self._run_poll
+            self.thread = threading.Thread(target=target, name="status-watcher", daemon=True)
+            self.thread.start()
+            logger.info(f"Status watcher started ({self.mode})")
+
+    def add_listener(self, fn: Callable) -> None:
+        """
+        Register a function to be called (in the watcher thread) with each event.
+        """
+        self.listeners.append(fn)
+
+    def subscribe(self, user_id: int, maxsize: int = 100) -> asyncio.Queue:
+        """
+        Subscribe to one user's events from the running event loop.  If
+        the subscriber falls behind, the oldest events are dropped.
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        with self.lock:
+            self.subscribers.setdefault(user_id, set()).add(
+                (asyncio.get_running_loop(), queue)
+            )
+        return queue
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue) -> None:
+        with self.lock:
+            subs = self.subscribers.get(user_id, set())
+            for sub in [s for s in subs if s[1] is queue]:
+                subs.discard(sub)
+            if not subs:
+                self.subscribers.pop(user_id, None)
+
+    def subscriber_count(self) -> int:
+        with self.lock:
+            return sum(len(s) for s in self.subscribers.values())
+
+    def mark_active(self, job_dir: str) -> None:
+        """
+        Check a job at the fast polling rate (e.g. just after starting it).
+        """
+        with self.lock:
+            self.active.add(os.path.abspath(job_dir))
+
+    def snapshot(self, user_id: int) -> List[dict]:
+        """
+        Current status of each of a user's jobs that has a status file.
+        """
+        prefix = os.path.join(os.path.abspath(self.jobs_root), str(user_id)) + os.sep
+        with self.lock:
+            items = [(d, s) for d, s in self.states.items() if d.startswith(prefix)]
+        return [self._event(d, s, None) for d, s in sorted(items)]
+
+    def check(self, job_dir: str) -> None:
+        """
+        Re-read one job's status file and publish any change.
+        """
+        job_dir = os.path.abspath(job_dir)
+        path = os.path.join(job_dir, "status")
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            with self.lock:
+                self.mtimes.pop(job_dir, None)
+                self.states.pop(job_dir, None)
+                self.active.discard(job_dir)
+            return
+        with self.lock:
+            if self.mtimes.get(job_dir) == mtime:
+                return
+        try:
+            with open(path) as fp:
+                state = parse_status_line(fp.readline())
+        except OSError:
+            return
+        with self.lock:
+            self.mtimes[job_dir] = mtime
+            previous = self.states.get(job_dir)
+            self.states[job_dir] = state
+            if state[0] in ACTIVE_STATUSES:
+                self.active.add(job_dir)
+            else:
+                self.active.discard(job_dir)
+        if previous is not None and previous == state:
+            return
+        self._publish(self._event(job_dir, state, previous))
+
+    # ------------------------------------------------------------------
+    #  Events
+
+    def _split(self, job_dir: str) -> Tuple[Optional[int], str]:
+        user, _, job = os.path.relpath(job_dir, self.jobs_root).partition(os.sep)
+        return (int(user) if user.isdigit() else None), job
+
+    def _event(self, job_dir: str, state: StatusState, previous: Optional[StatusState]) -> dict:
+        user_id, job_name = self._split(job_dir)
+        status, koverall, total, clock = state
+        percent = None
+        if koverall is not None and total:
+            percent = 100.0 * koverall / total
+        return {
+            "user_id": user_id,
+            "job_name": job_name,
+            "status": status,
+            "previous_status": previous[0] if previous else None,
+            "koverall": koverall,
+            "koverall_total": total,
+            "genie_clock": clock,
+            "percent_complete": percent,
+            "time": time.time(),
+        }
+
+    def _publish(self, event: dict) -> None:
+        for fn in self.listeners:
+            try:
+                fn(event)
+            except Exception as e:
+                logger.error(f"Status listener failed: {e}")
+        with self.lock:
+            subs = list(self.subscribers.get(event["user_id"], ()))
+        for loop, queue in subs:
+            try:
+                loop.call_soon_threadsafe(self._deliver, queue, event)
+            except RuntimeError:
+                # Event loop closed under us.
+                self.unsubscribe(event["user_id"], queue)
+
+    @staticmethod
+    def _deliver(queue: asyncio.Queue, event: dict) -> None:
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(event)
+
+    # ------------------------------------------------------------------
+    #  Discovery
+
+    def _user_dirs(self) -> List[str]:
+        try:
+            return [
+                e.path for e in os.scandir(self.jobs_root) if e.is_dir() and e.name.isdigit()
+            ]
+        except OSError:
+            return []
+
+    def _job_dirs(self, user_dir: str) -> List[str]:
+        try:
+            return [e.path for e in os.scandir(user_dir) if e.is_dir()]
+        except OSError:
+            return []
+
+    def _all_job_dirs(self) -> List[str]:
+        return [j for u in self._user_dirs() for j in self._job_dirs(u)]
+
+    # ------------------------------------------------------------------
+    #  Polling mode
+
+    def _run_poll(self) -> None:
+        last_sweep = 0.0
+        while True:
+            try:
+                if time.time() - last_sweep >= self.sweep_interval:
+                    last_sweep = time.time()
+                    seen = set()
+                    for job_dir in self._all_job_dirs():
+                        seen.add(os.path.abspath(job_dir))
+                        self.check(job_dir)
+                    with self.lock:
+                        gone = [d for d in self.states if d not in seen]
+                    for job_dir in gone:
+                        self.check(job_dir)
+                else:
+                    with self.lock:
+                        active = list(self.active)
+                    for job_dir in active:
+                        self.check(job_dir)
+            except Exception as e:
+                logger.error(f"Status watcher error: {e}")
+            time.sleep(self.poll_interval)
+
+    # ------------------------------------------------------------------
+    #  inotify mode
+
+    def _run_inotify(self) -> None:
+        fd = _inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            logger.warning("inotify_init1 failed: falling back to polling")
+            self.mode = "poll"
+            return self._run_poll()
+        watches: Dict[int, str] = {}
+
+        def add_watch(path: str, mask: int) -> None:
+            wd = _inotify_add_watch(fd, os.fsencode(path), mask)
+            if wd >= 0:
+                watches[wd] = os.path.abspath(path)
+
+        def watch_job(job_dir: str) -> None:
+            add_watch(job_dir, IN_MOVED_TO | IN_CLOSE_WRITE | IN_DELETE_SELF)
+            self.check(job_dir)
+
+        def watch_user(user_dir: str) -> None:
+            add_watch(user_dir, IN_CREATE | IN_MOVED_TO | IN_DELETE)
+            for job_dir in self._job_dirs(user_dir):
+                watch_job(job_dir)
+
+        def rescan() -> None:
+            add_watch(self.jobs_root, IN_CREATE | IN_MOVED_TO)
+            for user_dir in self._user_dirs():
+                watch_user(user_dir)
+
+        rescan()
+        while True:
+            try:
+                ready, _, _ = select.select([fd], [], [], self.sweep_interval)
+                if not ready:
+                    continue
+                data = os.read(fd, 65536)
+            except InterruptedError:
+                continue
+            except BlockingIOError:
+                continue
+            pos = 0
+            while pos + _EVENT_HEADER.size <= len(data):
+                wd, mask, _, name_len = _EVENT_HEADER.unpack_from(data, pos)
+                pos += _EVENT_HEADER.size
+                name = os.fsdecode(data[pos : pos + name_len].rstrip(b"\0"))
+                pos += name_len
+                try:
+                    if mask & IN_Q_OVERFLOW:
+                        rescan()
+                        continue
+                    if mask & IN_IGNORED:
+                        watches.pop(wd, None)
+                        continue
+                    parent = watches.get(wd)
+                    if parent is None:
+                        continue
+                    path = os.path.join(parent, name) if name else parent
+                    depth = len(os.path.relpath(parent, self.jobs_root).split(os.sep))
+                    if parent == os.path.abspath(self.jobs_root):
+                        if mask & IN_ISDIR and name.isdigit():
+                            watch_user(path)
+                    elif depth == 1:
+                        if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                            watch_job(path)
+                        elif mask & IN_DELETE:
+                            self.check(path)
+                    elif name == "status" or mask & IN_DELETE_SELF:
+                        self.check(parent)
+                except Exception as e:
+                    logger.error(f"Status watcher error: {e}")
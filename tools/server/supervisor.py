@@ -0,0 +1,301 @@
+import datetime
+import json
+import logging
+import os
+import signal
+import socket
+import subprocess as sp
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Set
+
+logger = logging.getLogger(__name__)
+
+# Model process supervisor.
+#
+# Every model process is started through a ModelSupervisor, which owns
+# it until it exits: a thread per process waits for it (with wait4, so
+# that its resource use comes back with its exit status), so children
+# are reaped as soon as they exit instead of lingering as zombies that
+# keep the executable busy.  Optional nice levels and CPU affinity are
+# applied when a process starts.
+#
+# Each run leaves a record in the job's runs/ directory: written when
+# the model starts, and completed with the exit code (or signal), wall
+# and CPU times and peak memory use when it exits.
+
+RUNS_DIRNAME = "runs"
+
+
+def parse_cpu_list(spec: Optional[str]) -> Optional[Set[int]]:
+    """
+    CPUs from a list such as "0-3,6" (None for an empty spec).
+
+    :raises ValueError: if the list is malformed.
+    """
+    if not spec or not spec.strip():
+        return None
+    cpus = set()
+    for part in spec.split(","):
+        first, _, last = part.strip().partition("-")
+        cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def _now() -> str:
+    return datetime.datetime.utcnow().isoformat(timespec="seconds") + "Z"
+
+
+def _write_json(path: str, data: dict) -> None:
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as fp:
+        json.dump(data, fp, indent=2)
+    os.replace(tmp_path, path)
+
+
+def read_run_records(job_path: str, limit: Optional[int] = None) -> List[dict]:
+    """
+    A job's run records, newest first.
+    """
+    runs_dir = os.path.join(job_path, RUNS_DIRNAME)
+    try:
+        names = sorted((n for n in os.listdir(runs_dir) if n.endswith(".json")), reverse=True)
+    except OSError:
+        return []
+    records = []
+    for name in names[:limit]:
+        try:
+            with open(os.path.join(runs_dir, name)) as fp:
+                records.append(json.load(fp))
+        except (OSError, ValueError):
+            continue
+    return records
+
+
+class SupervisedProcess:
+    """
+    A model process owned by a ModelSupervisor.  Has the parts of the
+    Popen interface that the run schedulers use (poll, wait, kill,
+    returncode, pid).
+    """
+
+    def __init__(self, popen: sp.Popen, record: dict, record_path: Optional[str]) -> None:
+        self.popen = popen
+        self.pid = popen.pid
+        self.record = record
+        self.record_path = record_path
+        self.returncode: Optional[int] = None
+        self.started = time.monotonic()
+        self.exited = threading.Event()
+        self.lock = threading.Lock()
+
+    def poll(self) -> Optional[int]:
+        return self.returncode
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[int]:
+        """
+        :raises subprocess.TimeoutExpired: if the process is still running after timeout.
+        """
+        if not self.exited.wait(timeout):
+            raise sp.TimeoutExpired(self.popen.args, timeout)
+        return self.returncode
+
+    def send_signal(self, sig: int) -> None:
+        # Not once the process has been reaped: its PID may have been reused.
+        with self.lock:
+            if self.returncode is None:
+                try:
+                    os.kill(self.pid, sig)
+                except ProcessLookupError:
+                    pass
+
+    def terminate(self) -> None:
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self) -> None:
+        self.send_signal(getattr(signal, "SIGKILL", signal.SIGTERM))
+
+
+class ModelSupervisor:
+    """
+    Starts, reaps and accounts for model processes.
+    """
+
+    def __init__(
+        self,
+        nice: Optional[int] = None,
+        cpu_affinity: Optional[Set[int]] = None,
+        record_runs: bool = True,
+    ) -> None:
+        """
+        :param nice: Nice level for model processes.
+        :param cpu_affinity: CPUs model processes may run on (Linux only).
+        :param record_runs: Write run records to the jobs' runs/ directories.
+        """
+        self.nice = nice
+        self.cpu_affinity = cpu_affinity
+        self.record_runs = record_runs
+        self.processes: Dict[int, SupervisedProcess] = {}
+        self.listeners: List[Callable[[SupervisedProcess], None]] = []
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "ModelSupervisor":
+        """
+        Settings from CTOASTER_MODEL_NICE and CTOASTER_MODEL_CPUS ("0-3,6").
+        """
+        nice = os.environ.get("CTOASTER_MODEL_NICE")
+        return cls(
+            nice=int(nice) if nice else None,
+            cpu_affinity=parse_cpu_list(os.environ.get("CTOASTER_MODEL_CPUS")),
+        )
+
+    def add_listener(self, fn: Callable[[SupervisedProcess], None]) -> None:
+        """
+        Call fn(process) whenever a model process exits.
+        """
+        self.listeners.append(fn)
+
+    def running(self) -> List[SupervisedProcess]:
+        with self.lock:
+            return list(self.processes.values())
+
+    def start(
+        self, argv: Sequence[str], job_path: str, log_path: str, info: Optional[dict] = None
+    ) -> SupervisedProcess:
+        """
+        Start a model process in a job directory, with its output
+        appended to log_path.
+
+        :param info: Extra fields for the run record.
+        """
+        with open(log_path, "a") as log_file:
+            popen = sp.Popen(list(argv), cwd=job_path, stdout=log_file, stderr=sp.STDOUT)
+        self._apply_limits(popen.pid)
+
+        record = {
+            "run": None,
+            "job_path": job_path,
+            "command": list(argv),
+            "host": socket.gethostname(),
+            "pid": popen.pid,
+            "nice": self.nice,
+            "cpu_affinity": sorted(self.cpu_affinity) if self.cpu_affinity else None,
+            "state": "RUNNING",
+            "started_at": _now(),
+            **(info or {}),
+        }
+        record_path = self._new_record(job_path, record) if self.record_runs else None
+        proc = SupervisedProcess(popen, record, record_path)
+        with self.lock:
+            self.processes[proc.pid] = proc
+        threading.Thread(target=self._wait, args=(proc,), name=f"model-{proc.pid}", daemon=True).start()
+        return proc
+
+    def _apply_limits(self, pid: int) -> None:
+        # Set from here rather than in the child (preexec_fn isn't safe
+        # in a threaded process); the model has barely started by then.
+        if self.nice is not None:
+            try:
+                os.setpriority(os.PRIO_PROCESS, pid, self.nice)
+            except (OSError, AttributeError) as e:
+                logger.warning(f"Could not set nice level {self.nice} for PID {pid}: {e}")
+        if self.cpu_affinity:
+            try:
+                os.sched_setaffinity(pid, self.cpu_affinity)
+            except (OSError, AttributeError) as e:
+                logger.warning(f"Could not set CPU affinity for PID {pid}: {e}")
+
+    def _new_record(self, job_path: str, record: dict) -> Optional[str]:
+        runs_dir = os.path.join(job_path, RUNS_DIRNAME)
+        try:
+            os.makedirs(runs_dir, exist_ok=True)
+            numbers = [int(n[:-5]) for n in os.listdir(runs_dir) if n.endswith(".json") and n[:-5].isdigit()]
+            record["run"] = max(numbers, default=0) + 1
+            path = os.path.join(runs_dir, f"{record['run']:04d}.json")
+            _write_json(path, record)
+            return path
+        except OSError as e:
+            logger.error(f"Could not write run record in {runs_dir}: {e}")
+            return None
+
+    def _wait(self, proc: SupervisedProcess) -> None:
+        rusage = None
+        if hasattr(os, "wait4"):
+            while True:
+                try:
+                    _, status, rusage = os.wait4(proc.pid, 0)
+                    break
+                except InterruptedError:
+                    continue
+                except ChildProcessError:
+                    status = None  # Reaped elsewhere
+                    break
+            returncode = os.waitstatus_to_exitcode(status) if status is not None else proc.popen.poll()
+        else:
+            returncode = proc.popen.wait()
+        wall = time.monotonic() - proc.started
+        with proc.lock:
+            proc.returncode = returncode
+            proc.popen.returncode = returncode  # Stop Popen reaping the PID itself
+        with self.lock:
+            self.processes.pop(proc.pid, None)
+
+        record = proc.record
+        record["finished_at"] = _now()
+        record["wall_seconds"] = round(wall, 3)
+        if returncode is not None and returncode < 0:
+            record["state"] = "KILLED"
+            record["signal"] = -returncode
+            record["exit_code"] = None
+        else:
+            record["state"] = "EXITED"
+            record["exit_code"] = returncode
+        if rusage is not None:
+            record["user_cpu_seconds"] = round(rusage.ru_utime, 3)
+            record["system_cpu_seconds"] = round(rusage.ru_stime, 3)
+            # ru_maxrss is in kilobytes, except on macOS (bytes).  On
+            # Linux it can include the forking process's memory from
+            # before the exec, so small models may show the server's size.
+            scale = 1 if sys.platform == "darwin" else 1024
+            record["max_rss_bytes"] = rusage.ru_maxrss * scale
+        record["last_status"] = self._last_status(record["job_path"])
+        if proc.record_path:
+            try:
+                _write_json(proc.record_path, record)
+            except OSError as e:
+                logger.error(f"Could not update run record {proc.record_path}: {e}")
+        logger.info(
+            f"Model PID {proc.pid} in {record['job_path']} finished: {record['state']} "
+            f"(exit code {record.get('exit_code')}, {wall:.1f} s)"
+        )
+        proc.exited.set()
+        for fn in self.listeners:
+            try:
+                fn(proc)
+            except Exception as e:
+                logger.error(f"Model exit listener failed: {e}")
+
+    @staticmethod
+    def _last_status(job_path: str) -> Optional[str]:
+        try:
+            with open(os.path.join(job_path, "status")) as fp:
+                return fp.readline().strip() or None
+        except OSError:
+            return None
+
+
+_default_supervisor: Optional[ModelSupervisor] = None
+_default_lock = threading.Lock()
+
+
+def default_supervisor() -> ModelSupervisor:
+    """
+    The process-wide supervisor (configured from the environment).
+    """
+    global _default_supervisor
+    with _default_lock:
+        if _default_supervisor is None:
+            _default_supervisor = ModelSupervisor.from_env()
+        return _default_supervisor
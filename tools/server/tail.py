@@ -0,0 +1,308 @@
+import asyncio
+import codecs
+import logging
+import os
+from typing import AsyncIterator, BinaryIO, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Shared file tailer for the streaming endpoints.
+#
+# Every client following a file (a job's run.log, a series file being
+# plotted) used to open it and poll it on its own.  Instead, one task
+# per followed file polls it and keeps the latest block of new lines in
+# memory; followers are woken when it grows and take that block from
+# memory if they are up to date, or read what they have missed from the
+# file themselves if they are behind (e.g. a client resuming from an
+# earlier offset, or one too slow to keep up).  Only complete lines are
+# handed out, except that a line longer than the block size (a very
+# long Fortran line, binary junk) goes out a block at a time rather
+# than holding everyone up.  Every block comes with the byte offset of
+# its end, which the endpoints send as SSE event IDs so that a
+# reconnecting client can resume where it left off via Last-Event-ID.
+# When the job has finished the tailer makes one last read, followers
+# drain what is left and their streams end.  Reads, and the check for a
+# finished job, run in a thread pool rather than on the event loop.
+
+
+def last_line_end(path: str, block_size: int = 65536) -> int:
+    """
+    Offset just after the last newline in a file (0 if none or no file).
+    """
+    try:
+        with open(path, "rb") as fp:
+            end = fp.seek(0, os.SEEK_END)
+            pos = end
+            while pos > 0:
+                start = max(0, pos - block_size)
+                fp.seek(start)
+                block = fp.read(pos - start)
+                i = block.rfind(b"\n")
+                if i >= 0:
+                    return start + i + 1
+                pos = start
+    except OSError:
+        pass
+    return 0
+
+
+def read_range(path: str, offset: int, length: Optional[int] = None) -> Tuple[str, int, int]:
+    """
+    Read part of a text file.  A UTF-8 character split by the end of
+    the range is left for the next read.
+
+    :param length: Maximum bytes to read (None: to the end of the file).
+    :return: (text, offset after the text, file size)
+    """
+    with open(path, "rb") as fp:
+        size = os.fstat(fp.fileno()).st_size
+        offset = min(offset, size)
+        fp.seek(offset)
+        data = fp.read(size - offset if length is None else min(length, size - offset))
+    decoder = codecs.getincrementaldecoder("utf-8")("replace")
+    text = decoder.decode(data, final=offset + len(data) == size)
+    return text, offset + len(data) - len(decoder.getstate()[0]), size
+
+
+def last_lines_offset(path: str, lines: int, block_size: int = 65536) -> int:
+    """
+    Offset of the start of the last `lines` lines of a file, found by
+    scanning backwards from the end a block at a time.  An unterminated
+    last line counts as a line.
+    """
+    with open(path, "rb") as fp:
+        end = fp.seek(0, os.SEEK_END)
+        if lines <= 0 or end == 0:
+            return end
+        fp.seek(end - 1)
+        if fp.read(1) == b"\n":
+            end -= 1  # The final newline ends the last line; don't count it.
+        while end > 0:
+            start = max(0, end - block_size)
+            fp.seek(start)
+            block = fp.read(end - start)
+            i = len(block)
+            while True:
+                i = block.rfind(b"\n", 0, i)
+                if i < 0:
+                    break
+                lines -= 1
+                if lines == 0:
+                    return start + i + 1
+            end = start
+    return 0
+
+
+def split_lines(data: bytes) -> List[bytes]:
+    """
+    The lines in a block from the tailer (without their newlines).  A
+    block that doesn't end with a newline is part of an over-long line;
+    that part comes out as a line of its own.
+    """
+    lines = data.split(b"\n")
+    return lines[:-1] if lines[-1] == b"" else lines
+
+
+def parse_event_id(last_event_id: Optional[str]) -> Optional[int]:
+    """
+    Byte offset from a Last-Event-ID header, or None if there isn't a valid one.
+    """
+    if last_event_id and last_event_id.strip().isdigit():
+        return int(last_event_id.strip())
+    return None
+
+
+class _Tail:
+    def __init__(self, path: str, pos: int, is_done: Optional[Callable[[], bool]]) -> None:
+        self.path = path
+        self.pos = pos  # End of the complete lines read so far.
+        self.is_done = is_done
+        self.done = False
+        self.last: Tuple[int, int, bytes] = (pos, pos, b"")  # (start, end, data)
+        self.followers = 0
+        self.changed = asyncio.Condition()
+        self.task: Optional[asyncio.Task] = None
+
+
+class TailHub:
+    """
+    One polling task per followed file, shared by all of its followers.
+    """
+
+    def __init__(self, interval: float = 0.5, block_size: int = 65536, pools=None) -> None:
+        """
+        :param interval: Seconds between checks of a file for new data.
+        :param block_size: Maximum bytes read from a file at a time.
+        :param pools: BlockingPools to read files and call is_done() in
+            (its "io" pool); the loop's default executor if not given.
+        """
+        self.interval = interval
+        self.block_size = block_size
+        self.pools = pools
+        self.tails: Dict[str, _Tail] = {}
+
+    def tail_count(self) -> int:
+        return len(self.tails)
+
+    def follower_count(self) -> int:
+        return sum(t.followers for t in self.tails.values())
+
+    async def follow(
+        self,
+        path: str,
+        offset: Optional[int] = None,
+        is_done: Optional[Callable[[], bool]] = None,
+    ) -> AsyncIterator[Tuple[int, bytes]]:
+        """
+        Follow a file, yielding (end offset, complete lines) as it grows.
+
+        :param offset: Where to start (None: at the end of the file).
+        :param is_done: Called when the file has stopped growing; once
+            it returns True, the file is read one last time and the
+            iteration ends.
+        """
+        path = os.path.abspath(path)
+        tail = self.tails.get(path)
+        if tail is None:
+            pos = await self._blocking(last_line_end, path)
+            tail = self.tails.get(path)  # (Another follower may have got there first.)
+            if tail is None:
+                tail = _Tail(path, pos, is_done)
+                self.tails[path] = tail
+                tail.task = asyncio.get_running_loop().create_task(self._run(tail))
+        tail.followers += 1
+        mine = tail.pos if offset is None or offset > tail.pos else offset
+        try:
+            while True:
+                if mine > tail.pos:
+                    mine = 0  # File was truncated and rewritten.
+                if mine < tail.pos:
+                    start, end, data = tail.last
+                    if start == mine:
+                        mine = end
+                        yield end, data
+                    else:
+                        # Behind: catch up from the file, in blocks.
+                        async for end, data in self._read(path, mine, tail.pos):
+                            mine = end
+                            yield end, data
+                    continue
+                if tail.done:
+                    return
+                async with tail.changed:
+                    if mine == tail.pos and not tail.done:
+                        await tail.changed.wait()
+        finally:
+            tail.followers -= 1
+
+    async def _read(self, path: str, start: int, end: int) -> AsyncIterator[Tuple[int, bytes]]:
+        try:
+            fp = await self._blocking(open, path, "rb")
+        except OSError:
+            return
+        with fp:
+            pos = start
+            while pos < end:
+                block = await self._blocking(self._read_block, fp, pos, end)
+                if not block:
+                    return
+                pos += len(block)
+                yield pos, block
+
+    def _read_block(self, fp: BinaryIO, pos: int, end: int) -> bytes:
+        fp.seek(pos)
+        block = fp.read(min(self.block_size, end - pos))
+        if not block:
+            return block
+        i = block.rfind(b"\n")
+        if i < 0:
+            # Part of a line longer than the block size, which the tailer
+            # hands out a block at a time too.
+            return block
+        return block[: i + 1]
+
+    async def _blocking(self, fn: Callable, *args):
+        # File access and is_done() (which may read status files or a
+        # database) are kept off the event loop.
+        if self.pools is not None:
+            return await self.pools.run("io", fn, *args)
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    async def _run(self, tail: _Tail) -> None:
+        fp = None
+        try:
+            while tail.followers > 0:
+                fp, data = await self._read_new(tail, fp)
+                if data:
+                    await self._publish(tail, tail.pos, tail.pos + len(data), data)
+                    continue
+                if tail.is_done is not None and await self._blocking(tail.is_done):
+                    # The writer has finished: pick up its last lines.
+                    while True:
+                        fp, data = await self._read_new(tail, fp)
+                        if not data:
+                            break
+                        await self._publish(tail, tail.pos, tail.pos + len(data), data)
+                    tail.done = True
+                    async with tail.changed:
+                        tail.changed.notify_all()
+                    break
+                await asyncio.sleep(self.interval)
+        except Exception as e:
+            logger.error(f"Tailer for {tail.path} failed: {e}")
+            tail.done = True
+            async with tail.changed:
+                tail.changed.notify_all()
+        finally:
+            if fp is not None:
+                fp.close()
+            if self.tails.get(tail.path) is tail:
+                del self.tails[tail.path]
+
+    async def _publish(self, tail: _Tail, start: int, end: int, data: bytes) -> None:
+        async with tail.changed:
+            tail.last = (start, end, data)
+            tail.pos = end
+            tail.changed.notify_all()
+        await asyncio.sleep(0)  # Let followers take the block.
+
+    async def _read_new(self, tail: _Tail, fp):
+        # The complete lines after tail.pos, with the file (re)opened
+        # first if need be.  A file that has been replaced or has shrunk
+        # is read from the start again.
+        fp, reset, data = await self._blocking(self._poll, tail.path, tail.pos, fp)
+        if reset:
+            tail.pos = 0
+            tail.last = (0, 0, b"")
+        return fp, data
+
+    def _poll(self, path: str, pos: int, fp) -> Tuple[Optional[BinaryIO], bool, bytes]:
+        fp, reset = self._reopen(path, pos, fp)
+        if fp is None:
+            return None, reset, b""
+        fp.seek(0 if reset else pos)
+        data = fp.read(self.block_size)
+        if len(data) == self.block_size and b"\n" not in data:
+            # All of it one line, still going: hand it out as it is, or
+            # the position would never move on.
+            return fp, reset, data
+        return fp, reset, data[: data.rfind(b"\n") + 1]
+
+    @staticmethod
+    def _reopen(path: str, pos: int, fp) -> Tuple[Optional[BinaryIO], bool]:
+        # (Re)open the file if it has appeared, been replaced or shrunk;
+        # and whether it has to be read from the start again.
+        try:
+            st = os.stat(path)
+        except OSError:
+            return fp, False
+        if fp is not None:
+            fst = os.fstat(fp.fileno())
+            if fst.st_ino == st.st_ino and st.st_size >= pos:
+                return fp, False
+            fp.close()
+        reset = fp is not None or st.st_size < pos
+        try:
+            return open(path, "rb"), reset
+        except OSError:
+            return None, reset
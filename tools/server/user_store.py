@@ -0,0 +1,189 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from tools.server.status_watch import is_network_filesystem
+
+logger = logging.getLogger(__name__)
+
+# User account storage for the REST API.
+#
+# Every authenticated request looks its user up, so connections are
+# kept open (one per thread, as sqlite3 connections can't be shared
+# between threads) rather than opened per query, and user rows are
+# cached for a short time.  The cache is cleared for a user whenever
+# this process changes them; changes made by other replicas show up
+# once the cached entry expires.  WAL journaling is used when the
+# database is on a local filesystem.  On a network filesystem (the
+# jobs PVC is NFS) WAL's shared-memory index isn't safe between hosts,
+# so the default rollback journal is kept there.
+
+USER_COLUMNS = ("id", "email", "password_hash", "salt", "created_at")
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire after a fixed time.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self.lock:
+            self.entries[key] = (expires, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self.entries)
+
+
+class UserStore:
+    """
+    The users table, with per-thread connections and a cache of user rows.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        cache_size: int = 1024,
+        cache_ttl: float = 30.0,
+        wal: Optional[bool] = None,
+    ) -> None:
+        """
+        :param db_path: Path of the user database.
+        :param cache_size: Number of user rows cached.
+        :param cache_ttl: Seconds a cached user row is trusted for.
+        :param wal: Use WAL journaling (None: if not on a network filesystem).
+        """
+        self.db_path = db_path
+        dir_path = os.path.dirname(db_path)
+        if dir_path:
+            os.makedirs(dir_path, exist_ok=True)
+        self.wal = (not is_network_filesystem(dir_path or ".")) if wal is None else wal
+        self.local = threading.local()
+        self.users = TTLCache(cache_size, cache_ttl)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            if self.wal:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def _execute(self, sql: str, params=()) -> sqlite3.Cursor:
+        try:
+            return self._connect().execute(sql, params)
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e) or "busy" in str(e):
+                raise
+            # The connection may have gone bad (e.g. the file was
+            # replaced): reopen it and try once more.
+            self.close()
+            return self._connect().execute(sql, params)
+
+    def close(self) -> None:
+        """
+        Close this thread's connection.
+        """
+        conn = getattr(self.local, "conn", None)
+        if conn is not None:
+            self.local.conn = None
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    def init(self) -> None:
+        self._execute(
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                email TEXT UNIQUE NOT NULL,
+                password_hash TEXT NOT NULL,
+                salt TEXT NOT NULL,
+                created_at TEXT NOT NULL
+            )
+            """
+        )
+        self._connect().commit()
+
+    def _row(self, where: str, value) -> Optional[dict]:
+        # fetchall() so that the statement finishes and releases its lock.
+        rows = self._execute(
+            f"SELECT {', '.join(USER_COLUMNS)} FROM users WHERE {where} = ?", (value,)
+        ).fetchall()
+        return dict(zip(USER_COLUMNS, rows[0])) if rows else None
+
+    def get_by_id(self, user_id: int) -> Optional[dict]:
+        user = self.users.get(user_id)
+        if user is None:
+            user = self._row("id", user_id)
+            if user is not None:
+                self.users.set(user_id, user)
+        return dict(user) if user else None
+
+    def get_by_email(self, email: str) -> Optional[dict]:
+        # Only used at login and registration, so not cached.
+        return self._row("email", email)
+
+    def create(self, email: str, password_hash: str, salt: str, created_at: str) -> int:
+        """
+        Add a user.
+        :raises sqlite3.IntegrityError: if the email address is taken.
+        """
+        conn = self._connect()
+        try:
+            cur = conn.execute(
+                "INSERT INTO users (email, password_hash, salt, created_at) VALUES (?, ?, ?, ?)",
+                (email, password_hash, salt, created_at),
+            )
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        self.invalidate(cur.lastrowid)
+        return cur.lastrowid
+
+    def invalidate(self, user_id: Optional[int] = None) -> None:
+        """
+        Forget a cached user (or all of them).
+        """
+        if user_id is None:
+            self.users.clear()
+        else:
+            self.users.pop(user_id)
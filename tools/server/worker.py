@@ -0,0 +1,79 @@
+import argparse
+import logging
+import os
+import signal
+import sys
+
+from tools import utils as U
+from tools.server.launch import launch_model
+from tools.server.metrics import MetricsRegistry, ModelMetrics, serve_metrics
+from tools.server.run_queue import RUN_QUEUE_FILENAME, RunQueue, RunWorker
+from tools.server.supervisor import default_supervisor
+
+# Stand-alone model worker: claims runs from the shared run queue on
+# the jobs volume and runs them.  Start with
+#
+#   python -m tools.server.worker --slots 1
+#
+# from the cTOASTER root directory.  Model metrics (runs, progress,
+# exits) are served in the Prometheus text format at
+# http://<host>:<metrics port>/metrics; as for the REST API, scrapers
+# must send CTOASTER_METRICS_TOKEN as a bearer token if it is set.
+
+
+def main() -> None:
+    if not U.read_ctoaster_config():
+        sys.exit("cTOASTER not set up: run the setup-ctoaster script!")
+
+    parser = argparse.ArgumentParser(description="Run queued cTOASTER model jobs.")
+    parser.add_argument(
+        "--slots",
+        type=int,
+        default=int(os.environ.get("CTOASTER_RUN_SLOTS", "1")),
+        help="Maximum number of model runs at once",
+    )
+    parser.add_argument(
+        "--lease",
+        type=float,
+        default=float(os.environ.get("CTOASTER_RUN_LEASE", "60")),
+        help="Run lease duration in seconds",
+    )
+    parser.add_argument(
+        "--poll", type=float, default=2.0, help="Seconds between queue checks"
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=int(os.environ.get("CTOASTER_METRICS_PORT", "9100")),
+        help="Port to serve /metrics on (0: don't)",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    per_user = os.environ.get("CTOASTER_RUN_SLOTS_PER_USER")
+    queue = RunQueue(
+        os.path.join(U.ctoaster_jobs, RUN_QUEUE_FILENAME),
+        per_user_slots=int(per_user) if per_user else None,
+    )
+    worker = RunWorker(
+        queue,
+        launch_model,
+        slots=args.slots,
+        lease_seconds=args.lease,
+        poll_interval=args.poll,
+    )
+    if args.metrics_port:
+        registry = MetricsRegistry()
+        model_metrics = ModelMetrics(registry, U.ctoaster_jobs)
+        default_supervisor().add_listener(model_metrics.count_exit)
+        # The queue length comes from the API pods, not from every worker.
+        registry.add_collector(
+            lambda: model_metrics.update(worker.running_count(), worker.running_paths())
+        )
+        serve_metrics(registry, args.metrics_port, token=os.environ.get("CTOASTER_METRICS_TOKEN"))
+    signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+    worker.run_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import asyncio
+
+from tools.server.channel import Channel, ChannelError, merge_updates, update_size
+
+# Update coalescing and credit-based flow control of the /ws channel.
+#
+#   python -m pytest tools/tests
+
+
+def test_merge_updates():
+    merged = merge_updates(
+        {"lines": ["a"], "jobs": {"j1": 1, "j2": 2}, "offset": 10},
+        {"lines": ["b", "c"], "jobs": {"j2": 3}, "offset": 20},
+    )
+    assert merged == {"lines": ["a", "b", "c"], "jobs": {"j1": 1, "j2": 3}, "offset": 20}
+
+
+def test_merge_updates_leaves_inputs_alone():
+    old = {"lines": ["a"]}
+    merge_updates(old, {"lines": ["b"]})
+    assert old == {"lines": ["a"]}
+
+
+def test_update_size():
+    assert update_size({"lines": ["a", "b"], "offset": 2}) == 2
+    assert update_size({"offset": 2}) == 1
+
+
+def test_channel_credit_and_coalescing():
+    async def main():
+        sent = []
+        first_sent = asyncio.Event()
+        release = asyncio.Event()
+
+        async def source():
+            yield {"lines": ["0"], "offset": 0}
+            await first_sent.wait()
+            for i in range(1, 5):
+                yield {"lines": [str(i)], "offset": i}
+            await release.wait()
+
+        async def send(message):
+            sent.append(message)
+            first_sent.set()
+
+        channel = Channel(send)
+        channel.subscribe("a", source(), credit=1)
+        with_error = False
+        try:
+            channel.subscribe("a", source())
+        except ChannelError:
+            with_error = True
+        await asyncio.sleep(0.05)
+        first = list(sent)
+        await channel.grant("a", 1)
+        release.set()
+        await asyncio.sleep(0.05)
+        return with_error, first, sent
+
+    with_error, first, sent = asyncio.run(main())
+    assert with_error
+    # One message for the one credit; the rest coalesced into the next
+    assert len(first) == 1 and first[0]["lines"] == ["0"]
+    assert sent[1]["lines"] == ["1", "2", "3", "4"] and sent[1]["offset"] == 4
+    assert sent[-1] == {"type": "end", "id": "a"}
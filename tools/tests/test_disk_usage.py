@@ -0,0 +1,43 @@
+import pytest
+
+from tools.server.disk_usage import QUOTA_HARD, QUOTA_OK, QUOTA_SOFT, parse_size, quota_state
+
+# Quota sizes and states.
+#
+#   python -m pytest tools/tests
+
+
+@pytest.mark.parametrize(
+    "text, size",
+    [
+        ("1048576", 1048576),
+        ("500M", 500 << 20),
+        ("500m", 500 << 20),
+        ("2Gi", 2 << 30),
+        ("2GiB", 2 << 30),
+        ("2GB", 2 << 30),
+        ("1.5K", 1536),
+        (" 1T ", 1 << 40),
+        ("10B", 10),
+        (None, None),
+        ("", None),
+        ("  ", None),
+    ],
+)
+def test_parse_size(text, size):
+    assert parse_size(text) == size
+
+
+@pytest.mark.parametrize("text", ["M", "lots", "5X", "1..5G"])
+def test_parse_size_rejects_malformed(text):
+    with pytest.raises(ValueError):
+        parse_size(text)
+
+
+def test_quota_state():
+    assert quota_state(10, None, None) == QUOTA_OK
+    assert quota_state(10, 20, 30) == QUOTA_OK
+    assert quota_state(20, 20, 30) == QUOTA_SOFT
+    assert quota_state(30, 20, 30) == QUOTA_HARD
+    assert quota_state(30, None, 30) == QUOTA_HARD
+    assert quota_state(25, 20, None) == QUOTA_SOFT
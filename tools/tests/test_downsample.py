@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from tools.server.downsample import (
+    downsample,
+    downsample_indices,
+    lttb_indices,
+    minmax_buckets,
+    minmax_indices,
+)
+
+# Invariants of the plot data downsampling: never more than max_points
+# points, indices strictly increasing, the end points kept.
+#
+#   python -m pytest tools/tests
+
+
+def _series(n, seed=0):
+    rng = np.random.default_rng(seed)
+    x = np.cumsum(rng.uniform(0.5, 1.5, n))
+    y = np.cumsum(rng.normal(size=n))
+    return x, y
+
+
+@pytest.mark.parametrize("fn", [lttb_indices, minmax_indices])
+@pytest.mark.parametrize("n", [3, 4, 5, 10, 101, 1000])
+@pytest.mark.parametrize("max_points", [3, 4, 5, 7, 10, 100, 2000])
+def test_indices_within_max_points(fn, n, max_points):
+    x, y = _series(n)
+    idx = fn(x, y, max_points)
+    assert len(idx) <= max_points
+    assert np.all(np.diff(idx) > 0)
+    assert idx[0] == 0 and idx[-1] == n - 1
+    if max_points >= n:
+        assert len(idx) == n
+
+
+def test_minmax_keeps_spikes():
+    x = np.arange(1000.0)
+    y = np.zeros(1000)
+    y[123], y[789] = 50.0, -50.0
+    idx = minmax_indices(x, y, 20)
+    assert 123 in idx and 789 in idx
+
+
+def test_downsample_rejects_unknown_method():
+    x, y = _series(10)
+    with pytest.raises(ValueError):
+        downsample(x, y, 5, "median")
+
+
+def test_minmax_buckets():
+    x = np.arange(10.0)
+    y = np.array([3, 1, 2, 9, 0, 5, 4, 4, 8, 7], dtype=float)
+    t, v = minmax_buckets(x, y, 5)
+    assert list(t) == [3, 4, 6, 8]
+    assert list(v) == [9, 0, 4, 8]
+
+
+@pytest.mark.parametrize("method", ["lttb", "minmax"])
+@pytest.mark.parametrize("n", [4, 10, 57, 500])
+@pytest.mark.parametrize("max_points", [3, 4, 5, 6, 9, 20])
+@pytest.mark.parametrize("ncolumns", [1, 2, 3, 7])
+def test_downsample_indices_within_max_points(method, n, max_points, ncolumns):
+    x, _ = _series(n)
+    columns = [_series(n, seed)[1] for seed in range(1, ncolumns + 1)]
+    columns[0][1::3] = np.nan  # Gaps, so a column's end points aren't the series'
+    idx = downsample_indices(x, columns, max_points, method)
+    assert len(idx) <= max_points
+    assert np.all(np.diff(idx) > 0)
+    assert idx[0] == 0 and idx[-1] == n - 1 or max_points >= n
+
+
+def test_downsample_indices_example():
+    # n=10, max_points=3 used to give 5 indices
+    x = np.arange(10.0)
+    idx = downsample_indices(x, [np.sin(x), np.cos(x)], 3)
+    assert len(idx) <= 3
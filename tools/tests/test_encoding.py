@@ -0,0 +1,48 @@
+import numpy as np
+
+from tools.server.encoding import (
+    COLUMNS_TYPE,
+    JSON_TYPE,
+    negotiate,
+    pack_columns,
+    unpack_columns,
+)
+
+# Content negotiation and the raw columns format.
+#
+#   python -m pytest tools/tests
+
+
+def test_negotiate_defaults_to_first_offer():
+    assert negotiate(None, [JSON_TYPE, COLUMNS_TYPE]) == JSON_TYPE
+    assert negotiate("", [JSON_TYPE, COLUMNS_TYPE]) == JSON_TYPE
+
+
+def test_negotiate_picks_highest_q():
+    offers = [JSON_TYPE, COLUMNS_TYPE]
+    assert negotiate(COLUMNS_TYPE, offers) == COLUMNS_TYPE
+    assert negotiate(f"{JSON_TYPE};q=0.5, {COLUMNS_TYPE}", offers) == COLUMNS_TYPE
+    assert negotiate(f"{JSON_TYPE}, {COLUMNS_TYPE}", offers) == JSON_TYPE  # Tie
+    assert negotiate("*/*", offers) == JSON_TYPE
+    assert negotiate(f"application/*;q=0.2, {COLUMNS_TYPE};q=0.8", offers) == COLUMNS_TYPE
+
+
+def test_negotiate_none_acceptable():
+    offers = [JSON_TYPE, COLUMNS_TYPE]
+    assert negotiate("text/html", offers) is None
+    assert negotiate(f"{JSON_TYPE};q=0, {COLUMNS_TYPE};q=0", offers) is None
+    assert negotiate("gzip;q=0, br", ["br", "gzip"]) == "br"
+    assert negotiate("identity", ["br", "gzip"]) is None
+
+
+def test_columns_round_trip():
+    t = np.arange(5.0)
+    v = np.array([1.5, np.nan, -2.0, 3.25, 1e300])
+    data = pack_columns({"variable": "x", "rows": 5}, [("time", t), ("x", v), ("empty", np.empty(0))])
+    assert (4 + int.from_bytes(data[:4], "little")) % 8 == 0  # Data 8-byte aligned
+    header, columns = unpack_columns(data)
+    assert header["variable"] == "x" and header["rows"] == 5
+    assert header["arrays"] == [["time", 5], ["x", 5], ["empty", 0]]
+    np.testing.assert_array_equal(columns["time"], t)
+    np.testing.assert_array_equal(columns["x"], v)
+    assert len(columns["empty"]) == 0
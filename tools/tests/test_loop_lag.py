@@ -0,0 +1,56 @@
+import json
+import os
+import subprocess as sp
+import sys
+
+# Regression test for event loop blocking in the REST API.
+#
+# Drives concurrent logins (password hashing), setup saves and job
+# downloads (zip compression) through the app in-process, with the
+# benchmark harness, and checks how late the API's LoopLagMonitor saw
+# its timers fire.  Any of these done on the event loop instead of in
+# the thread pools stalls the loop for hundreds of milliseconds.
+#
+#   python -m pytest tools/tests
+
+CTOASTER_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Worst event loop lag allowed, in milliseconds (around 30 ms when
+# nothing blocks the loop).
+MAX_LOOP_LAG_MS = 250
+
+
+def _benchmark(*args: str) -> None:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = CTOASTER_ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    env.pop("CTOASTER_METRICS_TOKEN", None)
+    sp.run(
+        [sys.executable, "-m", "tools.benchmark", *args],
+        cwd=CTOASTER_ROOT,
+        env=env,
+        check=True,
+        stdout=sp.DEVNULL,
+    )
+
+
+def test_loop_lag_under_concurrent_load(tmp_path):
+    root = str(tmp_path / "tree")
+    out = str(tmp_path / "results.json")
+    _benchmark(
+        "generate", "--root", root, "--users", "4", "--jobs", "4",
+        "--rows", "2000", "--log-lines", "200", "--setup-jobs", "2",
+    )
+    _benchmark(
+        "run", "--root", root, "--mix", "only:login,setup,download",
+        "--concurrency", "24", "--duration", "5", "--warmup", "1", "--out", out,
+    )
+    with open(out) as fp:
+        results = json.load(fp)
+
+    for name in ("login", "setup", "download"):
+        scenario = results["scenarios"][name]
+        assert scenario["count"] > 0, f"no {name} requests completed"
+        assert scenario["errors"] == 0, f"{name} requests failed"
+    lag = results["loop_lag"]
+    assert lag is not None, "no loop lag in /metrics"
+    assert lag["max_ms"] < MAX_LOOP_LAG_MS, f"event loop blocked for {lag['max_ms']} ms"
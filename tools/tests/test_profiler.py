@@ -0,0 +1,44 @@
+import pytest
+
+from tools.server.profiler import DEFAULT_SETTINGS, validate_settings
+
+# Checking of the settings sent to the profiler endpoint.
+#
+#   python -m pytest tools/tests
+
+
+def test_validate_settings_accepts_good_values():
+    settings = {"enabled": 1, "routes": ["/setup/{job_name}"], "sample_rate": "0.25", "interval": 0.01}
+    assert validate_settings(settings) == {
+        "enabled": True,
+        "routes": ["/setup/{job_name}"],
+        "sample_rate": 0.25,
+        "interval": 0.01,
+    }
+    assert validate_settings({}) == {}
+    assert validate_settings(dict(DEFAULT_SETTINGS)) == DEFAULT_SETTINGS
+
+
+@pytest.mark.parametrize(
+    "settings",
+    [
+        [],
+        "enabled",
+        {"colour": "red"},
+        {"routes": "/setup"},
+        {"routes": ["setup"]},
+        {"routes": [1]},
+        {"sample_rate": 1.5},
+        {"sample_rate": -0.1},
+        {"sample_rate": "nan"},
+        {"sample_rate": [0.5]},
+        {"sample_rate": True},
+        {"sample_rate": None},
+        {"interval": 0},
+        {"interval": 2},
+        {"interval": "often"},
+    ],
+)
+def test_validate_settings_rejects_bad_values(settings):
+    with pytest.raises(ValueError):
+        validate_settings(settings)
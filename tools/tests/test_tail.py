@@ -0,0 +1,65 @@
+import asyncio
+
+from tools.server.tail import TailHub, parse_event_id, split_lines
+
+# The shared file tailer: event IDs, line splitting, and following a
+# file as it grows.
+#
+#   python -m pytest tools/tests
+
+
+def test_parse_event_id():
+    assert parse_event_id("123") == 123
+    assert parse_event_id(" 42 ") == 42
+    assert parse_event_id(None) is None
+    assert parse_event_id("") is None
+    assert parse_event_id("-1") is None
+    assert parse_event_id("abc") is None
+
+
+def test_split_lines():
+    assert split_lines(b"a\nb\n") == [b"a", b"b"]
+    assert split_lines(b"\n") == [b""]
+    assert split_lines(b"part of a long line") == [b"part of a long line"]
+
+
+def _follow(path, block_size, appends):
+    hub = TailHub(interval=0.01, block_size=block_size)
+    done = []
+
+    async def main():
+        got = []
+
+        async def writer():
+            for data in appends:
+                await asyncio.sleep(0.05)
+                with open(path, "ab") as fp:
+                    fp.write(data)
+            await asyncio.sleep(0.1)
+            done.append(True)
+
+        task = asyncio.get_running_loop().create_task(writer())
+        async for end, data in hub.follow(path, 0, lambda: bool(done)):
+            got.append((end, data))
+        await task
+        return got
+
+    return asyncio.run(main())
+
+
+def test_follow_complete_lines(tmp_path):
+    path = str(tmp_path / "run.log")
+    open(path, "wb").close()
+    got = _follow(path, 64, [b"one\ntw", b"o\nthree\n"])
+    assert b"".join(data for _, data in got) == b"one\ntwo\nthree\n"
+    assert all(data.endswith(b"\n") for _, data in got)
+    assert got[-1][0] == len(b"one\ntwo\nthree\n")
+
+
+def test_follow_line_longer_than_block(tmp_path):
+    # A line longer than the block size must not stall the tailer.
+    path = str(tmp_path / "run.log")
+    open(path, "wb").close()
+    long_line = b"x" * 200
+    got = _follow(path, 64, [long_line, b"\nafter\n"])
+    assert b"".join(data for _, data in got) == long_line + b"\nafter\n"